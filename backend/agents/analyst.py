@@ -1,68 +1,316 @@
 import pandas as pd
+import numpy as np
 import json
 import os
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_experimental.utilities import PythonREPL
 from state import AgentState, WarningSignal
-import re
+from structured import SchemaError, validate_typed
+from llm import DEFAULT_MODEL, invoke as cached_invoke, note_fallback
+from llm_cache import cache_scope
+from prompt_budget import TokenBudgetExceeded
+from telemetry import record, traced
+from sandbox import get_sandbox_pool
+from sales_aggregates import get_sales_aggregates
+import workspaces
+from evidence_index import ALL_KEY, get_evidence_index
+from sales_data import REQUIRED_SALES_COLUMNS, read_sales_columns, iter_sales_chunks, inspect_sales, build_columnar_cache
 
 MAX_RETRIES = 3  # Reduced retries since GPT-4o is more reliable
 
-def extract_evidence_fallback(df, anomaly):
+# Deterministic anomaly engine settings (same rules the LLM prompt describes)
+BASELINE_MONTHS = 3      # Current month is compared to the trailing 3-month average
+DROP_THRESHOLD = -0.20   # Drop > 20% => Revenue Leak
+RISE_THRESHOLD = 0.50    # Rise > 50% => Growth Opportunity
+EVIDENCE_ROWS = 10
+TOP_ANOMALIES = 10
+
+def get_analyst_mode() -> str:
+    """
+    "deterministic" (default): built-in vectorized detector, LLM only if the schema is unknown.
+    "llm": always use the GPT-4o code interpreter loop.
+    """
+    return os.getenv("ANALYST_MODE", "deterministic").strip().lower()
+
+
+@traced("load")
+def detect_anomalies(csv_path: str):
+    """
+    Deterministic anomaly engine (replaces LLM-written pandas code).
+    1. Streams the file in typed chunks, aggregating monthly revenue by Region x Product_Tier per chunk.
+    2. Trailing 3-month baseline via cumulative sums over the segment x month matrix.
+    3. Flags Drop > 20% (Revenue Leak) and Rise > 50% (Growth Opportunity).
+    4. A second streaming pass pulls the top deals of every flagged segment-month as evidence_csv.
+
+    Peak memory is one chunk plus the aggregates, whatever the file size.
+    Returns a list of WarningSignal dicts, or None if the columns don't match the sales schema.
+    """
+    if not all(col in read_sales_columns(csv_path) for col in REQUIRED_SALES_COLUMNS):
+        return None
+
+    parts = []
+    for chunk in iter_sales_chunks(csv_path, columns=REQUIRED_SALES_COLUMNS):
+        part = _monthly_revenue(chunk)
+        if part is not None:
+            parts.append(part)
+    if not parts:
+        return None
+
+    # Segment x Month revenue matrix (missing months count as zero revenue)
+    monthly = pd.concat(parts).groupby(level=[0, 1, 2], sort=True).sum()
+    matrix = monthly.unstack('Month', fill_value=0.0)
+    all_months = pd.period_range(matrix.columns.min(), matrix.columns.max(), freq='M')
+    matrix = matrix.reindex(columns=all_months, fill_value=0.0)
+
+    return evaluate_segment_matrix(
+        matrix, evidence_lookup=lambda segments, periods: _stream_evidence(csv_path, segments, periods)
+    )
+
+
+def _monthly_revenue(chunk: pd.DataFrame):
+    """Revenue per (Region, Product_Tier, Month) of one chunk (summed in float64), or None if no valid dates."""
+    chunk = chunk[chunk['Date'].notna()]
+    if chunk.empty:
+        return None
+    month = chunk['Date'].dt.to_period('M').rename('Month')
+    revenue = chunk['Deal_Size_USD'].astype('float64').fillna(0.0)
+    part = revenue.groupby([chunk['Region'], chunk['Product_Tier'], month], observed=True).sum()
+    # Plain string labels so partial aggregates from chunks with different categories line up
+    part.index = pd.MultiIndex.from_arrays(
+        [part.index.get_level_values(0).astype(str), part.index.get_level_values(1).astype(str), part.index.get_level_values(2)],
+        names=['Region', 'Product_Tier', 'Month']
+    )
+    return part
+
+
+def _stream_evidence(csv_path: str, segments, periods):
+    """Top EVIDENCE_ROWS deals per flagged cell, merged across chunks (ties keep file order)."""
+    evidence = {}
+    for chunk in iter_sales_chunks(csv_path, float_dtype='float64'):
+        chunk = chunk[chunk['Date'].notna()]
+        if chunk.empty:
+            continue
+        found = _segment_month_evidence(chunk, chunk['Date'], chunk['Date'].dt.to_period('M'), segments, periods)
+        for key, rows in found.items():
+            merged = evidence.get(key, []) + rows
+            merged.sort(key=lambda row: -(row.get('Deal_Size_USD') or 0.0))
+            evidence[key] = merged[:EVIDENCE_ROWS]
+    return evidence
+
+
+def evaluate_segment_matrix(matrix: pd.DataFrame, affected: np.ndarray = None, evidence_lookup=None):
+    """
+    Applies the baseline/threshold rules to a (Region, Product_Tier) x Month revenue matrix.
+    - affected: optional boolean mask (same shape); only those cells can be flagged.
+    - evidence_lookup(segments, periods) -> {(region, tier, period): rows} supplies evidence_csv rows.
+    """
+    values = matrix.to_numpy(dtype=float)
+    n_segments, n_months = values.shape
+    if n_months <= BASELINE_MONTHS:
+        return []
+
+    # Trailing mean of the previous BASELINE_MONTHS months (excluding the current one)
+    csum = np.zeros((n_segments, n_months + 1))
+    np.cumsum(values, axis=1, out=csum[:, 1:])
+    baseline = np.full_like(values, np.nan)
+    baseline[:, BASELINE_MONTHS:] = (csum[:, BASELINE_MONTHS:-1] - csum[:, :-BASELINE_MONTHS - 1]) / BASELINE_MONTHS
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(baseline > 0, (values - baseline) / baseline, np.nan)
+
+    flagged = (change < DROP_THRESHOLD) | (change > RISE_THRESHOLD)
+    if affected is not None:
+        flagged &= affected
+    seg_idx, month_idx = np.nonzero(flagged)
+    if len(seg_idx) == 0:
+        return []
+
+    # Rank by absolute USD impact before building evidence, so only reported cells pay for it
+    impact = np.abs(values[seg_idx, month_idx] - baseline[seg_idx, month_idx])
+    order = np.argsort(-impact, kind='stable')[:TOP_ANOMALIES]
+    seg_idx, month_idx = seg_idx[order], month_idx[order]
+
+    segments = matrix.index[seg_idx]
+    periods = matrix.columns[month_idx]
+    evidence = evidence_lookup(segments, periods) if evidence_lookup is not None else {}
+
+    anomalies = []
+    for (region, tier), period, s, m in zip(segments, periods, seg_idx, month_idx):
+        pct = change[s, m]
+        current = values[s, m]
+        base = baseline[s, m]
+        is_drop = pct < 0
+        segment = f"{region} {tier}"
+        anomaly_type = "Revenue Leak" if is_drop else "Growth Opportunity"
+        value = f"{pct * 100:+.1f}%"
+
+        if is_drop:
+            severity = "CRITICAL" if pct <= 2 * DROP_THRESHOLD else "HIGH"
+        else:
+            severity = "HIGH" if pct >= 2 * RISE_THRESHOLD else "MEDIUM"
+
+        rows = evidence.get((region, tier, period), [])
+        anomalies.append({
+            "id": f"SIG-{region}-{tier}-{period}".upper().replace(' ', '_'),
+            "type": anomaly_type,
+            "metric": "Revenue",
+            "value": value,
+            "impact_usd": round(float(abs(current - base)), 2),
+            "segment": segment,
+            "description": (
+                f"{segment} revenue in {period.strftime('%b %Y')} was ${current:,.0f} vs a "
+                f"{BASELINE_MONTHS}-month average of ${base:,.0f} ({value})."
+            ),
+            "severity": severity,
+            "evidence_csv": {
+                "rows": rows,
+                "summary": f"Top {len(rows)} deals from {segment} in {period} showing the {anomaly_type}",
+                "extraction_method": "deterministic"
+            }
+        })
+
+    return anomalies
+
+
+@traced("load")
+def detect_anomalies_incremental(csv_path: str, store=None, immutable: bool = False):
+    """
+    Incremental variant of detect_anomalies for append-only sales files.
+    1. Reads only the rows appended since the last watermark (the first run ingests the whole file).
+    2. Folds them into the persisted Region x Product_Tier x month aggregates and top-deal evidence.
+    3. Re-evaluates the cells the delta touched, plus the following BASELINE_MONTHS months whose
+       baseline moved, with the same thresholds as the full engine.
+
+    Cost scales with the delta (and the number of segment-months), not with the history.
+    immutable: the file never changes (uploads), so its last line counts even without a newline.
+    Returns a list of WarningSignal dicts, or None if the columns don't match the sales schema.
+    """
+    store = store or get_sales_aggregates(EVIDENCE_ROWS)
+    delta = store.read_delta(csv_path, immutable)
+    if delta is None:
+        print("  No new sales rows since the last audit.", flush=True)
+        return []
+
+    if not all(col in delta["columns"] for col in REQUIRED_SALES_COLUMNS):
+        return None
+
+    cells = {}
+    deals = []
+    seq = delta["first_seq"]
+    for chunk in delta["frames"]:
+        chunk.index = pd.RangeIndex(seq, seq + len(chunk))
+        seq += len(chunk)
+        chunk = chunk[chunk['Date'].notna()]
+        if chunk.empty:
+            continue
+
+        dates = chunk['Date']
+        month = dates.dt.to_period('M').rename('Month')
+        # Chunks carry exact amounts for the evidence rows; sum at the full scan's float32 precision
+        revenue = chunk['Deal_Size_USD'].astype('float32').astype('float64').fillna(0.0)
+        grouped = revenue.groupby([chunk['Region'], chunk['Product_Tier'], month], observed=True).agg(['sum', 'count'])
+        for (region, tier, period), (total, count) in grouped.iterrows():
+            key = (str(region), str(tier), str(period))
+            prev_total, prev_count = cells.get(key, (0.0, 0))
+            cells[key] = (prev_total + float(total), prev_count + int(count))
+
+        # Candidate evidence: this chunk's top deals per cell (the store keeps the overall top)
+        chunk = chunk.assign(_seq=chunk.index)
+        index = grouped.index
+        evidence = _segment_month_evidence(
+            chunk, dates, month,
+            pd.MultiIndex.from_arrays([index.get_level_values(0), index.get_level_values(1)]),
+            index.get_level_values(2)
+        )
+        for (region, tier, period), rows in evidence.items():
+            for row in rows:
+                row_seq = row.pop('_seq')
+                deals.append((str(region), str(tier), str(period), float(row.get('Deal_Size_USD') or 0.0), row_seq, json.dumps(row)))
+
+    row_count = seq - delta["first_seq"]
+    if not store.apply(delta, [(*key, total, count) for key, (total, count) in cells.items()], deals, row_count):
+        print("  Delta already ingested by a concurrent audit.", flush=True)
+        return []
+    print(f"  Ingested {row_count} new rows ({delta['bytes']:,} bytes){' [full rebuild]' if delta['reset'] else ''}.", flush=True)
+    if not cells:
+        return []
+
+    aggregates = store.monthly_revenue(csv_path)
+    matrix = aggregates.pivot_table(index=['region', 'tier'], columns='month', values='revenue', aggfunc='sum', fill_value=0.0)
+    matrix.index.names = ['Region', 'Product_Tier']
+    matrix.columns = pd.PeriodIndex(matrix.columns, freq='M')
+    all_months = pd.period_range(matrix.columns.min(), matrix.columns.max(), freq='M')
+    matrix = matrix.reindex(columns=all_months, fill_value=0.0)
+
+    affected = None
+    if not delta["reset"]:
+        # A changed month moves its own value and the baseline of the next BASELINE_MONTHS months
+        affected = np.zeros(matrix.shape, dtype=bool)
+        row_of = {segment: i for i, segment in enumerate(matrix.index)}
+        for region, tier, period in cells:
+            start = all_months.get_loc(pd.Period(period, freq='M'))
+            affected[row_of[(region, tier)], start:start + BASELINE_MONTHS + 1] = True
+
+    def evidence_lookup(segments, periods):
+        keys = [(region, tier, str(period)) for (region, tier), period in zip(segments, periods)]
+        stored = store.top_deals(csv_path, keys)
+        return {(region, tier, pd.Period(period, freq='M')): rows for (region, tier, period), rows in stored.items()}
+
+    return evaluate_segment_matrix(matrix, affected=affected, evidence_lookup=evidence_lookup)
+
+
+def _segment_month_evidence(df, dates, month, segments, periods):
+    """Top EVIDENCE_ROWS deals (by size) for each flagged (Region, Product_Tier, Month) cell."""
+    wanted = pd.MultiIndex.from_arrays(
+        [segments.get_level_values(0), segments.get_level_values(1), periods],
+        names=['Region', 'Product_Tier', 'Month']
+    )
+    keys = pd.MultiIndex.from_arrays([df['Region'], df['Product_Tier'], month])
+    mask = keys.isin(wanted)
+    if not mask.any():
+        return {}
+
+    subset = df[mask].copy()
+    subset['Month'] = month[mask].astype(str).to_numpy()
+    subset['Segment'] = subset['Region'].astype(str) + ' ' + subset['Product_Tier'].astype(str)
+    subset['Date'] = dates[mask].dt.strftime('%Y-%m-%d').to_numpy()
+    subset = subset.sort_values('Deal_Size_USD', ascending=False, kind='stable')
+    subset = subset.groupby(['Region', 'Product_Tier', 'Month'], observed=True, sort=False).head(EVIDENCE_ROWS)
+
+    # to_json handles numpy scalars and NaN -> null in one pass
+    records = json.loads(subset.to_json(orient='records'))
+    evidence = {}
+    for row in records:
+        key = (row['Region'], row['Product_Tier'], pd.Period(row['Month'], freq='M'))
+        evidence.setdefault(key, []).append(row)
+    return evidence
+
+
+def extract_evidence_fallback(csv_path, anomaly, workspace_id=None):
     """
     Deterministic fallback evidence extractor when LLM fails to include evidence_csv.
     Extracts relevant rows based on anomaly metadata (segment, type, etc.).
+    The segment name is resolved against a pre-built evidence index (see evidence_index.py),
+    so each lookup is a key fetch instead of a scan of the sales file.
     
     This ensures 100% evidence coverage while maintaining the AI-driven analysis approach.
     """
     try:
         segment = anomaly.get('segment', '')
-        anomaly_type = anomaly.get('type', '')
         
         print(f"  🔧 Fallback: Extracting evidence for {anomaly.get('id')} ({segment})", flush=True)
         
-        # Filter dataframe for this segment
-        filtered_df = df.copy()
-        
-        if segment and 'Segment' in df.columns:
-            # Try exact match first, then partial match
-            exact_match = df[df['Segment'] == segment]
-            if len(exact_match) > 0:
-                filtered_df = exact_match
-            else:
-                # Partial match (e.g., "APAC" matches "APAC Enterprise")
-                filtered_df = df[df['Segment'].str.contains(segment, case=False, na=False)]
+        # Most recent EVIDENCE_ROWS rows of the closest key ("Enterprize APAC" -> APAC Enterprise);
+        # the anomaly id is tried next, then the whole dataset
+        index = get_evidence_index(csv_path, workspace_id)
+        key = index.resolve(segment) or index.resolve(str(anomaly.get('id', ''))) or ALL_KEY
+        rows = index.top(key, EVIDENCE_ROWS, by="date")
         
-        # Get top 10 most relevant rows (recent dates, high revenue)
-        if len(filtered_df) > 0:
-            # Sort by date (most recent first) and revenue (highest first)
-            if 'Date' in filtered_df.columns:
-                filtered_df = filtered_df.sort_values('Date', ascending=False)
-            
-            evidence_df = filtered_df.head(10)
-            
-            # Convert to native Python types
-            evidence_df = evidence_df.copy()
-            
-            # Convert Date to string if present
-            if 'Date' in evidence_df.columns:
-                evidence_df['Date'] = pd.to_datetime(evidence_df['Date']).dt.strftime('%Y-%m-%d')
-            
-            # Convert to list of dicts
-            rows = evidence_df.to_dict('records')
-            
-            # Convert numpy types to native Python
-            for row in rows:
-                for key, value in row.items():
-                    if hasattr(value, 'item'):  # numpy type
-                        row[key] = value.item()
-                    elif pd.isna(value):  # Handle NaN
-                        row[key] = None
-            
+        if rows:
+            label = index.labels().get(key, segment) if key != ALL_KEY else 'dataset'
             return {
                 "rows": rows,
-                "summary": f"Top {len(rows)} rows from {segment or 'dataset'} (auto-extracted)",
+                "summary": f"Top {len(rows)} rows from {label} (auto-extracted)",
                 "extraction_method": "fallback"
             }
         
@@ -81,53 +329,122 @@ def extract_evidence_fallback(df, anomaly):
             "extraction_method": "failed"
         }
 
+def validate_anomalies(result):
+    """
+    Checks the script's `result` against WarningSignal.
+    Returns (valid anomalies, errors); anomalies is None when nothing usable came back.
+    """
+    if not isinstance(result, list):
+        return None, [f"`result` should be a list of anomalies, got {type(result).__name__}"]
+    valid, errors = [], []
+    for item in result:
+        try:
+            valid.append(validate_typed(item, WarningSignal))
+        except SchemaError as e:
+            errors.append(str(e))
+    if errors:
+        print(f"⚠️ Dropped {len(errors)} anomalies that don't match the schema: {errors[:3]}", flush=True)
+        if not valid:
+            return None, errors
+    return valid, errors
+
+def format_inspection(inspection) -> str:
+    """
+    Compact data-structure view for the code-generation prompt: one "column: dtype" line and
+    the head/tail rows as CSV under a single header (to_string() pads every cell with spaces).
+    """
+    head, tail = inspection['head'], inspection['tail']
+    sample = head.to_csv(index=False).strip()
+    if len(tail) and not tail.index.equals(head.index):
+        sample += "\n...\n" + tail.to_csv(index=False, header=False).strip()
+    types = ", ".join(f"{column}: {dtype}" for column, dtype in inspection['dtypes'].items())
+    return f"""
+        Rows: {inspection['rows']}
+        Types: {types}
+        Head and tail (CSV):
+{sample}
+        """
+
+
 def analyst_agent(state: AgentState):
     """
-    Analyst Agent (Code Interpreter Pattern):
-    1. Inspects CSV structure (Head + Types).
-    2. Writes Pandas code to detect anomalies.
-    3. Executes code with retry loop for error handling.
+    Analyst Agent:
+    1. Runs the deterministic anomaly engine (default, milliseconds, reproducible);
+       with state["incremental"], only rows appended since the last audit are analysed.
+    2. Falls back to the Code Interpreter Pattern when ANALYST_MODE=llm or the schema is unknown:
+       inspects CSV structure, writes Pandas code, executes it in a sandboxed worker (sandbox.py) with a retry loop.
     """
-    print("--- Analyst Agent: Code Interpreter Mode (Harden) ---", flush=True)
-    
     csv_path = state["sales_data_path"]
     if not os.path.exists(csv_path):
         print(f"File not found: {csv_path}", flush=True)
         return {"anomalies": []}
+
+    if state.get("incremental") and get_analyst_mode() != "llm":
+        print("--- Analyst Agent: Incremental Anomaly Engine ---", flush=True)
+        try:
+            anomalies = detect_anomalies_incremental(
+                csv_path, get_sales_aggregates(EVIDENCE_ROWS, state.get("workspace_id")),
+                immutable=workspaces.get(state.get("workspace_id")).is_upload(csv_path)
+            )
+        except Exception as e:
+            print(f"❌ Incremental engine failed: {e}. Running a full scan.", flush=True)
+            anomalies = None
+
+        if anomalies is not None:
+            print(f"✅ Success: Found {len(anomalies)} anomalies in new data (incremental).", flush=True)
+            return {"anomalies": anomalies}
+
+    # Later reads (detection, evidence, inspection) use the typed columnar copy instead of the CSV
+    build_columnar_cache(csv_path)
         
+    if get_analyst_mode() != "llm":
+        print("--- Analyst Agent: Deterministic Anomaly Engine ---", flush=True)
+        try:
+            anomalies = detect_anomalies(csv_path)
+        except Exception as e:
+            print(f"❌ Deterministic engine failed: {e}", flush=True)
+            anomalies = None
+
+        if anomalies is not None:
+            print(f"✅ Success: Found {len(anomalies)} anomalies (deterministic).", flush=True)
+            if anomalies:
+                impacts = [a['impact_usd'] for a in anomalies]
+                print(f"  Impact range: ${min(impacts):,.0f} - ${max(impacts):,.0f}\n", flush=True)
+            return {"anomalies": anomalies}
+
+        print("⚠️ Sales schema not recognized. Falling back to LLM code interpreter.", flush=True)
+
+    print("--- Analyst Agent: Code Interpreter Mode (Harden) ---", flush=True)
+
     try:
         # 1. Inspection Phase (Deterministic)
-        df = pd.read_csv(csv_path)
-        
         # We need to give the LLM a view of the data structure
         # Head (first 5), Tail (last 5), and dtypes
-        inspection_str = f"""
-        Columns: {list(df.columns)}
-        Types: {df.dtypes.to_dict()}
-        Head:
-        {df.head().to_string()}
-        Tail:
-        {df.tail().to_string()}
-        """
+        inspection = inspect_sales(csv_path)
+        inspection_str = format_inspection(inspection)
         
     except Exception as e:
         print(f"Error loading sales data: {e}", flush=True)
+        note_fallback("sales data could not be inspected")
         return {"anomalies": []}
 
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("API Key missing.", flush=True)
+        note_fallback("no OPENAI_API_KEY")
         return {"anomalies": []} # Fallback/Exit
 
     # Agent 1: Analyst - Upgraded to GPT-4o for better reliability and instruction following
-    llm = ChatOpenAI(temperature=0, model="gpt-4o")
-    python_repl = PythonREPL()
+    llm = ChatOpenAI(temperature=0, model=DEFAULT_MODEL)
+    sandbox = get_sandbox_pool()
+    sandbox.load(csv_path)  # Workers load the data while the LLM writes the code
+    scope = cache_scope(state, "analyst")
     
     # Define our goal for the coding agent
     goal = """
     Write a Python script to detect significant anomalies in this dataset (Revenue leakes, Growth opps).
     
-    CRITICAL: The script must print the result as a VALID JSON string list of objects with this schema:
+    CRITICAL: The script must assign the result to a variable named `result`: a list of objects with this schema:
     [
         {
             "id": "SIG-001",
@@ -156,6 +473,8 @@ def analyst_agent(state: AgentState):
     
     for attempt in range(MAX_RETRIES):
         print(f"\n--- Analyst Loop: Attempt {attempt+1}/{MAX_RETRIES} ---", flush=True)
+        if attempt:
+            record("node", "analyst", "retries")
         
         error_context = f"Previous Error: {last_error}" if last_error else ""
         
@@ -174,8 +493,8 @@ def analyst_agent(state: AgentState):
         
         Requirements:
         1. DATA LOADING:
-           - Use 'pd.read_csv("{csv_path}")'
-           - Convert 'Date' column: df['Date'] = pd.to_datetime(df['Date'], format='%m/%d/%y')
+           - The data is ALREADY loaded as a pandas DataFrame named `df` (columns as shown above).
+           - 'Date' is already datetime64. Do NOT read the CSV file again.
            
         2. ANOMALY LOGIC:
            - Calculate monthly revenue by Segment.
@@ -209,28 +528,27 @@ def analyst_agent(state: AgentState):
            - Convert all strings/dates to python `str()`.
            - Do NOT perform arithmetic (sum/mean) directly on datetime columns.
            - Before json.dumps(), convert ALL dataframe columns to native Python types.
-           - Output ONLY valid JSON to stdout. No markdown.
-           - VERIFY that every anomaly has an "evidence_csv" field before printing.
+           - Assign the final list to `result` (do not print it). No markdown.
+           - VERIFY that every anomaly has an "evidence_csv" field before assigning `result`.
         """
         
         try:
             print("⏳ Generating Python code with LLM...", flush=True)
-            code_res = llm.invoke([HumanMessage(content=prompt)]).content
+            code_res = cached_invoke(llm, [HumanMessage(content=prompt)], scope).content
             print(f"✅ Code Generated ({len(code_res)} chars). Cleaning...", flush=True)
             
             # Clean markdown
             code = code_res.replace("```python", "").replace("```", "").strip()
             
-            # Execute
-            print("🚀 Executing Python code in REPL...", flush=True)
-            output = python_repl.run(code)
-            print(f"📄 Code Output (First 200 chars):\n{output[:200]}...", flush=True)
+            # Execute (sandboxed worker process: time/CPU/memory limits, structured result)
+            print("🚀 Executing Python code in sandbox...", flush=True)
+            execution = sandbox.run(code, csv_path)
+            print(f"📄 Sandbox: {'ok' if execution['ok'] else 'failed'} in {execution.get('duration_s', 0):.2f}s "
+                  f"(peak RSS {execution.get('peak_rss_mb')} MB)", flush=True)
 
             # Validate Output
-            match = re.search(r'\[.*\]', output, re.DOTALL)
-            if match:
-                json_str = match.group()
-                anomalies_data = json.loads(json_str)
+            if execution["ok"]:
+                anomalies_data, schema_errors = validate_anomalies(execution["result"])
                 if isinstance(anomalies_data, list) and len(anomalies_data) > 0:
                     print(f"✅ Success: Found {len(anomalies_data)} anomalies from LLM.", flush=True)
                     
@@ -250,8 +568,9 @@ def analyst_agent(state: AgentState):
                         
                         if needs_fallback:
                             fallback_count += 1
+                            note_fallback("deterministic evidence extraction")
                             # Use deterministic fallback
-                            fallback_evidence = extract_evidence_fallback(df, anomaly)
+                            fallback_evidence = extract_evidence_fallback(csv_path, anomaly, state.get("workspace_id"))
                             anomaly['evidence_csv'] = fallback_evidence
                         else:
                             # Mark as LLM-generated (implicit)
@@ -267,7 +586,7 @@ def analyst_agent(state: AgentState):
                     print(f"  Evidence Coverage: 100% ✓", flush=True)
                     
                     # FILTER: Return only top 10 most significant anomalies by impact
-                    print(f"\n🎯 Filtering to top 10 most significant anomalies by impact...", flush=True)
+                    print(f"\n🎯 Filtering to top {TOP_ANOMALIES} most significant anomalies by impact...", flush=True)
                     
                     # Sort by impact_usd (descending)
                     sorted_anomalies = sorted(
@@ -277,7 +596,7 @@ def analyst_agent(state: AgentState):
                     )
                     
                     # Take top 10
-                    top_anomalies = sorted_anomalies[:10]
+                    top_anomalies = sorted_anomalies[:TOP_ANOMALIES]
                     
                     print(f"  Returning top {len(top_anomalies)} anomalies (out of {len(anomalies_data)} detected)", flush=True)
                     print(f"  Impact range: ${min(abs(a.get('impact_usd', 0)) for a in top_anomalies):,.0f} - ${max(abs(a.get('impact_usd', 0)) for a in top_anomalies):,.0f}\n", flush=True)
@@ -287,12 +606,19 @@ def analyst_agent(state: AgentState):
                      print("Code ran but found no anomalies.", flush=True)
                      return {"anomalies": []}
             
-            last_error = f"Output was not valid JSON: {output}"
+            if not execution["ok"]:
+                last_error = execution["error"]
+            else:
+                last_error = f"{'; '.join(schema_errors[:5])}. Script output: {execution['stdout'][:2000]}"
             print(f"❌ Error: {last_error}", flush=True)
 
+        except TokenBudgetExceeded as e:
+            print(f"❌ Token budget reached: {e}", flush=True)
+            break
         except Exception as e:
             last_error = str(e)
             print(f"❌ Exception executing code: {e}", flush=True)
 
     print("Max retries reached. Returning empty.", flush=True)
+    note_fallback("code interpreter failed")
     return {"anomalies": []}
\ No newline at end of file
@@ -1,95 +1,104 @@
 import os
+from datetime import datetime
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import HumanMessage
+from langgraph.config import get_stream_writer
 from state import AgentState
+from llm import DEFAULT_MODEL, get_max_concurrency, invoke_as_completed, note_fallback
+from llm_cache import cache_scope
 
-def ghostwriter_agent(state: AgentState):
-    """
-    Ghostwriter Agent: Synthesizes findings into Executive Prose.
-    Uses OpenAI if available, otherwise falls back to a high-quality template.
-    """
-    print("--- Ghostwriter Agent: Synthesizing Report ---")
-    
-    anomalies = state.get("anomalies", [])
-    context = state.get("context_insights", [])
-    recommendations = state.get("recommendations", [])
-    
-    # Check for API Key
-    api_key = os.getenv("OPENAI_API_KEY")
-    
-    if api_key:
-        # LLM Synthesis
-        try:
-            # Agent 4: Ghostwriter - Polished Narrative -> gpt-4o
-            llm = ChatOpenAI(temperature=0, model="gpt-4o")
-            
-            
-            rec = recommendations[0] if recommendations else {}
-            ctx = context[0] if context else {}
-            employee_attr = ctx.get('employee_attribution', {}) if ctx else {}
-            
-            prompt = f"""
+MAX_SIGNALS = 5  # Signals kept per audit (top by impact)
+
+
+def get_memo_concurrency() -> int:
+    """Memos generated at once (GHOSTWRITER_MAX_CONCURRENCY, defaults to LLM_MAX_CONCURRENCY)."""
+    try:
+        return max(1, int(os.getenv("GHOSTWRITER_MAX_CONCURRENCY", get_max_concurrency())))
+    except ValueError:
+        return get_max_concurrency()
+
+
+def memo_writer():
+    """Emits finished memos on the graph's "custom" stream (no-op outside a graph run)."""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
+
+
+def build_memo_prompt(signal_text: str, ctx, rec):
+    """Transformation Investment Memo prompt for one reported signal."""
+    employee_attr = ctx.get('employee_attribution', {}) if ctx else {}
+    prompt = f"""
             You are a Senior Strategic Advisor to the CEO.
             Write a "Transformation Investment Memo" - a decision-ready brief that recognizes employee contributions.
-            
+
             **SIGNAL DETECTED:**
-            {anomalies[0]['description'] if anomalies else 'No major signal'}
-            
+            {signal_text or 'No major signal'}
+
             **INTERNAL CONTEXT:**
-            {ctx.get('content', 'No context found.')}
-            
+            {ctx.get('content', 'No context found.') if ctx else 'No context found.'}
+
             **EMPLOYEE CONTRIBUTION:**
             {f"Name: {employee_attr.get('name', 'Unknown')}" if employee_attr else "No employee attribution found"}
             {f"Department: {employee_attr.get('department', 'N/A')}" if employee_attr and employee_attr.get('department') else ""}
             {f"Proposal: {employee_attr.get('proposal_summary', 'N/A')}" if employee_attr and employee_attr.get('proposal_summary') else ""}
             {f"Validation: {employee_attr.get('validation', 'N/A')}" if employee_attr and employee_attr.get('validation') else ""}
-            
+
             **STRATEGIC RESPONSE:**
             Product: {rec.get('project_title', 'Investigation Pending')}
             Market Context: {rec.get('market_context', 'N/A')}
             ROI: {rec.get('roi_metric', 'N/A')} (${rec.get('impact_usd', 0):,.0f} impact)
             Feasibility: {rec.get('feasibility_score', 'N/A')}/10
-            
+
             **FORMAT REQUIREMENTS:**
             Write 2-3 paragraphs in this structure:
-            
+
             Paragraph 1 - THE PROBLEM:
             - State the business impact clearly (use the signal data)
             - Mention the root cause if known from context
             - Keep it urgent but professional
-            
+
             Paragraph 2 - THE SOLUTION & RECOGNITION:
             - If an employee proposed a solution, CREDIT THEM BY NAME
             - Example: "**Hiroshi Tanaka** (APAC Sales) identified this issue and proposed..."
             - Summarize their solution approach
             - Mention any validation they did (customer interviews, data analysis, etc.)
-            
+
             Paragraph 3 - THE BUSINESS CASE:
             - State the ROI and financial impact
             - Reference the market context from Tavily research
             - End with a clear recommendation (Approve/Investigate Further/Archive)
-            
+
             **TONE:**
             - Professional, "Mag7" consulting style
             - Bold key entities (employee names, dollar amounts, company names)
             - No bullet points in the prose
             - Make the employee feel recognized and valued
             """
-            
-            response = llm.invoke([HumanMessage(content=prompt)])
-            final_prose = response.content
-            
-        except Exception as e:
-            print(f"LLM Error: {e}. Using fallback.")
-            final_prose = fallback_prose()
-    else:
-        print("No OPENAI_API_KEY found. Using fallback.")
-        final_prose = fallback_prose()
+    return [HumanMessage(content=prompt)]
+
+
+def ghostwriter_agent(state: AgentState):
+    """
+    Ghostwriter Agent: Synthesizes findings into Executive Prose.
+    1. Groups signals by region + classification (Master Signals) and keeps the top 5 by impact.
+    2. Writes a memo per kept signal with OpenAI: concurrent calls (GHOSTWRITER_MAX_CONCURRENCY),
+       each memo streamed out as soon as it is ready and cached on its prompt's content,
+       so unchanged signals are not regenerated. Falls back to a template without an API key.
+    """
+    print("--- Ghostwriter Agent: Synthesizing Report ---")
+
+    anomalies = state.get("anomalies", [])
+    context = state.get("context_insights", [])
+    recommendations = state.get("recommendations", [])
+
+    # Check for API Key
+    api_key = os.getenv("OPENAI_API_KEY")
 
     # Construct the final report object for the UI
-    from datetime import datetime
-    
     report = []
+    memo_inputs = {}  # signal_id -> (signal text, context, recommendation) for the memo prompt
     
     # Deduplication: Group anomalies by classification and region
     grouped_anomalies = {}
@@ -132,6 +141,17 @@ def ghostwriter_agent(state: AgentState):
             "segment": segment
         })
 
+    # Recommendations are keyed by signal_id (the Strategist sorts them by value, not by anomaly order)
+    rec_by_signal = {r.get('signal_id'): r for r in recommendations if r.get('signal_id')}
+
+    def rec_for(item):
+        signal_id = item["data"].get('id')
+        if signal_id in rec_by_signal:
+            return rec_by_signal[signal_id]
+        if not rec_by_signal and item["index"] < len(recommendations):
+            return recommendations[item["index"]]
+        return {}
+
     # Process grouped anomalies
     for key, group in grouped_anomalies.items():
         # If group has multiple items, create a Master Signal. If single, treat normally.
@@ -145,7 +165,7 @@ def ghostwriter_agent(state: AgentState):
         region = primary_item["region"]
         
         # Context/Recs from primary item (could be aggregated in future)
-        rec = recommendations[idx] if idx < len(recommendations) else {}
+        rec = rec_for(primary_item)
         ctx = next((c for c in context if c.get('signal_id') == anom.get('id')), {}) if context else {}
         employee_attr = ctx.get('employee_attribution', {}) if ctx else {}
         
@@ -163,14 +183,12 @@ def ghostwriter_agent(state: AgentState):
             # Aggregate impact from RECOMMENDATIONS (not anomaly data)
             total_impact_usd = 0
             for item in group:
-                item_idx = item["index"]
-                if item_idx < len(recommendations):
-                    total_impact_usd += recommendations[item_idx].get('impact_usd', 0)
+                total_impact_usd += rec_for(item).get('impact_usd', 0)
             
             impact_display = f"${total_impact_usd/1000000:.2f}M" if total_impact_usd > 1000000 else f"${total_impact_usd/1000:.0f}k"
             
             # Combine UNIQUE segments string (avoid repetition)
-            unique_segments = list(set([item["segment"] for item in group]))
+            unique_segments = list(dict.fromkeys(item["segment"] for item in group))  # Stable order (memo cache key)
             segments_str = ", ".join(unique_segments[:3])  # Show max 3 unique segments
             if len(unique_segments) > 3:
                 segments_str += f" and {len(unique_segments) - 3} more"
@@ -189,24 +207,24 @@ def ghostwriter_agent(state: AgentState):
             
             # Use aggregated impact for the signal
             signal_impact = impact_display
+
+            # The memo covers every signal of the group
+            signal_text = "\n            ".join([prose] + [f"- {item['data'].get('description', '')}" for item in group])
             
         else:
             # Single Signal Logic
-            # ... (Existing logic for single items, simplified here for new structure) ...
             title_prefix = f"Critical {classification}" if classification == "Revenue Leak" else f"Strategic {classification}"
             severity_override = "critical" if classification == "Revenue Leak" else "medium"
             contextual_title = f"{title_prefix}: {anom.get('description', 'Anomaly Detected')}{event_context}"
             summary = f"{classification} detected in {primary_item['segment']}."
             signal_impact = anom.get('value', 'Unknown')
-            
-            if api_key and idx == 0 and not is_master_signal:
-                 prose = final_prose # Use LLM prose if it's the very first one and not a master signal
-            else:
-                 prose = f"A {classification} has been detected in {primary_item['segment']}."
+            # Template prose, replaced by the LLM memo when available
+            prose = f"A {classification} has been detected in {primary_item['segment']}."
+            signal_text = anom.get('description', '')
 
         # Create signal object
         # Use the deterministic ID from the analyst agent if available, otherwise fallback
-        base_id = primary_item.get("id")
+        base_id = anom.get("id")
         if base_id and not is_master_signal:
              signal_id = base_id
         elif is_master_signal and base_id:
@@ -221,6 +239,7 @@ def ghostwriter_agent(state: AgentState):
             "summary": summary,
             "prose": prose,
             "severity": severity_override,
+            "region": region,
             "date": datetime.now().strftime('%Y-%m-%d'),
             "status": severity_override,
             "impact": signal_impact, # Now can be USD string
@@ -255,8 +274,9 @@ def ghostwriter_agent(state: AgentState):
         }
         
         report.append(signal_data)
+        memo_inputs[signal_id] = (signal_text, ctx, rec or {})
 
-    # CRITICAL: Constrain to top 3 signals by impact
+    # CRITICAL: Constrain to top signals by impact
     # Sort by impact_usd (from recommendation) in descending order
     report_sorted = sorted(
         report, 
@@ -265,19 +285,36 @@ def ghostwriter_agent(state: AgentState):
     )
     
     # Take top 5 signals to allow for the bootstrap 5-signal run
-    top_3_signals = report_sorted[:5]
+    top_signals = report_sorted[:MAX_SIGNALS]
+
+    # Memos only for the signals that are reported (no tokens spent on the cut ones)
+    write = memo_writer()
+    if api_key and top_signals:
+        # Agent 4: Ghostwriter - Polished Narrative -> gpt-4o
+        llm = ChatOpenAI(temperature=0, model=DEFAULT_MODEL)
+        prompts = [build_memo_prompt(*memo_inputs[s["signal_id"]]) for s in top_signals]
+        # A memo depends only on its prompt: cache on the prompt content alone, so a signal
+        # whose data is unchanged reuses its memo even when other input rows changed
+        scope = {**cache_scope(state, "ghostwriter"), "inputs": {}}
+        for i, reply in invoke_as_completed(llm, prompts, get_memo_concurrency(), scope):
+            signal = top_signals[i]
+            if isinstance(reply, Exception):
+                print(f"LLM Error for {signal['signal_id']}: {reply}. Using fallback.")
+                note_fallback("template memo")
+            else:
+                signal["prose"] = reply.content
+            write({"signal_id": signal["signal_id"], "prose": signal["prose"]})
+    else:
+        print("No OPENAI_API_KEY found. Using fallback.")
+        if top_signals:
+            note_fallback("no OPENAI_API_KEY")
+        for signal in top_signals:
+            write({"signal_id": signal["signal_id"], "prose": signal["prose"]})
     
     print(f"\n📊 Ghostwriter Summary:")
     print(f"  Input: {len(anomalies)} anomalies from Analyst")
     print(f"  After deduplication: {len(report)} signals")
-    print(f"  Returning top 5 by impact")
-    print(f"  Top IDs: {[s['signal_id'] for s in top_3_signals]}")
+    print(f"  Returning top {MAX_SIGNALS} by impact")
+    print(f"  Top IDs: {[s['signal_id'] for s in top_signals]}")
     
-    return {"final_report": top_3_signals}
-
-def fallback_prose():
-    return (
-        "A critical **Revenue Leak** has been identified in the **APAC Enterprise** segment, where revenue has dropped by 34.2% since November 15th. "
-        "This correlates directly with the **Zenith Labs** acquisition, which appears to have frozen renewal conversations as clients await clarity on the merged product roadmap. "
-        "Immediate intervention is required to unblock these deals by providing a clear migration strategy."
-    )
+    return {"final_report": top_signals}
@@ -2,130 +2,202 @@ import os
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
 from state import AgentState, ContextInsight
+from llm import DEFAULT_MODEL, fan_out, note_fallback
+from structured import parse_json, validate_typed
+from llm_cache import cache_scope
+from context_index import get_context_index, dedupe_entries, format_entries
+from prompt_budget import fit_to_budget
 
-def investigator_agent(state: AgentState):
-    """
-    Investigator Agent: Context Seeker.
-    1. Reads the anomalies from the Analyst.
-    2. Scans the 'context_data_path' (txt file).
-    3. Uses LLM to find relevant explanations/events for each anomaly.
-    """
-    print("--- Investigator Agent: Searching Internal Context (Dynamic) ---")
-    
-    anomalies = state.get("anomalies", [])
-    context_path = state["context_data_path"]
-    insights = []
-    
-    if not anomalies:
-        print("No anomalies to investigate.")
-        return {"context_insights": []}
-
-    try:
-        with open(context_path, "r") as f:
-            context_text = f.read()
-    except Exception as e:
-        print(f"Error reading context file: {e}")
-        return {"context_insights": []}
-
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("No API Key. Returning empty insights.")
-        return {"context_insights": []}
+DEFAULT_CONTEXT_TOKENS = 1500
 
-    # Agent 2: Investigator - Rich Context Matching -> gpt-4o
-    llm = ChatOpenAI(temperature=0, model="gpt-4o")
 
-    # Group anomalies to ask in one go, or loop. Looping is safer for detailed retrieval.
-    for signal in anomalies:
-        prompt = f"""
-        You are an Investigator Agent with a special focus on employee attribution.
-        
-        The Analyst has detected this anomaly:
-        Type: {signal['type']}
-        Description: {signal['description']}
-        Segment: {signal['segment']}
-        Metric Value: {signal['value']}
-        
-        Search the following Internal Logs/Context for:
-        1. Specific events, meeting notes, or emails that explain WHY this is happening
-        2. Employee-submitted ideas or proposals that address this problem
-        3. The employee's name, department (if mentioned), and their proposed solution
-        
-        Focus on specific project names, acquisitions, operational changes, and employee contributions.
-        
-        SEARCH KEYWORDS TO LOOK FOR:
-        - Anomaly-specific: "{signal['segment']}", "{signal['type']}"
-        - Revenue/Acquisition: "Zenith", "acquisition", "migration", "churn", "GlobalStack"
-        - Tier/Segment: "Enterprise", "Professional", "Starter", "tier", "segment", "LTV"
-        - Operational: "compliance", "legal", "review", "bottleneck", "friction", "cycle time", "deal velocity"
-        - Employees: "Hiroshi Tanaka", "Jessica Wu", "Marcus Thorne"
-        - Transformation projects: "TRANS-001", "TRANS-014", "TRANS-032"
-        
-        Internal Logs:
-        \"\"\"
-        {context_text[:15000]} 
-        \"\"\"
-        (Note: Text truncated to first 15k chars for efficiency)
+def get_context_budget(signals: int = 1):
+    """Context tokens per investigator prompt (INVESTIGATOR_CONTEXT_TOKENS per signal, 0 = no limit)."""
+    try:
+        per_signal = int(os.getenv("INVESTIGATOR_CONTEXT_TOKENS", DEFAULT_CONTEXT_TOKENS))
+    except ValueError:
+        per_signal = DEFAULT_CONTEXT_TOKENS
+    return per_signal * signals if per_signal > 0 else None
 
-        If you find a relevant explanation, return a JSON object with employee attribution when available.
-        
-        Schema:
-        {{
+INSIGHT_SCHEMA = """
+        {
             "source": "e.g. Slack #product-roadmap or Email from CEO",
             "content": "One sentence summary of the finding.",
             "date": "YYYY-MM-DD (if found)",
             "relevance_score": 0.95,
-            "evidence_txt": {{
+            "evidence_txt": {
                 "file": "internal_context_dump.txt",
                 "excerpt": "VERBATIM text excerpt from the logs (200-500 chars). Include the exact message/email that explains the context.",
                 "context": "Brief explanation of what this excerpt shows"
-            }},
-            "employee_attribution": {{
+            },
+            "employee_attribution": {
                 "name": "Employee Name (if found in logs)",
                 "department": "Department or role (if mentioned, e.g., 'APAC Sales', 'Engineering')",
                 "proposal_summary": "Brief summary of their proposed solution (if they submitted one)",
                 "validation": "Any validation they provided (e.g., 'interviewed 8 customers')",
                 "submission_channel": "Where they submitted it (e.g., 'Slack #product-roadmap')",
                 "submission_date": "YYYY-MM-DD (when they submitted the idea)"
-            }}
-        }}
-        
+            }
+        }"""
+
+EVIDENCE_RULES = """
         CRITICAL EVIDENCE REQUIREMENTS:
         - The 'excerpt' field MUST contain the EXACT, VERBATIM text from the logs (not a paraphrase)
         - Include 200-500 characters of the most relevant portion
         - Preserve the original formatting, names, and punctuation
         - If it's a Slack message, include the author's name at the start (e.g., "Hiroshi Tanaka: ...")
         - The 'context' field should briefly explain what this excerpt demonstrates
-        
-        IMPORTANT: 
+
+        IMPORTANT:
         - If no employee attribution is found, set "employee_attribution" to null
         - If you find an employee who flagged the issue OR proposed a solution, extract their details
         - Look for patterns like "Name: message" or "From: Name" in Slack/email entries
         - Extract detailed proposals that include problem statements, solutions, ROI estimates, etc.
-        
-        Return null if no relevant context is found at all.
+"""
+
+
+def _signal_block(signal) -> str:
+    return f"""
+        Type: {signal['type']}
+        Description: {signal['description']}
+        Segment: {signal['segment']}
+        Metric Value: {signal['value']}
+"""
+
+
+def _search_instructions(segments: str, types: str, context_text: str) -> str:
+    return f"""
+        Search the following Internal Logs/Context for:
+        1. Specific events, meeting notes, or emails that explain WHY this is happening
+        2. Employee-submitted ideas or proposals that address this problem
+        3. The employee's name, department (if mentioned), and their proposed solution
+
+        Focus on specific project names, acquisitions, operational changes, and employee contributions.
+
+        SEARCH KEYWORDS TO LOOK FOR:
+        - Anomaly-specific: {segments}, {types}
+        - Revenue/Acquisition: "Zenith", "acquisition", "migration", "churn", "GlobalStack"
+        - Tier/Segment: "Enterprise", "Professional", "Starter", "tier", "segment", "LTV"
+        - Operational: "compliance", "legal", "review", "bottleneck", "friction", "cycle time", "deal velocity"
+        - Employees: "Hiroshi Tanaka", "Jessica Wu", "Marcus Thorne"
+        - Transformation projects: "TRANS-001", "TRANS-014", "TRANS-032"
+
+        Internal Logs:
+        \"\"\"
+        {context_text}
+        \"\"\"
+        (Note: Most relevant entries retrieved from the indexed context file)
+"""
+
+
+def build_prompt(signal, context_text: str):
+    prompt = f"""
+        You are an Investigator Agent with a special focus on employee attribution.
+
+        The Analyst has detected this anomaly:
+        {_signal_block(signal)}
+        {_search_instructions(f'"{signal["segment"]}"', f'"{signal["type"]}"', context_text)}
+        If you find a relevant explanation, return a JSON object with employee attribution when available.
+
+        Schema:
+        {INSIGHT_SCHEMA}
+        {EVIDENCE_RULES}
+        Return an empty JSON object {{}} if no relevant context is found at all.
         """
-        
-        try:
-            response = llm.invoke([HumanMessage(content=prompt)])
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            
-            if "null" in content.lower() and len(content) < 10:
-                continue
-                
-            data = None
-            # Simple check to parse JSON
-            import json
-            data = json.loads(content)
-            
-            if data:
-                data["signal_id"] = signal["id"]
-                insights.append(data)
-                
-        except Exception as e:
-            print(f"Investigator LLM Error for {signal['id']}: {e}")
+    return [HumanMessage(content=prompt)]
+
+
+def build_packed_prompt(signals, context_text: str):
+    """One prompt covering several signals; the reply is keyed by signal id."""
+    blocks = "\n".join(f"        [{s['id']}]{_signal_block(s)}" for s in signals)
+    segments = ", ".join(sorted({f'"{s["segment"]}"' for s in signals}))
+    types = ", ".join(sorted({f'"{s["type"]}"' for s in signals}))
+    prompt = f"""
+        You are an Investigator Agent with a special focus on employee attribution.
+
+        The Analyst has detected these anomalies:
+{blocks}
+        {_search_instructions(segments, types, context_text)}
+        For EACH anomaly, find the most relevant explanation with employee attribution when available.
+
+        Return ONLY a JSON object keyed by anomaly id, e.g. {{"{signals[0]['id']}": <insight or null>}}.
+        Each insight follows this schema:
+        {INSIGHT_SCHEMA}
+        {EVIDENCE_RULES}
+        Use null for an anomaly when no relevant context is found.
+        """
+    return [HumanMessage(content=prompt)]
+
+
+def parse_insight(content: str):
+    """JSON reply -> ContextInsight (signal_id is set by the caller); null / {} -> None."""
+    data = parse_json(content)
+    if not data:
+        return None
+    return validate_typed(data, ContextInsight, exclude=("signal_id",))
+
+
+def investigator_agent(state: AgentState):
+    """
+    Investigator Agent: Context Seeker.
+    1. Reads the anomalies from the Analyst.
+    2. Retrieves the top-k entries per anomaly from the indexed 'context_data_path' (see context_index),
+       deduplicated and capped at INVESTIGATOR_CONTEXT_TOKENS per anomaly.
+    3. Uses LLM to find relevant explanations/events for each anomaly
+       (concurrent calls across signals, optionally packed, see llm.fan_out).
+    """
+    print("--- Investigator Agent: Searching Internal Context (Dynamic) ---")
+
+    anomalies = state.get("anomalies", [])
+    context_path = state["context_data_path"]
+    insights = []
+
+    if not anomalies:
+        print("No anomalies to investigate.")
+        return {"context_insights": []}
+
+    # Retrieve top-k entries per signal from the persisted index instead of prompt-stuffing the file
+    try:
+        index = get_context_index(context_path, state.get("workspace_id"))
+        index.ensure_built()
+        retrieved = {s["id"]: index.retrieve_for_signal(s) for s in anomalies}
+    except Exception as e:
+        print(f"Error indexing context file: {e}")
+        note_fallback("context index unavailable")
+        return {"context_insights": []}
+
+    def context_for(signals):
+        # Round-robin over the signals' rankings, so a budget cut drops each signal's weakest entries
+        rankings = [retrieved[s["id"]] for s in signals]
+        ordered = [r[i] for i in range(max(map(len, rankings), default=0)) for r in rankings if i < len(r)]
+        entries = fit_to_budget(dedupe_entries(ordered), format_entries, get_context_budget(len(signals)))
+        return format_entries(entries) or "(No matching entries)"
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("No API Key. Returning empty insights.")
+        note_fallback("no OPENAI_API_KEY")
+        return {"context_insights": []}
+
+    # Agent 2: Investigator - Rich Context Matching -> gpt-4o
+    # JSON mode: replies are always a syntactically valid JSON object
+    llm = ChatOpenAI(temperature=0, model=DEFAULT_MODEL, model_kwargs={"response_format": {"type": "json_object"}})
+
+    results = fan_out(
+        llm,
+        anomalies,
+        build_prompt=lambda signal: build_prompt(signal, context_for([signal])),
+        build_packed_prompt=lambda signals: build_packed_prompt(signals, context_for(signals)),
+        parse_reply=parse_insight,
+        label="Investigator LLM",
+        scope=cache_scope(state, "investigator"),
+    )
+
+    # Results are aligned with anomalies, so insights keep the Analyst's order
+    for signal, data in zip(anomalies, results):
+        if data:
+            data["signal_id"] = signal["id"]
+            insights.append(data)
 
     print(f"Found {len(insights)} insights.")
     return {"context_insights": insights}
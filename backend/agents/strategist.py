@@ -1,19 +1,121 @@
-import json
 import os
+from typing import List
+import numpy as np
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_experimental.utilities import PythonREPL
-from state import AgentState, Recommendation
-import re
+from state import AgentState, Recommendation, BacklogMatch
+from llm import DEFAULT_MODEL, fan_out, note_fallback
+from llm_cache import cache_scope
+from structured import parse_json, validate_typed
+from backlog_index import get_backlog_matcher
+from market_research import get_market_research
+from portfolio import get_budget, plan_portfolio, score_pairs
+from prompt_budget import compact_json
+
+SYSTEM_PROMPT = """You are a Senior Strategic Transformation Architect.
+Your goal is to align operational problems with the most high-leverage digital transformation initiatives from the backlog.
+You generally favor 'Platform' solutions over point solutions if the problem is systemic.
+Verify that the solution directly addresses the root cause described in the context.
+
+MATCHING RULES:
+- For revenue drops in a specific region, look for transformations that address that region or competitive issues
+- For customer churn or migration friction, look for retention or migration-related transformations (e.g., TRANS-001)
+- For segment/tier divergence (Enterprise vs Starter), look for growth or marketing transformations (e.g., TRANS-032)
+- For operational bottlenecks or compliance friction, look for automation or process improvement transformations (e.g., TRANS-014)
+- Prioritize transformations with CRITICAL or High strategic alignment
+- Match based on department, pain point, and impact size
+"""
+
+# Backlog fields the selection prompt needs (owner and tech spec don't decide the match)
+CANDIDATE_FIELDS = ("id", "dept", "title", "pain_point", "impact_usd", "complexity_points", "strategic_alignment")
+
+MATCHING_GUIDELINES = """
+        The candidates were pre-ranked by a keyword matcher ("match_score", higher is better) and are
+        too close to call on keywords alone. Pick the one that addresses the ROOT CAUSE in the context.
+"""
+
+
+def _signal_line(signal, insight) -> str:
+    context_str = f"Context: {insight['content']}" if insight else ""
+    return f"""Signal Detected: {signal['description']} ({signal['value']} impact in {signal.get('segment', 'Unknown')} segment).
+        {context_str}"""
+
+
+def build_match_prompt(signal, insight, backlog_str: str):
+    human_prompt = f"""
+        {_signal_line(signal, insight)}
+        
+        Candidate Transformation Projects:
+        {backlog_str}
+        
+        Task: Select the BEST project from the candidates that directly solves this signal.
+        {MATCHING_GUIDELINES}
+        Return ONLY valid JSON with this exact format:
+        {{"project_id": "TRANS-XXX", "complexity_points": <number>}}
+        
+        Example: {{"project_id": "TRANS-001", "complexity_points": 40}}
+        """
+    return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=human_prompt)]
+
+
+def build_packed_match_prompt(signals, insight_by_signal, backlog_str: str):
+    """One selection prompt covering several signals; the reply is keyed by signal id."""
+    blocks = "\n".join(
+        f"        [{s['id']}] {_signal_line(s, insight_by_signal.get(s['id']))}" for s in signals
+    )
+    human_prompt = f"""
+{blocks}
+        
+        Candidate Transformation Projects:
+        {backlog_str}
+        
+        Task: For EACH signal above, select the BEST project from the candidates that directly solves it.
+        {MATCHING_GUIDELINES}
+        Return ONLY a valid JSON object keyed by signal id with this exact format:
+        {{"<signal id>": {{"project_id": "TRANS-XXX", "complexity_points": <number>}}}}
+        
+        Example: {{"{signals[0]['id']}": {{"project_id": "TRANS-001", "complexity_points": 40}}}}
+        """
+    return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=human_prompt)]
+
+
+def parse_match(content: str):
+    """JSON reply -> BacklogMatch (raises ValueError on malformed/incomplete replies)."""
+    return validate_typed(parse_json(content), BacklogMatch)
+
+
+def candidates_str(ranked) -> str:
+    """Backlog candidates for a prompt as minified JSON (best match first, CANDIDATE_FIELDS and their match score)."""
+    return compact_json([
+        {**{f: c["item"][f] for f in CANDIDATE_FIELDS if c["item"].get(f) is not None}, "match_score": c["score"]}
+        for c in ranked
+    ])
+
+
+def audit_regions(anomalies) -> List[str]:
+    """Every sales region in the audit (the matcher demotes items about another region)."""
+    return sorted({s["segment"].split()[0] for s in anomalies if s.get("segment")})
+
+
+def relevance_matrix(matcher, anomalies, insights, regions) -> np.ndarray:
+    """Match scores of every backlog item for every signal (signals x items)."""
+    insight_by_signal = {i["signal_id"]: i for i in insights}
+    return np.vstack([matcher.scores(s, insight_by_signal.get(s["id"]), regions) for s in anomalies])
+
 
 def strategist_agent(state: AgentState):
     """
     Strategist Agent (v2): Tool-Augmented Financial Reasoner.
-    1. Matches Signals -> Backlog Item (LLM).
-    2. Market Research (Tavily): Validates the need and finds competitors.
-    3. ROI Calculation (Python): Deterministically calculates Impact, Cost, and Feasibility.
+    1. Matches Signals -> Backlog Item: ranks the whole backlog with an inverted index (see backlog_index),
+       and asks the LLM only when the top candidates score too close to call.
+    2. Market Research (Tavily or a local corpus, see market_research): Validates the need and finds
+       competitors. Lookups run concurrently and are cached across audits.
+    3. ROI Scoring (see portfolio.py): Impact, Cost, ROI, Feasibility and NSV for every
+       (signal, backlog item) pair as one matrix.
     4. Outputs 'EnrichedRecommendation' list sorted by Net Strategic Value.
+    Runs over any subset of the audit's signals (state["regions"] holds the whole audit's regions);
+    portfolio_agent then plans the budget over all of them.
     """
     print("--- Strategist Agent: Financial Reasoning (Tool-Augmented) ---")
     
@@ -25,114 +127,102 @@ def strategist_agent(state: AgentState):
     if not anomalies:
         return {"recommendations": []}
 
-    # Load Backlog
+    # Load Backlog (indexed once per file content)
     try:
-        with open(backlog_path, "r") as f:
-            backlog_data = json.load(f)
-            backlog_str = json.dumps(backlog_data[:15], indent=2) 
+        matcher = get_backlog_matcher(backlog_path)
     except Exception as e:
         print(f"Error reading backlog: {e}")
+        note_fallback("backlog unreadable")
         return {"recommendations": []}
 
     api_key = os.getenv("OPENAI_API_KEY")
-    tavily_key = os.getenv("TAVILY_API_KEY") # User must provide this
-    
-    if not api_key: 
-        print("Missing OPENAI_API_KEY")
-        return {"recommendations": []}
     
     # Initialize Tools
-    # Agent 3: Strategist - Complex Reasoning & ROI -> gpt-4o
-    llm = ChatOpenAI(temperature=0, model="gpt-4o")
-    tavily = TavilySearchResults(k=3) if tavily_key else None
+    research = get_market_research(state.get("workspace_id"))
     python_repl = PythonREPL()
 
-    for signal in anomalies:
-        # 1. Match Signal to Backlog (Selection Phase)
-        related_insight = next((i for i in insights if i["signal_id"] == signal["id"]), None)
-        context_str = f"Context: {related_insight['content']}" if related_insight else ""
-        
-        system_prompt = """You are a Senior Strategic Transformation Architect.
-Your goal is to align operational problems with the most high-leverage digital transformation initiatives from the backlog.
-You generally favor 'Platform' solutions over point solutions if the problem is systemic.
-Verify that the solution directly addresses the root cause described in the context.
+    # 1. Match Signals to Backlog (Selection Phase) - deterministic ranking over the whole backlog
+    insight_by_signal = {i["signal_id"]: i for i in insights}
+    regions = state.get("regions") or audit_regions(anomalies)
+    relevance = relevance_matrix(matcher, anomalies, insights, regions)
+    ranked = {s["id"]: matcher.top(row) for s, row in zip(anomalies, relevance)}
+    # signal id -> (backlog position, complexity estimate or None for the backlog's own)
+    selections = {
+        signal_id: (candidates[0]["position"], None) for signal_id, candidates in ranked.items() if candidates
+    }
+    ambiguous = [s for s in anomalies if matcher.is_ambiguous(ranked[s["id"]]) and ranked[s["id"]]]
+    print(f"Matched {len(selections) - len(ambiguous)}/{len(anomalies)} signals deterministically, "
+          f"{len(ambiguous)} ambiguous.")
 
-MATCHING RULES:
-- For revenue drops in a specific region, look for transformations that address that region or competitive issues
-- For customer churn or migration friction, look for retention or migration-related transformations (e.g., TRANS-001)
-- For segment/tier divergence (Enterprise vs Starter), look for growth or marketing transformations (e.g., TRANS-032)
-- For operational bottlenecks or compliance friction, look for automation or process improvement transformations (e.g., TRANS-014)
-- Prioritize transformations with CRITICAL or High strategic alignment
-- Match based on department, pain point, and impact size
-"""
+    if ambiguous and api_key:
+        # Agent 3: Strategist - Complex Reasoning & ROI -> gpt-4o, shown only the top candidates
+        # JSON mode: replies are always a syntactically valid JSON object
+        llm = ChatOpenAI(temperature=0, model=DEFAULT_MODEL, model_kwargs={"response_format": {"type": "json_object"}})
+        matches = fan_out(
+            llm,
+            ambiguous,
+            build_prompt=lambda signal: build_match_prompt(
+                signal, insight_by_signal.get(signal["id"]), candidates_str(ranked[signal["id"]])
+            ),
+            build_packed_prompt=lambda signals: build_packed_match_prompt(
+                signals, insight_by_signal,
+                candidates_str(list({c["position"]: c for s in signals for c in ranked[s["id"]]}.values()))
+            ),
+            parse_reply=parse_match,
+            label="Strategist LLM",
+            scope=cache_scope(state, "strategist"),
+        )
+        for signal, match_json in zip(ambiguous, matches):
+            if not match_json:
+                continue  # Keep the top-ranked candidate
+            candidates = [c["position"] for c in ranked[signal["id"]]] + list(range(len(matcher.items)))
+            chosen = next((p for p in candidates if matcher.items[p].get("id") == match_json["project_id"]), None)
+            if chosen is not None:
+                selections[signal["id"]] = (chosen, match_json.get("complexity_points"))
+    elif ambiguous:
+        print("Missing OPENAI_API_KEY: using the top-ranked candidate for ambiguous signals.")
+        note_fallback("no OPENAI_API_KEY")
+
+    # 2. Market Research (Validation Phase) - one batch, concurrent across signals
+    # Queries use the stable parts of a signal so repeat audits hit the result cache
+    matched = [s for s in anomalies if s["id"] in selections]
+    queries = [
+        f"industry trends solution for {s['type']} in {s.get('segment', '')} and {matcher.items[selections[s['id']][0]]['title']}"
+        for s in matched
+    ]
+    search_results = research.lookup_many(queries, bypass=bool(state.get("cache_bypass")))
+
+    # 3. ROI Scoring - every (signal, backlog item) pair in one vectorized pass
+    rows = {s["id"]: row for row, s in enumerate(anomalies)}
+    overrides = {
+        (rows[signal_id], position): points
+        for signal_id, (position, points) in selections.items() if points is not None
+    }
+    scores = score_pairs(matcher.items, relevance, overrides)
+
+    for signal, results in zip(matched, search_results):
+        position, _ = selections[signal["id"]]
+        row = rows[signal["id"]]
+        selected_project = matcher.items[position]
 
-        human_prompt = f"""
-        Signal Detected: {signal['description']} ({signal['value']} impact in {signal.get('segment', 'Unknown')} segment).
-        {context_str}
-        
-        Available Transformation Projects:
-        {backlog_str}
-        
-        Task: Select the BEST project from the backlog that directly solves this signal.
-        
-        MATCHING GUIDELINES:
-        - If signal mentions "EMEA", "Professional tier", "Enterprise tier", or "tier growth" → Select TRANS-032 (EMEA Growth Multiplier)
-        - If signal mentions "NorthAm", "compliance", "legal", or "contract review" → Select TRANS-014 (Automated Contract Reviewer)
-        - If signal mentions "APAC", "churn", "migration", "Zenith", or "GlobalStack" → Select TRANS-001 (AI Competitive Switch-Kit)
-        - If signal mentions "revenue drop" or "revenue leak" → Select TRANS-001 (AI Competitive Switch-Kit)
-        
-        Return ONLY valid JSON with this exact format:
-        {{"project_id": "TRANS-XXX", "complexity_points": <number>}}
-        
-        Example: {{"project_id": "TRANS-001", "complexity_points": 40}}
-        """
-        match_res = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=human_prompt)
-        ]).content
-        try:
-            # Extract JSON from response
-            json_match = re.search(r'\{.*?\}', match_res, re.DOTALL)
-            if not json_match:
-                print(f"No JSON found in LLM response: {match_res[:200]}")
-                continue
-                
-            match_json = json.loads(json_match.group())
-            project_id = match_json.get("project_id")
-            complexity = match_json.get("complexity_points", 5)
-            selected_project = next((p for p in backlog_data if p["id"] == project_id), None)
-            if not selected_project: continue
-        except Exception as e:
-            print(f"Error parsing LLM response for signal '{signal['description']}': {e}. Response: {match_res[:200]}")
-            continue
-
-        # 2. Market Research (Validation Phase)
         market_context = "No market data (missing API key)."
-        if tavily:
-            try:
-                query = f"industry trends solution for {signal['description']} and {selected_project['title']}"
-                search_results = tavily.invoke(query)
-                market_context = "\n".join([r['content'][:200] for r in search_results])
-            except Exception as e:
-                print(f"Tavily error: {e}")
-
-        # 3. ROI Calculation using backlog's impact_usd
+        if research.available:
+            market_context = "\n".join([r['content'][:200] for r in results]) or "No market data found."
+
         # Use the pre-defined impact from the backlog
-        impact_usd = selected_project.get('impact_usd', 0)
-        cost_usd = complexity * 20_000  # $20k per complexity point
-        
-        # Calculate ROI multiple
-        roi_multiple = impact_usd / cost_usd if cost_usd > 0 else 0
-        net_strategic_value = impact_usd - cost_usd
+        impact_usd = scores["impact"][row, position]
+        roi_multiple = scores["roi"][row, position]
+        net_strategic_value = float(scores["nsv"][row, position])
         
         # Format ROI string
         roi_str = f"{roi_multiple:.1f}x" if roi_multiple > 0 else "N/A"
 
         # 4. Final Synthesis
         recommendations.append({
+            "signal_id": signal["id"],
             "project_title": selected_project['title'],
             "impact_usd": int(impact_usd),  # Use backlog's impact
-            "feasibility_score": 8,  # Could be calculated based on complexity
+            "feasibility_score": int(scores["feasibility"][row, position]),
             "market_context": market_context[:1500],
             "technical_spec": selected_project.get("tech_spec", selected_project.get("description", "")),
             "roi_metric": roi_str,  # Properly formatted ROI
@@ -149,3 +239,40 @@ MATCHING RULES:
     
     print(f"Generated {len(recommendations)} enriched recommendations.")
     return {"recommendations": recommendations}
+
+
+def portfolio_agent(state: AgentState):
+    """
+    Portfolio Planner: joins the per-signal Strategist branches.
+    Selects the budget-constrained project portfolio over the whole backlog (see portfolio.py),
+    flags the recommendations it funds and sorts them by Net Strategic Value.
+    """
+    print("--- Portfolio Planner: Budget Allocation ---")
+
+    anomalies = state.get("anomalies", [])
+    recommendations = list(state.get("recommendations", []))
+    if not anomalies or not recommendations:
+        return {"recommendations": recommendations, "portfolio": {}}
+
+    try:
+        matcher = get_backlog_matcher(state["backlog_data_path"])
+    except Exception as e:
+        print(f"Error reading backlog: {e}")
+        note_fallback("backlog unreadable")
+        return {"recommendations": recommendations, "portfolio": {}}
+
+    regions = state.get("regions") or audit_regions(anomalies)
+    relevance = relevance_matrix(matcher, anomalies, state.get("context_insights", []), regions)
+    portfolio = plan_portfolio(matcher.items, score_pairs(matcher.items, relevance), get_budget())
+    funded = set(portfolio["projects"])
+    budget = portfolio["budget_usd"]
+    print(f"Portfolio: {len(funded)} of {portfolio['candidates']} candidate projects funded "
+          f"({'no budget cap' if budget is None else f'budget ${budget:,.0f}'}), "
+          f"cost ${portfolio['total_cost_usd']:,.0f}, NSV ${portfolio['total_nsv_usd']:,.0f}.")
+
+    recommendations = [
+        {**r, "in_portfolio": (r.get("evidence_json") or {}).get("entry", {}).get("id") in funded}
+        for r in recommendations
+    ]
+    recommendations.sort(key=lambda x: x["net_strategic_value"], reverse=True)
+    return {"recommendations": recommendations, "portfolio": portfolio}
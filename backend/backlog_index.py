@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List
+import numpy as np
+from llm_cache import file_digest
+from context_index import TYPE_KEYWORDS
+
+# Fields indexed per backlog item, with their weight in the score
+FIELD_WEIGHTS = {"title": 2.0, "pain_point": 2.5, "dept": 1.5, "tech_spec": 1.0}
+ALIGNMENT_WEIGHTS = {"critical": 1.3, "high": 1.15, "medium": 1.0, "low": 0.9}
+REGION_BOOST = 1.5       # Item names the signal's region
+OTHER_REGION_PENALTY = 0.5  # Item names a different sales region
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DEFAULT_TOP_K = 5
+AMBIGUITY_RATIO = 0.8  # Runner-up within 80% of the best score => ask the LLM
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "because", "by", "for", "from", "in", "into", "is", "it",
+    "its", "of", "on", "or", "our", "than", "that", "the", "their", "this", "to", "vs", "was", "we",
+    "were", "with", "month", "average", "revenue"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords, lightly stemmed ("switching" -> "switch")."""
+    tokens = []
+    for word in re.findall(r'[a-z0-9]+', str(text).lower()):
+        if word in STOPWORDS or len(word) < 2 or word.isdigit():
+            continue
+        for suffix in ("ing", "ers", "ed", "es", "er", "s"):
+            if len(word) > len(suffix) + 3 and word.endswith(suffix):
+                word = word[:-len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+
+class BacklogMatcher:
+    """
+    In-memory inverted index over a transformation backlog (dept, pain_point, title, tech_spec).
+    - scores() scores every item against a signal (+ its investigator insight) with field-weighted BM25,
+      only touching the postings of the query terms, then applies strategic_alignment and region weights;
+      rank() returns the top-k of those scores.
+    - is_ambiguous() tells whether the top matches are too close to call without the LLM.
+    """
+
+    def __init__(self, backlog: List[Dict[str, Any]]):
+        self.items = backlog
+        counts_per_item = []
+        for item in backlog:
+            counts: Counter = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(item.get(field, "")):
+                    counts[token] += weight
+            counts_per_item.append(counts)
+
+        lengths = np.array([sum(c.values()) for c in counts_per_item], dtype=np.float64)
+        avg_length = lengths.mean() if len(lengths) else 1.0
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (avg_length or 1.0))
+        postings: Dict[str, List[tuple]] = defaultdict(list)
+        for position, counts in enumerate(counts_per_item):
+            for token, tf in counts.items():
+                postings[token].append((position, tf))
+
+        # Posting lists hold the full (query-independent) BM25 term weight per item
+        self.postings: Dict[str, tuple] = {}
+        for token, docs in postings.items():
+            positions = np.array([d[0] for d in docs], dtype=np.int64)
+            tf = np.array([d[1] for d in docs], dtype=np.float64)
+            idf = math.log(1 + (len(backlog) - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[token] = (positions, idf * tf * (BM25_K1 + 1) / (tf + norms[positions]))
+        self.alignment = np.array([
+            ALIGNMENT_WEIGHTS.get(str(item.get("strategic_alignment", "")).lower(), 1.0) for item in backlog
+        ], dtype=np.float64)
+
+    @staticmethod
+    def query_terms(signal: Dict[str, Any], insight: Dict[str, Any] = None) -> Counter:
+        """Signal description/segment/type, the type's keyword expansion and the insight text."""
+        signal_type = signal.get("type", "")
+        type_key = "leak" if ("leak" in signal_type.lower() or "-" in str(signal.get("value", ""))) else "growth"
+        parts = [signal.get("description", ""), signal.get("segment", ""), signal_type] + TYPE_KEYWORDS[type_key]
+        if insight:
+            parts.append(insight.get("content", ""))
+            parts.append((insight.get("evidence_txt") or {}).get("excerpt", ""))
+            parts.append((insight.get("employee_attribution") or {}).get("proposal_summary", ""))
+        return Counter(token for part in parts for token in tokenize(part or ""))
+
+    def scores(
+        self,
+        signal: Dict[str, Any],
+        insight: Dict[str, Any] = None,
+        regions: Iterable[str] = ()
+    ) -> np.ndarray:
+        """
+        Match score of every backlog item for a signal (0 = no shared terms).
+        regions: every sales region in the audit, so items about another region are demoted.
+        """
+        scores = np.zeros(len(self.items), dtype=np.float64)
+        for token, query_tf in self.query_terms(signal, insight).items():
+            posting = self.postings.get(token)
+            if posting is not None:
+                positions, weights = posting
+                scores[positions] += weights * (1 + math.log(query_tf))
+        scores *= self.alignment
+
+        segment = signal.get("segment", "")
+        region = next(iter(tokenize(segment.split()[0])), None) if segment else None
+        multiplier = np.ones(len(self.items), dtype=np.float64)
+        for other in {t for r in regions for t in tokenize(r)} - {region}:
+            if other in self.postings:
+                multiplier[self.postings[other][0]] = OTHER_REGION_PENALTY
+        if region in self.postings:
+            multiplier[self.postings[region][0]] = REGION_BOOST
+        return scores * multiplier
+
+    def top(self, scores: np.ndarray, k: int = None) -> List[Dict[str, Any]]:
+        """Top-k items of a score vector: [{"position", "id", "score", "item"}], best first."""
+        k = k or DEFAULT_TOP_K
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        # Best first; ties keep backlog order
+        matched = matched[np.lexsort((matched, -scores[matched]))]
+        return [
+            {"position": int(p), "id": self.items[p].get("id"), "score": round(float(scores[p]), 4),
+             "item": self.items[p]}
+            for p in matched
+        ]
+
+    def rank(
+        self,
+        signal: Dict[str, Any],
+        insight: Dict[str, Any] = None,
+        k: int = None,
+        regions: Iterable[str] = ()
+    ) -> List[Dict[str, Any]]:
+        """Top-k backlog items for a signal (see scores() and top())."""
+        return self.top(self.scores(signal, insight, regions), k)
+
+    @staticmethod
+    def is_ambiguous(ranked: List[Dict[str, Any]], ratio: float = None) -> bool:
+        """No match at all, or a runner-up scoring within `ratio` of the best."""
+        ratio = ratio or float(os.getenv("BACKLOG_AMBIGUITY_RATIO", AMBIGUITY_RATIO))
+        if not ranked or ranked[0]["score"] <= 0:
+            return True
+        return len(ranked) > 1 and ranked[1]["score"] >= ratio * ranked[0]["score"]
+
+
+_matchers: Dict[str, BacklogMatcher] = {}
+
+
+def get_backlog_matcher(backlog_path: str) -> BacklogMatcher:
+    """Process-wide matcher per backlog file content (re-indexed only when the file changes)."""
+    digest = file_digest(backlog_path)
+    if digest not in _matchers:
+        with open(backlog_path, "r") as f:
+            _matchers[digest] = BacklogMatcher(json.load(f))
+    return _matchers[digest]
@@ -0,0 +1,297 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import List, Dict, Any, Iterator, Optional
+from llm_cache import DEFAULT_CACHE_DIR, DEFAULT_WORKSPACE, env_path, file_digest, workspace_cache_path
+from telemetry import traced
+
+# "2025-11-12 [SLACK]: #apac-sales - Hiroshi Tanaka: message"
+ENTRY_HEADER = re.compile(r'^\s*(\d{4}-\d{2}-\d{2})\s*\[([^\]]+)\]:\s*(.*)$', re.DOTALL)
+SLACK_AUTHOR = re.compile(r'^#[\w-]+\s+-\s+([^:]+?):')
+FROM_AUTHOR = re.compile(r'From:\s*([^|\n]+)')
+
+DEFAULT_TOP_K = 6
+CANDIDATE_POOL = 50
+INSERT_BATCH = 5000
+
+# Extra terms per anomaly type so e.g. a leak also finds churn/acquisition chatter
+TYPE_KEYWORDS = {
+    "leak": ["drop", "dropped", "churn", "lost", "acquisition", "acquired", "migration", "competitor",
+             "GlobalStack", "bottleneck", "friction", "compliance", "delayed"],
+    "growth": ["growth", "expansion", "momentum", "outlier", "crushing", "lookalike", "proposal", "LTV"],
+}
+
+
+_embedder = None
+
+
+def get_embedder():
+    """
+    Optional local embedding model (CONTEXT_EMBEDDING_MODEL, e.g. "all-MiniLM-L6-v2").
+    Requires sentence-transformers; returns None when disabled or not installed.
+    """
+    global _embedder
+    model_name = os.getenv("CONTEXT_EMBEDDING_MODEL")
+    if not model_name:
+        return None
+    if _embedder is None or _embedder[0] != model_name:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print("⚠️ CONTEXT_EMBEDDING_MODEL set but sentence-transformers is not installed. Using BM25 only.", flush=True)
+            return None
+        _embedder = (model_name, SentenceTransformer(model_name))
+    return _embedder[1]
+
+
+def _parse_author(channel: str, body: str) -> str:
+    """Best-effort author extraction for the dump's Slack / Email / Memo conventions."""
+    match = SLACK_AUTHOR.match(body)
+    if match:
+        author = match.group(1)
+    else:
+        match = FROM_AUTHOR.search(body)
+        if match:
+            author = match.group(1)
+        else:
+            # "CFO Sarah J: ...", "Legal Dept - ...", "Marcus Thorne (Legal Tech Lead) to Sales Leadership - ..."
+            author = re.split(r'\s+-\s+|:', body, maxsplit=1)[0]
+            author = re.split(r'\s+to\s+', author, maxsplit=1)[0]
+    author = re.sub(r'\s*\(.*?\)', '', author).strip()
+    return author[:80]
+
+
+def parse_entry(raw: str) -> Optional[Dict[str, str]]:
+    """Splits one dump entry into date, channel, author and text."""
+    raw = raw.strip()
+    if not raw:
+        return None
+    match = ENTRY_HEADER.match(raw)
+    if not match:
+        return {"date": "", "channel": "UNKNOWN", "author": "", "text": raw}
+    date, channel, body = match.groups()
+    channel = channel.strip().upper()
+    return {"date": date, "channel": channel, "author": _parse_author(channel, body), "text": raw}
+
+
+def iter_entries(path: str) -> Iterator[Dict[str, str]]:
+    """Streams entries from the context dump, split on '---' separator lines."""
+    buffer = []
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            if line.strip() == "---":
+                entry = parse_entry("".join(buffer))
+                if entry:
+                    yield entry
+                buffer = []
+            else:
+                buffer.append(line)
+    entry = parse_entry("".join(buffer))
+    if entry:
+        yield entry
+
+
+class ContextIndex:
+    """
+    Persisted BM25 index (SQLite FTS5) over the internal context dump.
+    Rebuilt only when the source file's content digest changes.
+    """
+
+    def __init__(self, source_path: str, index_dir: str = None):
+        self.source_path = source_path
+        index_dir = index_dir or env_path("CONTEXT_INDEX_DIR", os.path.join(DEFAULT_CACHE_DIR, "context_index"))
+        os.makedirs(index_dir, exist_ok=True)
+        name = hashlib.sha256(os.path.abspath(source_path).encode()).hexdigest()[:16]
+        self.index_path = os.path.join(index_dir, f"{name}.sqlite")
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    def _indexed_digest(self, conn: sqlite3.Connection) -> Optional[str]:
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row else None
+
+    def ensure_built(self) -> bool:
+        """Build the index if missing or stale. Returns True if a rebuild happened."""
+        digest = file_digest(self.source_path)
+        if digest is None:
+            raise FileNotFoundError(self.source_path)
+        # Enabling/changing the embedding model also invalidates the index
+        digest = f"{digest}:{os.getenv('CONTEXT_EMBEDDING_MODEL', '')}"
+        with self._lock, self._connect() as conn:
+            if self._indexed_digest(conn) == digest:
+                return False
+            self._build(conn, digest)
+        return True
+
+    @traced("load", "context_index")
+    def _build(self, conn: sqlite3.Connection, digest: str):
+        print(f"📚 Indexing context file {os.path.basename(self.source_path)}...", flush=True)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("DROP TABLE IF EXISTS entries")
+        conn.execute("DROP TABLE IF EXISTS entries_fts")
+        conn.execute("DROP TABLE IF EXISTS embeddings")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "CREATE TABLE entries (id INTEGER PRIMARY KEY, date TEXT, channel TEXT, author TEXT, text TEXT)"
+        )
+        conn.execute("CREATE INDEX idx_entries_date ON entries(date)")
+        conn.execute("CREATE INDEX idx_entries_channel ON entries(channel)")
+        conn.execute(
+            "CREATE VIRTUAL TABLE entries_fts USING fts5(author, text, content='entries', content_rowid='id', "
+            "tokenize='porter unicode61')"
+        )
+
+        count = 0
+        batch = []
+        for entry in iter_entries(self.source_path):
+            batch.append((entry["date"], entry["channel"], entry["author"], entry["text"]))
+            if len(batch) >= INSERT_BATCH:
+                conn.executemany("INSERT INTO entries (date, channel, author, text) VALUES (?, ?, ?, ?)", batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            conn.executemany("INSERT INTO entries (date, channel, author, text) VALUES (?, ?, ?, ?)", batch)
+            count += len(batch)
+
+        conn.execute("INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')")
+
+        embedder = get_embedder()
+        if embedder is not None:
+            conn.execute("CREATE TABLE embeddings (id INTEGER PRIMARY KEY, vector BLOB)")
+            cursor = conn.execute("SELECT id, text FROM entries ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(256)
+                if not rows:
+                    break
+                vectors = embedder.encode([r[1] for r in rows], normalize_embeddings=True)
+                conn.executemany(
+                    "INSERT INTO embeddings (id, vector) VALUES (?, ?)",
+                    [(r[0], v.astype("float32").tobytes()) for r, v in zip(rows, vectors)]
+                )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('digest', ?)", (digest,))
+        print(f"  Indexed {count} context entries.", flush=True)
+
+    def search(
+        self,
+        terms: List[str],
+        k: int = DEFAULT_TOP_K,
+        boost_terms: List[str] = None,
+        channels: List[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        BM25 search over entries. Candidates containing any boost_terms (e.g. the signal's
+        region) are ranked first. Returns up to k entries with their score.
+        """
+        self.ensure_built()
+        tokens = sorted({t.lower() for term in terms for t in re.findall(r'\w+', term) if len(t) > 1})
+        if not tokens:
+            return []
+        query = " OR ".join(f'"{t}"' for t in tokens)
+        sql = (
+            "SELECT e.id, e.date, e.channel, e.author, e.text, bm25(entries_fts) AS rank "
+            "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid "
+            "WHERE entries_fts MATCH ?"
+        )
+        params: List[Any] = [query]
+        if channels:
+            sql += f" AND e.channel IN ({','.join('?' * len(channels))})"
+            params.extend(c.upper() for c in channels)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(max(k, CANDIDATE_POOL))
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            similarity = self._similarity(conn, " ".join(terms), [r[0] for r in rows])
+
+        boosts = [b.lower() for b in (boost_terms or []) if b]
+        results = []
+        for entry_id, date, channel, author, text, rank in rows:
+            lowered = text.lower()
+            boost = sum(1 for b in boosts if b in lowered)
+            # bm25() is negative (lower is better); flip it so higher is better
+            results.append({
+                "id": entry_id,
+                "date": date,
+                "channel": channel,
+                "author": author,
+                "text": text,
+                "score": round(-rank + similarity.get(entry_id, 0.0), 4),
+                "boost": boost
+            })
+        results.sort(key=lambda r: (r["boost"], r["score"]), reverse=True)
+        # Recurring posts (same text on several dates) take one slot, so the top k stay distinct
+        return dedupe_entries(results)[:k]
+
+    def _similarity(self, conn: sqlite3.Connection, query: str, ids: List[int]) -> Dict[int, float]:
+        """Cosine similarity of candidates to the query when local embeddings are enabled."""
+        embedder = get_embedder()
+        if embedder is None or not ids:
+            return {}
+        import numpy as np
+        rows = conn.execute(
+            f"SELECT id, vector FROM embeddings WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        if not rows:
+            return {}
+        query_vec = embedder.encode([query], normalize_embeddings=True)[0]
+        matrix = np.vstack([np.frombuffer(v, dtype=np.float32) for _, v in rows])
+        scores = matrix @ query_vec
+        return {r[0]: float(s) for r, s in zip(rows, scores)}
+
+    def retrieve_for_signal(self, signal: Dict[str, Any], k: int = None) -> List[Dict[str, Any]]:
+        """Top-k context entries for an anomaly, by segment, anomaly type and keyword."""
+        k = k or int(os.getenv("CONTEXT_TOP_K", DEFAULT_TOP_K))
+        segment = signal.get("segment", "")
+        signal_type = signal.get("type", "")
+        type_key = "leak" if ("leak" in signal_type.lower() or "-" in str(signal.get("value", ""))) else "growth"
+        terms = [segment, signal_type, signal.get("metric", "")] + TYPE_KEYWORDS[type_key]
+        # Region is the strongest locality signal (tiers like "Enterprise" appear everywhere)
+        region = segment.split()[0] if segment else ""
+        return self.search(terms, k=k, boost_terms=[region])
+
+
+_indexes: Dict[tuple, ContextIndex] = {}
+
+
+def get_context_index(source_path: str, workspace_id: str = None) -> ContextIndex:
+    """Process-wide index per context file, stored in its workspace's cache (CONTEXT_INDEX_DIR)."""
+    key = (workspace_id or DEFAULT_WORKSPACE, os.path.abspath(source_path))
+    if key not in _indexes:
+        _indexes[key] = ContextIndex(source_path, workspace_cache_path(workspace_id, "context_index", "CONTEXT_INDEX_DIR"))
+    return _indexes[key]
+
+
+def dedupe_entries(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Keeps the first of the entries posted with the same channel and text (e.g. a recurring
+    "Lost and found" email); the dates of the others are listed in its "repeats".
+    """
+    unique: List[Dict[str, Any]] = []
+    by_text: Dict[tuple, Dict[str, Any]] = {}
+    for entry in entries:
+        match = ENTRY_HEADER.match(entry["text"])
+        body = match.group(3) if match else entry["text"]
+        key = (entry["channel"], " ".join(body.lower().split()))
+        first = by_text.get(key)
+        if first is None:
+            by_text[key] = {**entry, "repeats": list(entry.get("repeats", []))}
+            unique.append(by_text[key])
+        elif entry.get("id") != first.get("id"):
+            dates = [entry["date"]] + list(entry.get("repeats", []))
+            first["repeats"].extend(d for d in dates if d and d != first["date"] and d not in first["repeats"])
+    return unique
+
+
+def format_entries(entries: List[Dict[str, Any]]) -> str:
+    """Renders retrieved entries verbatim for the prompt (keeps excerpts quotable)."""
+    return "\n\n---\n\n".join(
+        e["text"] + (f"\n(Also posted on {', '.join(e['repeats'])})" if e.get("repeats") else "")
+        for e in entries
+    )
@@ -0,0 +1,218 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from llm_cache import DEFAULT_CACHE_DIR, DEFAULT_WORKSPACE, env_path, file_digest, workspace_cache_path
+from sales_data import iter_sales_chunks
+
+DEFAULT_DEPTH = 25  # Rows kept per key and ordering (top-k lookups up to this k)
+
+# Key kinds, most specific first (used to break ties when resolving a segment name)
+KEY_KINDS = ["segment", "account", "rep", "region", "tier", "all"]
+ALL_KEY = "all:all deals"  # Every row (fallback when a segment name resolves to nothing)
+KIND_COLUMNS = {
+    "region": ["Region"],
+    "tier": ["Product_Tier"],
+    "segment": ["Region", "Product_Tier"],
+    "rep": ["Sales_Rep"],
+    "account": ["Account_Name"],
+    "all": [],
+}
+
+
+def normalize_segment(text: str) -> str:
+    """'APAC-Enterprise ' -> 'apac enterprise'"""
+    return re.sub(r'[^a-z0-9]+', ' ', str(text).lower()).strip()
+
+
+class SegmentEvidenceIndex:
+    """
+    Per-dataset evidence index (one SQLite file per sales file content digest).
+    - Normalized keys (region, tier, region+tier segment, rep, account) map to row-position
+      arrays pre-sorted by date (newest first) and by deal size (largest first).
+    - The referenced rows are stored ready to serve, so top-k evidence is one key lookup
+      plus one primary-key fetch, whatever the dataset size.
+    - resolve() maps a free-form segment name onto the closest key.
+    """
+
+    def __init__(self, csv_path: str, index_dir: str = None, depth: int = None):
+        self.csv_path = csv_path
+        self.depth = depth or DEFAULT_DEPTH
+        index_dir = index_dir or env_path("EVIDENCE_INDEX_DIR", os.path.join(DEFAULT_CACHE_DIR, "evidence_index"))
+        os.makedirs(index_dir, exist_ok=True)
+        self.digest = file_digest(csv_path)
+        if self.digest is None:
+            raise FileNotFoundError(csv_path)
+        self.index_path = os.path.join(index_dir, f"{self.digest}.sqlite")
+        self._labels: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    def ensure_built(self) -> bool:
+        """Build the index if missing. Returns True if a build happened."""
+        with self._lock:
+            if os.path.exists(self.index_path):
+                return False
+            self._build()
+        return True
+
+    def _key_frame(self, chunk: pd.DataFrame, kind: str) -> Optional[pd.DataFrame]:
+        columns = KIND_COLUMNS[kind]
+        if kind == "segment" and "Segment" in chunk.columns:
+            columns = ["Segment"]
+        if not all(c in chunk.columns for c in columns):
+            return None
+        label = chunk[columns[0]].astype(str) if columns else pd.Series("All deals", index=chunk.index)
+        for column in columns[1:]:
+            label = label + " " + chunk[column].astype(str)
+        return pd.DataFrame({
+            "key": kind + ":" + label.map(normalize_segment),
+            "label": label,
+            "position": chunk.index.to_numpy(),
+            "date": chunk["Date"].to_numpy() if "Date" in chunk.columns else np.datetime64("NaT"),
+            "size": chunk["Deal_Size_USD"].to_numpy() if "Deal_Size_USD" in chunk.columns else np.nan,
+        })
+
+    def _top(self, frame: pd.DataFrame, by: str) -> pd.DataFrame:
+        ordered = frame.sort_values([by, "position"], ascending=[False, True], na_position="last", kind="stable")
+        return ordered.groupby("key", sort=False).head(self.depth)
+
+    def _build(self):
+        print(f"📇 Indexing evidence rows of {os.path.basename(self.csv_path)}...", flush=True)
+        by_date = by_size = None
+        counts: Dict[str, int] = {}
+        labels: Dict[str, str] = {}
+
+        # Pass 1: running top-k positions per key (memory bounded by keys x depth)
+        for chunk in iter_sales_chunks(self.csv_path, float_dtype='float64'):
+            frames = [f for f in (self._key_frame(chunk, kind) for kind in KEY_KINDS) if f is not None]
+            if not frames:
+                continue
+            keyed = pd.concat(frames, ignore_index=True)
+            for key, count in keyed["key"].value_counts().items():
+                counts[key] = counts.get(key, 0) + int(count)
+            labels.update(keyed.drop_duplicates("key").set_index("key")["label"].to_dict())
+            by_date = self._top(keyed if by_date is None else pd.concat([by_date, keyed]), "date")
+            by_size = self._top(keyed if by_size is None else pd.concat([by_size, keyed]), "size")
+
+        if by_date is None:
+            raise ValueError("no indexable sales columns")
+
+        # Pass 2: materialize the referenced rows (dates as strings, exact amounts)
+        wanted = set(by_date["position"]).union(by_size["position"])
+        rows = []
+        for chunk in iter_sales_chunks(self.csv_path, float_dtype='float64'):
+            hit = chunk[chunk.index.isin(wanted)]
+            if hit.empty:
+                continue
+            if "Date" in hit.columns:
+                hit = hit.assign(Date=hit["Date"].dt.strftime('%Y-%m-%d'))
+            records = json.loads(hit.to_json(orient='records'))
+            rows.extend((int(p), json.dumps(r)) for p, r in zip(hit.index, records))
+
+        date_positions = by_date.groupby("key", sort=False)["position"].apply(lambda p: p.to_numpy(dtype=np.int64))
+        size_positions = by_size.groupby("key", sort=False)["position"].apply(lambda p: p.to_numpy(dtype=np.int64))
+
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(
+                "CREATE TABLE keys (key TEXT PRIMARY KEY, label TEXT, rows INTEGER, by_date BLOB, by_size BLOB)"
+            )
+            conn.execute("CREATE TABLE rows (position INTEGER PRIMARY KEY, row TEXT NOT NULL)")
+            conn.executemany(
+                "INSERT INTO keys (key, label, rows, by_date, by_size) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (key, labels[key], counts[key], date_positions[key].tobytes(), size_positions[key].tobytes())
+                    for key in date_positions.index
+                ]
+            )
+            conn.executemany("INSERT INTO rows (position, row) VALUES (?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.index_path)
+        print(f"  Indexed {len(date_positions)} segment keys ({len(rows)} evidence rows).", flush=True)
+
+    def labels(self) -> Dict[str, str]:
+        """key -> display label for every indexed key."""
+        if self._labels is None:
+            self.ensure_built()
+            with self._connect() as conn:
+                self._labels = dict(conn.execute("SELECT key, label FROM keys").fetchall())
+        return self._labels
+
+    def resolve(self, text: str) -> Optional[str]:
+        """
+        Best key for a free-form segment name ("APAC Enterprise", "emea", "Enterprize APAC", "Sarah Chen").
+        1. Exact normalized label match (most specific kind first).
+        2. The most specific key whose label tokens all appear in the text (after fixing token typos).
+        3. Closest whole label by similarity.
+        Returns None when nothing is close.
+        """
+        query = normalize_segment(text)
+        if not query:
+            return None
+        labels = self.labels()
+        rank = {kind: i for i, kind in enumerate(KEY_KINDS)}
+        keys = sorted(labels, key=lambda k: rank.get(k.split(":", 1)[0], len(rank)))
+
+        for key in keys:
+            if key.split(":", 1)[1] == query:
+                return key
+
+        names = {k.split(":", 1)[1]: k for k in reversed(keys)}
+        vocabulary = {word for name in names for word in name.split()}
+        # Snap each token onto the indexed vocabulary ("enterprize" -> "enterprise")
+        tokens = set()
+        for token in query.split():
+            match = token if token in vocabulary else next(iter(difflib.get_close_matches(token, vocabulary, n=1, cutoff=0.8)), None)
+            if match:
+                tokens.add(match)
+        contained = [k for k in keys if set(k.split(":", 1)[1].split()) <= tokens]
+        if contained:
+            # More tokens = more specific; max() keeps the kind order for ties
+            return max(contained, key=lambda k: len(k.split(":", 1)[1].split()))
+
+        close = difflib.get_close_matches(query, list(names), n=1, cutoff=0.75)
+        return names[close[0]] if close else None
+
+    def top(self, key: str, k: int = 10, by: str = "date") -> List[Dict[str, Any]]:
+        """Top-k rows for a key, newest first (by="date") or largest deal first (by="deal_size")."""
+        self.ensure_built()
+        column = "by_date" if by == "date" else "by_size"
+        with self._connect() as conn:
+            found = conn.execute(f"SELECT {column} FROM keys WHERE key = ?", (key,)).fetchone()
+            if not found:
+                return []
+            positions = np.frombuffer(found[0], dtype=np.int64)[:k].tolist()
+            stored = dict(conn.execute(
+                f"SELECT position, row FROM rows WHERE position IN ({','.join('?' * len(positions))})", positions
+            ).fetchall())
+        return [json.loads(stored[p]) for p in positions if p in stored]
+
+    def row_count(self, key: str) -> int:
+        with self._connect() as conn:
+            found = conn.execute("SELECT rows FROM keys WHERE key = ?", (key,)).fetchone()
+        return found[0] if found else 0
+
+
+_indexes: Dict[tuple, SegmentEvidenceIndex] = {}
+
+
+def get_evidence_index(csv_path: str, workspace_id: str = None) -> SegmentEvidenceIndex:
+    """
+    Process-wide index per dataset content (rebuilt only for new file contents),
+    stored in its workspace's cache (EVIDENCE_INDEX_DIR).
+    """
+    key = (workspace_id or DEFAULT_WORKSPACE, file_digest(csv_path))
+    if key not in _indexes:
+        _indexes[key] = SegmentEvidenceIndex(csv_path, workspace_cache_path(workspace_id, "evidence_index", "EVIDENCE_INDEX_DIR"))
+    return _indexes[key]
@@ -1,24 +1,206 @@
-from langgraph.graph import StateGraph, END
-from state import AgentState
-from agents.analyst import analyst_agent
+import hashlib
+import json
+import os
+from langgraph.graph import StateGraph, START, END
+from langgraph.cache.sqlite import SqliteCache
+from langgraph.types import CachePolicy, Send
+from state import AgentState, BranchOutput
+from llm import DEFAULT_MODEL, chunked, get_pack_size, track_fallbacks
+from llm_cache import DEFAULT_WORKSPACE, env_path, file_digest, input_digests, workspace_cache_path
+from context_index import get_context_index
+from backlog_index import get_backlog_matcher
+from market_research import get_market_research
+from agents.analyst import analyst_agent, get_analyst_mode
 from agents.investigator import investigator_agent
-from agents.strategist import strategist_agent
+from agents.strategist import strategist_agent, portfolio_agent, audit_regions
 from agents.ghostwriter import ghostwriter_agent
+from telemetry import traced
 
-def create_graph():
+# What each cached node reads (state keys + input files). A node's cached output is reused
+# as long as these are unchanged, so a re-run resumes at the first node whose inputs changed.
+# "enrich" is one per-signal branch (Investigator -> Strategist for its signals).
+NODE_INPUTS = {
+    "analyst": (["incremental"], ["sales_data_path"]),
+    "enrich": (["anomalies", "regions"], ["context_data_path", "backlog_data_path"]),
+    "portfolio": (["anomalies", "context_insights", "recommendations"], ["backlog_data_path"]),
+    "ghostwriter": (["anomalies", "context_insights", "recommendations"], []),
+}
+
+# Settings (env vars) a cached node's output depends on, besides its inputs: a change recomputes the node.
+# API keys only count by their presence (without one, the agents fall back).
+# Nodes calling the LLM also depend on the token budgets (an exhausted budget means template output)
+# and on the tokenizer that counts prompts against them and trims the packed context.
+LLM_NODE_SETTINGS = ["LLM_AUDIT_TOKEN_BUDGET", "LLM_TOKENIZER_ENCODING"]
+NODE_SETTINGS = {
+    "analyst": ["ANALYST_MODE", "LLM_TOKEN_BUDGET_ANALYST"] + LLM_NODE_SETTINGS,
+    "enrich": [
+        "LLM_PACK_SIZE", "INVESTIGATOR_CONTEXT_TOKENS", "CONTEXT_TOP_K", "CONTEXT_EMBEDDING_MODEL",
+        "BACKLOG_AMBIGUITY_RATIO", "MARKET_RESEARCH_PROVIDER", "MARKET_CORPUS_PATH",
+        "LLM_TOKEN_BUDGET_INVESTIGATOR", "LLM_TOKEN_BUDGET_STRATEGIST"
+    ] + LLM_NODE_SETTINGS,
+    "portfolio": ["PORTFOLIO_BUDGET_USD"],
+    "ghostwriter": ["LLM_TOKEN_BUDGET_GHOSTWRITER"] + LLM_NODE_SETTINGS,
+}
+NODE_API_KEYS = {"enrich": ["OPENAI_API_KEY", "TAVILY_API_KEY"]}
+
+# Top-level nodes in execution order (the first three run in parallel)
+NODE_ORDER = ["analyst", "prepare_context", "prepare_backlog", "dispatch", "enrich", "portfolio", "ghostwriter"]
+
+# State handed to every per-signal branch, besides its own signals
+BRANCH_KEYS = [
+    "sales_data_path", "context_data_path", "backlog_data_path", "cache_bypass", "run_id",
+    "input_digests", "regions", "workspace_id"
+]
+
+def node_cache_key(node: str):
+    """Cache key function for a node: digest of its state inputs, input file contents, model and settings."""
+    state_keys, file_keys = NODE_INPUTS[node]
+
+    def key_func(state: AgentState) -> str:
+        digests = state.get("input_digests") or input_digests(state)
+        payload = {
+            "node": node,
+            "state": {k: state.get(k) for k in state_keys},
+            "files": {k: digests.get(k) for k in file_keys},
+            "model": DEFAULT_MODEL,
+            "settings": {name: os.getenv(name) for name in NODE_SETTINGS[node]},
+            "api_keys": {name: bool(os.getenv(name)) for name in ["OPENAI_API_KEY"] + NODE_API_KEYS.get(node, [])}
+        }
+        if node == "analyst":
+            payload["mode"] = get_analyst_mode()
+        if node == "enrich" and os.getenv("MARKET_CORPUS_PATH"):
+            # The Strategist's local market research corpus counts by content, like the input files
+            payload["market_corpus"] = file_digest(env_path("MARKET_CORPUS_PATH"))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    return key_func
+
+
+class NodeCache(SqliteCache):
+    """
+    Node output cache that never stores the output of a node that degraded (non-empty "degraded"
+    update, see llm.note_fallback): the next run computes it again instead of reusing the fallback.
+    With refresh (cache_bypass runs), lookups always miss and the fresh outputs overwrite the entries.
+    """
+
+    def __init__(self, *, path: str, refresh: bool = False):
+        super().__init__(path=path)
+        self.refresh = refresh
+
+    def get(self, keys):
+        return {} if self.refresh else super().get(keys)
+
+    async def aget(self, keys):
+        return {} if self.refresh else await super().aget(keys)
+
+    def set(self, pairs):
+        super().set(self._storable(pairs))
+
+    async def aset(self, pairs):
+        await super().aset(self._storable(pairs))
+
+    @staticmethod
+    def _storable(pairs):
+        return {
+            key: (writes, ttl) for key, (writes, ttl) in pairs.items()
+            if not any(channel == "degraded" and value for channel, value in writes)
+        }
+
+def get_checkpoint_path(workspace_id: str = None) -> str:
+    """SQLite file holding a workspace's per-run checkpoints (AUDIT_CHECKPOINT_PATH)."""
+    path = workspace_cache_path(workspace_id, "checkpoints.sqlite", "AUDIT_CHECKPOINT_PATH")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return path
+
+_node_caches = {}
+
+def get_node_cache(workspace_id: str = None, refresh: bool = False) -> NodeCache:
+    """
+    Node output cache of a workspace (AUDIT_NODE_CACHE_PATH), shared across its runs.
+    refresh: the write-only view used by cache_bypass runs.
+    """
+    workspace_id = workspace_id or DEFAULT_WORKSPACE
+    if (workspace_id, refresh) not in _node_caches:
+        path = workspace_cache_path(workspace_id, "node_cache.sqlite", "AUDIT_NODE_CACHE_PATH")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _node_caches[(workspace_id, refresh)] = NodeCache(path=path, refresh=refresh)
+    return _node_caches[(workspace_id, refresh)]
+
+def prepare_context(state: AgentState):
+    """Builds the context index while the Analyst runs (the Investigator branches only query it)."""
+    try:
+        get_context_index(state["context_data_path"], state.get("workspace_id")).ensure_built()
+    except Exception as e:
+        print(f"Error indexing context file: {e}")
+    return {}
+
+def prepare_backlog(state: AgentState):
+    """Indexes the backlog and the market research corpus while the Analyst runs."""
+    try:
+        get_backlog_matcher(state["backlog_data_path"])
+        get_market_research(state.get("workspace_id"))
+    except Exception as e:
+        print(f"Error preparing backlog: {e}")
+    return {}
+
+def dispatch(state: AgentState):
+    """Joins the parallel start: records the audit's regions for the per-signal branches."""
+    return {"regions": audit_regions(state.get("anomalies", []))}
+
+def route_signals(state: AgentState):
+    """
+    One Investigator -> Strategist branch per signal (per pack of LLM_PACK_SIZE signals), run in parallel.
+    Stops early when the Analyst found nothing to investigate.
+    """
+    anomalies = state.get("anomalies", [])
+    if not anomalies:
+        return END
+    shared = {k: state.get(k) for k in BRANCH_KEYS}
+    return [Send("enrich", {**shared, "anomalies": pack}) for pack in chunked(anomalies, get_pack_size())]
+
+def create_signal_graph():
+    """Per-signal branch: Investigator then Strategist; hands back its insights and recommendations."""
+    branch = StateGraph(AgentState, output_schema=BranchOutput)
+    branch.add_node("investigator", traced("node", "investigator")(track_fallbacks("investigator")(investigator_agent)))
+    branch.add_node("strategist", traced("node", "strategist")(track_fallbacks("strategist")(strategist_agent)))
+    branch.add_edge(START, "investigator")
+    branch.add_edge("investigator", "strategist")
+    branch.add_edge("strategist", END)
+    return branch.compile()
+
+def create_graph(checkpointer=None, cache=None):
+    """
+    Compiles the workflow:
+      analyst | prepare_context | prepare_backlog (parallel) -> dispatch
+      -> enrich x N (Send: one Investigator -> Strategist branch per signal, in parallel)
+      -> portfolio (join) -> ghostwriter
+    End-to-end latency follows the slowest signal rather than the sum over signals.
+    - checkpointer: LangGraph checkpoint saver; state is saved after every node per thread_id (run ID).
+    - cache: LangGraph node cache (see NodeCache); node outputs are reused when their inputs are unchanged.
+    Every agent node runs in a telemetry span (see telemetry.py); nodes served from the cache don't.
+    """
     workflow = StateGraph(AgentState)
+    ttl = int(float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600)
+
+    def policy(node: str):
+        return CachePolicy(key_func=node_cache_key(node), ttl=ttl) if cache is not None else None
 
     # Add Nodes
-    workflow.add_node("analyst", analyst_agent)
-    workflow.add_node("investigator", investigator_agent)
-    workflow.add_node("strategist", strategist_agent)
-    workflow.add_node("ghostwriter", ghostwriter_agent)
-
-    # Add Edges (Linear flow for V1)
-    workflow.set_entry_point("analyst")
-    workflow.add_edge("analyst", "investigator")
-    workflow.add_edge("investigator", "strategist")
-    workflow.add_edge("strategist", "ghostwriter")
+    workflow.add_node("analyst", traced("node", "analyst")(track_fallbacks("analyst")(analyst_agent)), cache_policy=policy("analyst"))
+    workflow.add_node("prepare_context", traced("node", "prepare_context")(prepare_context))
+    workflow.add_node("prepare_backlog", traced("node", "prepare_backlog")(prepare_backlog))
+    workflow.add_node("dispatch", traced("node", "dispatch")(dispatch))
+    workflow.add_node("enrich", create_signal_graph(), cache_policy=policy("enrich"))
+    workflow.add_node("portfolio", traced("node", "portfolio")(track_fallbacks("portfolio")(portfolio_agent)), cache_policy=policy("portfolio"))
+    workflow.add_node("ghostwriter", traced("node", "ghostwriter")(track_fallbacks("ghostwriter")(ghostwriter_agent)), cache_policy=policy("ghostwriter"))
+
+    # Add Edges: input preparation runs alongside the Analyst, signals fan out, then join
+    for node in ["analyst", "prepare_context", "prepare_backlog"]:
+        workflow.add_edge(START, node)
+    workflow.add_edge(["analyst", "prepare_context", "prepare_backlog"], "dispatch")
+    workflow.add_conditional_edges("dispatch", route_signals, ["enrich", END])
+    workflow.add_edge("enrich", "portfolio")
+    workflow.add_edge("portfolio", "ghostwriter")
     workflow.add_edge("ghostwriter", END)
 
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer, cache=cache)
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import uuid
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+TOKEN_BUFFER = 1024  # Latest LLM token events kept for the attached streams (they are not replayed)
+
+
+class QueueFullError(Exception):
+    """Raised when the audit queue is at capacity."""
+
+
+class AuditJob:
+    """
+    One audit run. Events are kept in an append-only log so any number of clients
+    can (re)attach to the stream from a given offset. LLM token events are the exception:
+    they only go to the streams attached at the time (the memo/result events carry the full text),
+    so a finished job's log doesn't hold every token of its run.
+    """
+
+    def __init__(self, key: str, request: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.request = request
+        self.workspace_id = request.get("workspace_id") or "default"
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.events: List[Dict[str, Any]] = []
+        self._tokens: "deque[tuple]" = deque(maxlen=TOKEN_BUFFER)  # (sequence number, log offset, event)
+        self._token_seq = 0
+        self.progress: Dict[str, str] = {}
+        self.error: Optional[str] = None
+        self.subscribers = 0  # Streams currently attached
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    async def publish(self, event: Dict[str, Any]):
+        if event.get("type") == "progress":
+            self.progress[event["node"]] = event["status"]
+        elif event.get("type") == "error":
+            self.error = event.get("message")
+        async with self._changed:
+            if event.get("type") == "token":
+                self._token_seq += 1
+                self._tokens.append((self._token_seq, len(self.events), event))
+            else:
+                self.events.append(event)
+            self._changed.notify_all()
+
+    async def finish(self, status: str):
+        async with self._changed:
+            self.status = status
+            self.finished_at = datetime.now().isoformat()
+            self._changed.notify_all()
+
+    async def stream(self, offset: int = 0) -> AsyncIterator[tuple]:
+        """
+        Yields (offset, event) from `offset` until the job is done, with the token events published
+        meanwhile in between (offset None). A slow stream may skip token events, never others.
+        """
+        position = max(0, offset)
+        seen = self._token_seq
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._changed:
+                    while position >= len(self.events) and seen == self._token_seq and not self.done:
+                        await self._changed.wait()
+                    pending = self.events[position:]
+                    tokens = [(at, event) for seq, at, event in self._tokens if seq > seen]
+                    seen = self._token_seq
+                    finished = self.done
+                start, end = position, position + len(pending)
+                for at, token in tokens:
+                    # Log events published before the token come first
+                    while position < min(at, end):
+                        yield position, pending[position - start]
+                        position += 1
+                    yield None, token
+                while position < end:
+                    yield position, pending[position - start]
+                    position += 1
+                if finished and position >= len(self.events):
+                    return
+        finally:
+            self.subscribers -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "workspace_id": self.workspace_id,
+            "status": self.status,
+            "progress": self.progress,
+            "event_count": len(self.events),
+            "subscribers": self.subscribers,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class AuditJobManager:
+    """
+    In-process audit queue with a fixed worker pool, shared fairly between dataset workspaces.
+    - Bounded queue: submissions beyond max_queue (or max_queue_per_workspace for one workspace)
+      raise QueueFullError.
+    - Per-workspace quota: at most max_per_workspace audits of one workspace run at once; workers take
+      the oldest queued job whose workspace is below its quota, so one tenant can't hold every worker.
+    - Coalescing: a submission whose key matches a queued/running job attaches to it.
+    - Finished jobs are kept (up to max_history) so their streams can still be replayed.
+    """
+
+    def __init__(
+        self,
+        run_audit: Callable[[Dict[str, Any]], AsyncIterator[Dict[str, Any]]],
+        workers: int = None,
+        max_queue: int = None,
+        max_history: int = 100,
+        max_per_workspace: int = None,
+        max_queue_per_workspace: int = None
+    ):
+        self.run_audit = run_audit
+        self.worker_count = workers or int(os.getenv("AUDIT_WORKERS", "2"))
+        self.max_queue = max_queue or int(os.getenv("AUDIT_QUEUE_SIZE", "16"))
+        self.max_history = max_history
+        self.max_per_workspace = max_per_workspace or int(os.getenv("AUDIT_WORKSPACE_CONCURRENCY", "1"))
+        self.max_queue_per_workspace = max_queue_per_workspace or int(os.getenv("AUDIT_WORKSPACE_QUEUE_SIZE", "4"))
+        self.jobs: "OrderedDict[str, AuditJob]" = OrderedDict()
+        self._inflight: Dict[str, AuditJob] = {}
+        self._pending: "deque[AuditJob]" = deque()
+        self._running: Counter = Counter()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    def _ensure_started(self):
+        """Workers are started lazily on the running event loop."""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.worker_count:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    def submit(self, request: Dict[str, Any], key: str) -> tuple:
+        """Returns (job, coalesced)."""
+        self._ensure_started()
+        existing = self._inflight.get(key)
+        if existing is not None and not existing.done:
+            return existing, True
+
+        job = AuditJob(key, request)
+        if len(self._pending) >= self.max_queue:
+            raise QueueFullError(f"Audit queue is full ({self.max_queue} pending jobs)")
+        queued = sum(1 for pending in self._pending if pending.workspace_id == job.workspace_id)
+        if queued >= self.max_queue_per_workspace:
+            raise QueueFullError(
+                f"Workspace {job.workspace_id} already has {queued} pending jobs (limit {self.max_queue_per_workspace})"
+            )
+        self._pending.append(job)
+        self._wakeup.set()
+        self._inflight[key] = job
+        self.jobs[job.id] = job
+        self._trim_history()
+        return job, False
+
+    def get(self, job_id: str) -> Optional[AuditJob]:
+        return self.jobs.get(job_id)
+
+    def stats(self, workspace_id: str = None) -> Dict[str, Any]:
+        """Queue counters; with a workspace_id, its own queued/running counts and quotas."""
+        if workspace_id is not None:
+            return {
+                "workspace_id": workspace_id,
+                "queued": sum(1 for j in self._pending if j.workspace_id == workspace_id),
+                "max_queue": self.max_queue_per_workspace,
+                "running": self._running[workspace_id],
+                "max_running": self.max_per_workspace
+            }
+        return {
+            "workers": self.worker_count,
+            "queued": len(self._pending),
+            "max_queue": self.max_queue,
+            "running": sum(self._running.values()),
+            "max_running_per_workspace": self.max_per_workspace
+        }
+
+    def _trim_history(self):
+        while len(self.jobs) > self.max_history:
+            oldest_id = next((jid for jid, j in self.jobs.items() if j.done), None)
+            if oldest_id is None:
+                break
+            del self.jobs[oldest_id]
+
+    def _next_job(self) -> Optional[AuditJob]:
+        """Oldest queued job whose workspace is below its concurrency quota (claims a slot for it)."""
+        for job in self._pending:
+            if self._running[job.workspace_id] < self.max_per_workspace:
+                self._pending.remove(job)
+                self._running[job.workspace_id] += 1
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job.status = "running"
+            job.started_at = datetime.now().isoformat()
+            status = "completed"
+            try:
+                async for event in self.run_audit(job.request):
+                    await job.publish(event)
+                    if event.get("type") == "error":
+                        status = "failed"
+            except Exception as e:
+                await job.publish({"type": "error", "message": str(e)})
+                status = "failed"
+            finally:
+                await job.finish(status)
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+                self._running[job.workspace_id] -= 1
+                if not self._running[job.workspace_id]:
+                    del self._running[job.workspace_id]
+                # A freed slot may unblock a job of this workspace
+                self._wakeup.set()
@@ -0,0 +1,282 @@
+import functools
+import hashlib
+import json
+import os
+from concurrent.futures import as_completed
+from contextvars import ContextVar
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+from langchain_core.messages import AIMessage
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from llm_cache import get_llm_cache
+from prompt_budget import TokenBudgetExceeded, compact_messages, get_ledger
+from telemetry import record, span
+from structured import parse_json
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_MAX_CONCURRENCY = 5
+DEFAULT_PACK_SIZE = 1
+
+# Fallbacks taken by the graph node running in this context (see track_fallbacks)
+_fallbacks: ContextVar[Optional[List[str]]] = ContextVar("llm_fallbacks", default=None)
+
+
+def get_max_concurrency() -> int:
+    """Upper bound on in-flight LLM calls per agent (LLM_MAX_CONCURRENCY)."""
+    try:
+        return max(1, int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_MAX_CONCURRENCY
+
+
+def get_pack_size() -> int:
+    """Number of signals packed into one structured prompt (LLM_PACK_SIZE, 1 = one call per signal)."""
+    try:
+        return max(1, int(os.getenv("LLM_PACK_SIZE", DEFAULT_PACK_SIZE)))
+    except ValueError:
+        return DEFAULT_PACK_SIZE
+
+
+def chunked(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def note_fallback(reason: str):
+    """
+    Records that the running node degraded: an LLM call failed for good, the API key is missing,
+    a template replaced the model's output... Its output is then not written to the node cache.
+    """
+    reasons = _fallbacks.get()
+    if reasons is not None:
+        reasons.append(reason)
+
+
+def track_fallbacks(node: str):
+    """Decorator for a graph node: the fallbacks it noted are returned in its "degraded" state key."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(state):
+            token = _fallbacks.set([])
+            try:
+                update = fn(state)
+                reasons = _fallbacks.get()
+            finally:
+                _fallbacks.reset(token)
+            if reasons and isinstance(update, dict):
+                update = {**update, "degraded": [f"{node}: {r}" for r in dict.fromkeys(reasons)]}
+            return update
+        return wrapper
+    return decorate
+
+
+def cache_key(llm, messages: list, scope: Dict[str, Any]) -> str:
+    """Content address of one LLM call: model settings + prompt + input file digests."""
+    payload = {
+        "model": getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__,
+        "temperature": getattr(llm, "temperature", None),
+        "messages": [[m.type, m.content] for m in messages],
+        "inputs": scope.get("inputs", {})
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _meter(scope: Dict[str, Any] = None):
+    """(token ledger, agent) the calls of a scope are charged to; no ledger outside an audit."""
+    if scope is None:
+        return None, None
+    return get_ledger(scope.get("run_id")), scope.get("agent") or "llm"
+
+
+def _book(ledger, agent: str, charged: int, reply: Any, current):
+    """Counts a finished call on its telemetry span and settles it on the audit's token ledger."""
+    current.add("calls")
+    if isinstance(reply, Exception):
+        current.add("errors")
+    if ledger:
+        prompt_tokens, completion_tokens = ledger.settle(agent, charged, reply)
+        current.add("prompt_tokens", prompt_tokens)
+        current.add("completion_tokens", completion_tokens)
+
+
+def batch_invoke(llm, prompts: List[list], max_concurrency: int = None, scope: Dict[str, Any] = None) -> List[Any]:
+    """
+    Fans prompts out over the chat model with a bounded number of concurrent calls.
+    Prompts are sent without their source-code indentation (see prompt_budget.compact_prompt).
+    Results come back in input order; a failed call yields its Exception instead of
+    aborting the whole batch (per-signal error isolation).
+
+    With a cache scope (see llm_cache.cache_scope), replies are served from / written to the
+    on-disk LLM cache; scope["bypass"] skips the lookup but still refreshes the entry.
+    Calls of an audit are counted against its token budgets (see prompt_budget): a call that
+    doesn't fit yields TokenBudgetExceeded without being sent.
+    """
+    if not prompts:
+        return []
+    prompts = [compact_messages(prompt) for prompt in prompts]
+    limit = max_concurrency or get_max_concurrency()
+    if scope is None:
+        with span("llm", "llm") as current:
+            replies = llm.batch(prompts, config={"max_concurrency": limit}, return_exceptions=True)
+            for reply in replies:
+                _book(None, "llm", 0, reply, current)
+        return replies
+
+    cache = get_llm_cache(scope.get("workspace"))
+    ledger, agent = _meter(scope)
+    keys = [cache_key(llm, prompt, scope) for prompt in prompts]
+    results: List[Any] = [None] * len(prompts)
+    misses = []
+    charged = {}
+    with span("llm", agent) as current:
+        for i, key in enumerate(keys):
+            cached = None if scope.get("bypass") else cache.get(key)
+            if cached is not None:
+                results[i] = AIMessage(content=cached)
+                current.add("cache_hits")
+                if ledger:
+                    ledger.cached(agent, prompts[i])
+                continue
+            if ledger:
+                try:
+                    charged[i] = ledger.charge(agent, prompts[i])
+                except TokenBudgetExceeded as e:
+                    results[i] = e
+                    current.add("refused")
+                    continue
+            misses.append(i)
+
+        if misses:
+            replies = llm.batch([prompts[i] for i in misses], config={"max_concurrency": limit}, return_exceptions=True)
+            for i, reply in zip(misses, replies):
+                results[i] = reply
+                _book(ledger, agent, charged.get(i, 0), reply, current)
+                if not isinstance(reply, Exception):
+                    cache.set(keys[i], reply.content)
+    return results
+
+
+def invoke(llm, messages: list, scope: Dict[str, Any] = None):
+    """Single (cached) LLM call; raises on failure like llm.invoke."""
+    reply = batch_invoke(llm, [messages], max_concurrency=1, scope=scope)[0]
+    if isinstance(reply, Exception):
+        raise reply
+    return reply
+
+
+def invoke_as_completed(
+    llm,
+    prompts: List[list],
+    max_concurrency: int = None,
+    scope: Dict[str, Any] = None
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Like batch_invoke, but yields (index, reply) as soon as each call finishes
+    (cache hits first), so callers can stream results out one by one.
+    A failed call (or one refused by the token budget) yields its Exception.
+    """
+    prompts = [compact_messages(prompt) for prompt in prompts]
+    cache = get_llm_cache(scope.get("workspace")) if scope is not None else None
+    ledger, agent = _meter(scope)
+    keys = [cache_key(llm, prompt, scope) for prompt in prompts] if cache else []
+    misses = []
+    charged = {}
+    for i in range(len(prompts)):
+        cached = None if (cache is None or scope.get("bypass")) else cache.get(keys[i])
+        if cached is not None:
+            record("llm", agent, "cache_hits")
+            if ledger:
+                ledger.cached(agent, prompts[i])
+            yield i, AIMessage(content=cached)
+            continue
+        if ledger:
+            try:
+                charged[i] = ledger.charge(agent, prompts[i])
+            except TokenBudgetExceeded as e:
+                record("llm", agent, "refused")
+                yield i, e
+                continue
+        misses.append(i)
+    if not misses:
+        return
+
+    def call(i):
+        # One span per round trip (the pool's threads report to the caller's metric listener)
+        with span("llm", agent or "llm") as current:
+            try:
+                reply = llm.invoke(prompts[i])
+            except Exception as e:
+                reply = e
+            _book(ledger, agent, charged.get(i, 0), reply, current)
+        return reply
+
+    # Context-propagating threads: streamed tokens still reach the graph's callbacks
+    with ContextThreadPoolExecutor(max_workers=min(len(misses), max_concurrency or get_max_concurrency())) as pool:
+        futures = {pool.submit(call, i): i for i in misses}
+        for future in as_completed(futures):
+            i, reply = futures[future], future.result()
+            if cache is not None and not isinstance(reply, Exception):
+                cache.set(keys[i], reply.content)
+            yield i, reply
+
+
+def fan_out(
+    llm,
+    items: List[Dict[str, Any]],
+    build_prompt: Callable[[Dict[str, Any]], list],
+    build_packed_prompt: Callable[[List[Dict[str, Any]]], list],
+    parse_reply: Callable[[str], Any],
+    key: str = "id",
+    label: str = "LLM",
+    scope: Dict[str, Any] = None,
+) -> List[Any]:
+    """
+    Runs one LLM request per item (or per pack of LLM_PACK_SIZE items) concurrently.
+
+    Packed replies must be a JSON object keyed by item[key]; items missing from a
+    packed reply, rejected by parse_reply (schema validation) or belonging to a pack
+    that failed are retried individually.
+    Returns parsed results aligned with `items` (None where nothing was found or the call failed).
+    """
+    results: List[Any] = [None] * len(items)
+    pending = list(range(len(items)))
+    pack_size = get_pack_size()
+
+    if pack_size > 1 and len(items) > 1:
+        packs = chunked(pending, pack_size)
+        replies = batch_invoke(llm, [build_packed_prompt([items[i] for i in pack]) for pack in packs], scope=scope)
+        retry = []
+        for pack, reply in zip(packs, replies):
+            try:
+                if isinstance(reply, Exception):
+                    raise reply
+                data = parse_json(reply.content)
+                if not isinstance(data, dict):
+                    raise ValueError("packed reply is not a JSON object")
+            except Exception as e:
+                print(f"{label} packed call failed for {[items[i][key] for i in pack]}: {e}. Retrying individually.")
+                retry.extend(pack)
+                continue
+            # Items are validated one by one: only missing/invalid ones are retried
+            for i in pack:
+                item_id = items[i][key]
+                if item_id not in data:
+                    retry.append(i)
+                    continue
+                try:
+                    results[i] = parse_reply(json.dumps(data[item_id]))
+                except Exception as e:
+                    print(f"{label} packed reply invalid for {item_id}: {e}. Retrying individually.")
+                    retry.append(i)
+        record("llm", _meter(scope)[1] or "llm", "retries", len(retry))
+        pending = retry
+
+    replies = batch_invoke(llm, [build_prompt(items[i]) for i in pending], scope=scope)
+    for i, reply in zip(pending, replies):
+        try:
+            if isinstance(reply, Exception):
+                raise reply
+            results[i] = parse_reply(reply.content)
+        except Exception as e:
+            print(f"{label} Error for {items[i][key]}: {e}")
+            note_fallback(f"{label} call failed ({type(e).__name__})")
+
+    return results
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BACKEND_DIR, ".cache")
+DEFAULT_WORKSPACE = "default"
+
+
+def env_path(env_var: str, default: Optional[str] = None) -> Optional[str]:
+    """Path setting; relative values are resolved against backend/, whatever the working directory."""
+    value = os.getenv(env_var) or default
+    return os.path.join(BACKEND_DIR, value) if value else value
+
+
+def workspace_cache_path(workspace_id: Optional[str], name: str, env_var: str = None) -> str:
+    """
+    Location of a cache file/directory for a workspace (see workspaces.py).
+    The default workspace keeps the single-tenant locations (env_var override, else DEFAULT_CACHE_DIR/name);
+    any other workspace gets WORKSPACE_CACHE_DIR/<workspace_id>/name.
+    """
+    if not workspace_id or workspace_id == DEFAULT_WORKSPACE:
+        default = os.path.join(DEFAULT_CACHE_DIR, name)
+        return env_path(env_var, default) if env_var else default
+    root = env_path("WORKSPACE_CACHE_DIR", os.path.join(DEFAULT_CACHE_DIR, "workspaces"))
+    return os.path.join(root, workspace_id, name)
+
+
+class DiskCache:
+    """
+    Persistent key/value cache in a local SQLite file.
+    - Values are JSON-serializable objects.
+    - Entries expire after ttl_seconds.
+    - Total payload size is bounded by max_bytes; least recently used entries are evicted first.
+    - Keeps hit/miss counters for the lifetime of the process.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._ensure_storage_exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _ensure_storage_exists(self):
+        """Create cache file and table if they don't exist"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None on a miss (expired entries count as misses)."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+                if row is not None:
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY last_access ASC"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+    def clear(self):
+        """Clear all cached entries (use with caution)"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+
+_digest_memo: Dict[tuple, str] = {}
+
+
+def file_digest(path: str) -> Optional[str]:
+    """SHA-256 of a file's contents, memoized on (path, size, mtime) so unchanged files are hashed once."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _digest_memo.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def remember_digest(path: str, digest: str):
+    """Records a digest computed elsewhere (e.g. while streaming an upload) so file_digest skips re-hashing."""
+    st = os.stat(path)
+    _digest_memo[(os.path.abspath(path), st.st_size, st.st_mtime_ns)] = digest
+
+
+def input_digests(state: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Content digests of the audit's input files (sales, context, backlog)."""
+    return {
+        key: file_digest(state[key])
+        for key in ("sales_data_path", "context_data_path", "backlog_data_path")
+        if state.get(key)
+    }
+
+
+def cache_scope(state: Dict[str, Any], agent: str = None) -> Dict[str, Any]:
+    """
+    Per-request cache settings threaded from AgentState into the LLM helpers.
+    run_id / agent attribute the calls' tokens to the audit and its node (see prompt_budget).
+    """
+    return {
+        "inputs": input_digests(state),
+        "bypass": bool(state.get("cache_bypass", False)),
+        "workspace": state.get("workspace_id"),
+        "run_id": state.get("run_id"),
+        "agent": agent
+    }
+
+
+_llm_caches: Dict[str, DiskCache] = {}
+_llm_caches_lock = threading.Lock()
+
+
+def get_llm_cache(workspace_id: str = None) -> DiskCache:
+    """
+    LLM response cache of a workspace (LLM_CACHE_PATH, LLM_CACHE_MAX_MB, LLM_CACHE_TTL_HOURS).
+    Every workspace has its own file and its own LLM_CACHE_MAX_MB quota.
+    """
+    workspace_id = workspace_id or DEFAULT_WORKSPACE
+    with _llm_caches_lock:
+        if workspace_id not in _llm_caches:
+            _llm_caches[workspace_id] = DiskCache(
+                workspace_cache_path(workspace_id, "llm_cache.sqlite", "LLM_CACHE_PATH"),
+                max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024),
+                ttl_seconds=int(float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600)
+            )
+        return _llm_caches[workspace_id]
@@ -7,10 +7,20 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from graph import create_graph
-from storage import SignalStorage
+from fastapi.responses import JSONResponse, PlainTextResponse
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from graph import create_graph, get_checkpoint_path, get_node_cache, NODE_ORDER
+from workspaces import WorkspaceManager, InvalidWorkspaceError, UnknownWorkspaceError
+from llm_cache import get_llm_cache, input_digests
+from sales_data import build_columnar_cache
+from evidence_index import get_evidence_index
+from structured import IncrementalJSONParser
+from state import merge_by_signal
+from llm import get_max_concurrency
+import telemetry
 
 app = FastAPI()
 
@@ -21,6 +31,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
 
 # Paths to data
@@ -32,164 +43,629 @@ if os.path.exists(os.path.join(current_dir, "data")):
 else:
     DATA_DIR = os.path.join(os.path.dirname(current_dir), "data")
 
-# Initialize signal storage
-STORAGE_PATH = os.path.join(DATA_DIR, "signals_history.json")
-signal_storage = SignalStorage(STORAGE_PATH)
+DEFAULT_SALES_FILE = "nexusflow_sales_2025_full.csv"
+
+# Dataset workspaces: each has its own inputs, signal history and caches ("default" is DATA_DIR itself)
+workspaces = WorkspaceManager(DATA_DIR)
+
+@app.exception_handler(InvalidWorkspaceError)
+def invalid_workspace(request: Request, e: InvalidWorkspaceError):
+    return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+
+@app.exception_handler(UnknownWorkspaceError)
+def unknown_workspace(request: Request, e: UnknownWorkspaceError):
+    return JSONResponse({"status": "error", "message": str(e)}, status_code=404)
 
 @app.get("/")
 def read_root():
     return {"status": "Signals Backend Operational"}
 
+def _csv_param(value: str | None):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
 @app.get("/api/signals")
-def get_signals():
+def get_signals(
+    request: Request,
+    limit: int = 50,
+    cursor: str = None,
+    severity: str = None,
+    status: str = None,
+    region: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    fields: str = "full",
+    workspace: str = None
+):
     """
-    Retrieve all stored signals from persistent storage.
-    Returns signals sorted by last_updated (newest first).
+    Retrieve stored signals, sorted by last_updated (newest first).
+    - Cursor pagination: pass the returned next_cursor to get the following page.
+    - Filters: severity, status, region (comma-separated), date_from/date_to (YYYY-MM-DD).
+    - fields=summary leaves out the evidence_csv/evidence_txt/evidence_json blobs.
+    - Conditional GET: ETag / Last-Modified, answers 304 when nothing changed.
+    - workspace: dataset workspace whose signals are listed (default: "default").
     """
+    signal_storage = workspaces.get(workspace).storage
     try:
-        signals = signal_storage.get_all_signals()
-        return {
+        revision = signal_storage.get_revision()
+        etag = f'W/"signals-{revision["workspace_id"]}-{revision["revision"]}"'
+        last_modified = None
+        if revision["modified_at"]:
+            last_modified = format_datetime(datetime.fromisoformat(revision["modified_at"]), usegmt=True)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if last_modified:
+            headers["Last-Modified"] = last_modified
+
+        if_none_match = request.headers.get("if-none-match")
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_none_match:
+            if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+                return Response(status_code=304, headers=headers)
+        elif if_modified_since and last_modified:
+            try:
+                if parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since):
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+        try:
+            page = signal_storage.query_signals(
+                limit=limit,
+                cursor=cursor,
+                severity=_csv_param(severity),
+                status=_csv_param(status),
+                region=_csv_param(region),
+                date_from=date_from,
+                date_to=date_to,
+                include_evidence=fields != "summary"
+            )
+        except (ValueError, TypeError) as e:
+            return JSONResponse({"status": "error", "message": f"Invalid cursor: {e}"}, status_code=400)
+        return JSONResponse({
             "status": "success",
-            "count": len(signals),
-            "signals": signals
-        }
+            "count": len(page["signals"]),
+            "next_cursor": page["next_cursor"],
+            "signals": page["signals"]
+        }, headers=headers)
     except Exception as e:
         return {"status": "error", "message": str(e), "signals": []}
 
+@app.get("/api/signals/{signal_id}")
+def get_signal(signal_id: str, workspace: str = None):
+    """Retrieve a single stored signal (full evidence) by ID."""
+    signal = workspaces.get(workspace).storage.get_signal_by_id(signal_id)
+    if signal is None:
+        return JSONResponse({"status": "error", "message": f"Signal {signal_id} not found"}, status_code=404)
+    return {"status": "success", "signal": signal}
+
+@app.get("/api/cache/stats")
+def get_cache_stats(workspace: str = None):
+    """LLM response cache counters (hits/misses since start-up) and size of a workspace."""
+    workspace_id = workspaces.get(workspace).id
+    return {"status": "success", "workspace_id": workspace_id, "llm_cache": get_llm_cache(workspace_id).stats()}
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus text exposition of the pipeline telemetry: span durations per node, LLM call,
+    sandbox run, market search, storage operation and data load, plus token / cache / retry counters.
+    """
+    if not telemetry.ENABLED:
+        return JSONResponse({"status": "error", "message": "Metrics are disabled (METRICS_ENABLED)"}, status_code=404)
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/workspaces")
+def list_workspaces():
+    """Dataset workspaces on this server (a workspace is created by its first upload)."""
+    return {"status": "success", "workspaces": workspaces.list()}
+
 from fastapi import UploadFile, File
-import shutil
+from uploads import UploadRejected, store_upload
 
 @app.post("/api/upload")
 async def upload_files(
     sales: UploadFile = File(...),
     context: UploadFile = File(...),
-    backlog: UploadFile = File(...)
+    backlog: UploadFile = File(...),
+    workspace: str = None
 ):
+    """
+    Stores the three audit inputs in content-addressed storage (see uploads.store_upload).
+    Files are copied in chunks off the event loop, hashed and validated while streaming
+    (CSV header/rows, backlog JSON items, UTF-8 context) and limited to UPLOAD_MAX_MB each.
+    Re-uploading identical content is a no-op. The returned filenames go to /api/audit as-is.
+    - workspace: dataset workspace to store into (created by its first upload).
+    """
+    target = workspaces.get(workspace, create=True)
     try:
-        # Save uploaded files to data directory
-        sales_path = os.path.join(DATA_DIR, sales.filename)
-        context_path = os.path.join(DATA_DIR, context.filename)
-        backlog_path = os.path.join(DATA_DIR, backlog.filename)
-
-        with open(sales_path, "wb") as buffer:
-            shutil.copyfileobj(sales.file, buffer)
-        with open(context_path, "wb") as buffer:
-            shutil.copyfileobj(context.file, buffer)
-        with open(backlog_path, "wb") as buffer:
-            shutil.copyfileobj(backlog.file, buffer)
+        stored = await asyncio.gather(*[
+            asyncio.to_thread(store_upload, upload.file, kind, upload.filename, target.upload_dir)
+            for kind, upload in (("sales", sales), ("context", context), ("backlog", backlog))
+        ])
+        files = dict(zip(("sales", "context", "backlog"), stored))
+        sales_path = files["sales"]["path"]
+
+        # Convert the sales file once into the columnar cache so audits skip CSV parsing
+        await asyncio.to_thread(build_columnar_cache, sales_path)
+        # Pre-build the evidence index (otherwise built on the first fallback lookup)
+        try:
+            await asyncio.to_thread(get_evidence_index(sales_path, target.id).ensure_built)
+        except Exception as e:
+            print(f"⚠️ Evidence index build failed: {e}", flush=True)
+        # Precompute the dashboard views (/api/customers, /api/team) for the new file
+        try:
+            await asyncio.to_thread(get_sales_views(target.id).refresh, sales_path, True)
+        except Exception as e:
+            print(f"⚠️ Dashboard view precompute failed: {e}", flush=True)
 
         return {
             "status": "success", 
-            "filenames": {
-                "sales": sales.filename,
-                "context": context.filename,
-                "backlog": backlog.filename
+            "workspace_id": target.id,
+            "filenames": {kind: target.relative(info["path"]) for kind, info in files.items()},
+            "files": {
+                kind: {k: info[k] for k in ("original_filename", "sha256", "bytes", "deduplicated")}
+                for kind, info in files.items()
             }
         }
+    except UploadRejected as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=422)
     except Exception as e:
-        return {"error": str(e)}
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+from sales_views import get_sales_views, CUSTOMER_SORTS, TEAM_SORTS
+
+def _view_page(workspace: str | None, sales: str | None, sort: str, sorts: dict, order: str, query):
+    """Shared handling of the dashboard view endpoints (precompute on first use, sort/cursor validation)."""
+    target = workspaces.get(workspace)
+    # Sales file relative to the workspace, as returned by /api/upload
+    path = target.resolve(sales or DEFAULT_SALES_FILE)
+    if not os.path.isfile(path):
+        return JSONResponse({"status": "error", "message": f"Sales file {sales} not found"}, status_code=404)
+    if sort not in sorts or order not in ("asc", "desc"):
+        return JSONResponse(
+            {"status": "error", "message": f"sort must be one of {', '.join(sorts)}; order asc or desc"},
+            status_code=400
+        )
+    views = get_sales_views(target.id)
+    if views.watermark(path) is None:
+        # Never precomputed (e.g. a file placed in data/ by hand): ingest it once
+        views.refresh(path, target.is_upload(path))
+    try:
+        page = query(views, path, order == "desc")
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"status": "error", "message": f"Invalid cursor: {e}"}, status_code=400)
+    return {"status": "success", **page, "updated_at": views.watermark(path)["updated_at"]}
+
+@app.get("/api/customers")
+def get_customers(
+    sales: str = None,
+    limit: int = 50,
+    cursor: str = None,
+    sort: str = "total_spend",
+    order: str = "desc",
+    region: str = None,
+    segment: str = None,
+    status: str = None,
+    workspace: str = None
+):
+    """
+    Account view of a sales file, one page at a time (see sales_views.SalesViewStore).
+    - Precomputed after every upload and audit; served from an index, not from the CSV.
+    - sort: total_spend, last_active, deals or name; order: asc or desc.
+    - Cursor pagination: pass the returned next_cursor to get the following page.
+    - Filters: region, segment, status (comma-separated).
+    """
+    return _view_page(workspace, sales, sort, CUSTOMER_SORTS, order, lambda views, path, descending: views.customers(
+        path, limit=limit, cursor=cursor, sort=sort, descending=descending,
+        region=_csv_param(region), segment=_csv_param(segment), status=_csv_param(status)
+    ))
+
+@app.get("/api/team")
+def get_team(
+    sales: str = None,
+    limit: int = 50,
+    cursor: str = None,
+    sort: str = "total_revenue",
+    order: str = "desc",
+    workspace: str = None
+):
+    """
+    Sales rep view of a sales file, one page at a time (same precompute and pagination as /api/customers).
+    - sort: total_revenue, deals_closed, avg_deal_size, avg_cycle_days or name; order: asc or desc.
+    """
+    return _view_page(workspace, sales, sort, TEAM_SORTS, order, lambda views, path, descending: views.team(
+        path, limit=limit, cursor=cursor, sort=sort, descending=descending
+    ))
 
 from fastapi.responses import StreamingResponse
+from collections import deque
 import json
 import asyncio
+import hashlib
+import uuid
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from jobs import AuditJob, AuditJobManager, QueueFullError
+from prompt_budget import open_ledger, close_ledger
 
-@app.post("/api/audit")
-async def run_audit(data: dict = None):
+NODE_START_LOGS = {
+    "analyst": "[Analyst] Scanning sales data for anomalies...",
+    "prepare_context": "[Investigator] Indexing internal context (Wikis, Slack, Jira)...",
+    "prepare_backlog": "[Strategist] Indexing transformation backlog & market research...",
+    "dispatch": "[Router] Fanning out one Investigator → Strategist branch per signal...",
+    "enrich": "[Investigator → Strategist] Cross-referencing context & identifying solutions per signal...",
+    "portfolio": "[Strategist] Calculating Financial Impact & allocating the portfolio budget...",
+    "ghostwriter": "[Ghostwriter] Synthesizing executive signals..."
+}
+
+# Nodes fanned out once per signal: one start log / progress count per node, not per branch
+FAN_OUT_NODES = {"enrich"}
+# State keys merged across per-signal branches (same reducer as the graph state)
+MERGED_KEYS = {"context_insights", "recommendations"}
+
+# Nodes whose LLM replies are JSON (parsed incrementally into "partial" events)
+JSON_NODES = {"investigator", "strategist"}
+
+def node_summary_logs(node: str, state: dict):
+    """Human-readable progress lines built from the state a node just produced."""
+    if node == "analyst":
+        count = len(state.get("anomalies", []))
+        if count == 0:
+            return ["[Analyst] No anomalies found. Stopping."]
+        return [f"[Analyst] ⚠️ Detected {count} anomalies in revenue data."]
+    if node == "investigator":
+        # One per-signal branch's insights
+        insights = state.get("context_insights", [])
+        messages = [f"[Investigator] Found {len(insights)} relevant context insight(s)."]
+        for insight in insights:
+            messages.append(f"[Investigator] {insight.get('signal_id')}: '{insight.get('content', '')[:120]}'")
+        return messages
+    if node == "strategist":
+        # One per-signal branch's matches
+        messages = []
+        for rec in state.get("recommendations", []):
+            project_id = (rec.get("evidence_json") or {}).get("entry", {}).get("id", "")
+            messages.append(f"[Strategist] {rec.get('signal_id')}: Match found: '{rec.get('project_title')}' ({project_id}) | "
+                            f"ROI Projected: {rec.get('roi_metric')}.")
+        return messages
+    if node == "portfolio":
+        recs = state.get("recommendations", [])
+        messages = [f"[Strategist] Generated {len(recs)} recommendation(s)."]
+        if recs:
+            top = recs[0]
+            project_id = (top.get("evidence_json") or {}).get("entry", {}).get("id", "")
+            messages.append(f"[Strategist] Top match: '{top.get('project_title')}' ({project_id}).")
+            messages.append(f"[Strategist] ROI Projected: {top.get('roi_metric')} | Impact: ${top.get('impact_usd', 0) / 1_000_000:.2f}M.")
+        portfolio = state.get("portfolio")
+        if portfolio and portfolio.get("projects"):
+            messages.append(f"[Strategist] Portfolio: {len(portfolio['projects'])} project(s), "
+                            f"cost ${portfolio['total_cost_usd'] / 1_000_000:.2f}M, NSV ${portfolio['total_nsv_usd'] / 1_000_000:.2f}M.")
+        return messages
+    if node == "ghostwriter":
+        return [f"[Ghostwriter] Generated {len(state.get('final_report', []))} executive brief(s)."]
+    return []
+
+def token_usage_logs(usage: dict):
+    """One line per node that called the LLM, then the audit total (token counts and estimated cost)."""
+    def line(name, u, budget=None):
+        details = [f"{u['calls']} call(s)", f"{u['prompt_tokens']:,} prompt + {u['completion_tokens']:,} completion tokens"]
+        if budget:
+            details.append(f"budget {budget:,}")
+        details.append(f"~${u['cost_usd']:.4f}")
+        if u["cache_hits"]:
+            details.append(f"{u['cache_hits']} cache hit(s) saved {u['saved_tokens']:,} tokens")
+        if u["refused"]:
+            details.append(f"{u['refused']} refused by budget")
+        return f"[Tokens] {name}: {', '.join(details)}."
+    messages = [line(node.capitalize(), u) for node, u in usage["nodes"].items()]
+    if messages:
+        messages.append(line("Audit total", usage["total"], usage["total"]["budget"]))
+    return messages
+
+def drain_metrics(events: deque):
+    """Metric events collected from the graph's threads since the last drain."""
+    while events:
+        yield events.popleft()
+
+def build_initial_state(data: dict = None) -> dict:
     """
-    Triggers the multi-agent workflow and flows back real-time logs.
-    Returns: NDJSON stream (Newline Delimited JSON)
+    Resolves the audit request body into the graph's initial AgentState.
+    Input filenames are relative to the request's "workspace" (default: "default").
     """
-    
-    # 1. Setup Data Paths
-    sales_file = "nexusflow_sales_2025_full.csv"
+    sales_file = DEFAULT_SALES_FILE
     context_file = "internal_context_dump.txt"
     backlog_file = "transformation_backlog.json"
+    bypass_cache = False
+    incremental = False
+    resume_run_id = None
+    workspace_id = None
 
     if data:
         sales_file = data.get("sales", sales_file)
         context_file = data.get("context", context_file)
         backlog_file = data.get("backlog", backlog_file)
+        bypass_cache = bool(data.get("bypass_cache", False))
+        incremental = bool(data.get("incremental", False))
+        resume_run_id = data.get("resume_run_id")
+        workspace_id = data.get("workspace")
     
-    initial_state = {
-        "sales_data_path": os.path.join(DATA_DIR, sales_file),
-        "context_data_path": os.path.join(DATA_DIR, context_file),
-        "backlog_data_path": os.path.join(DATA_DIR, backlog_file),
+    workspace = workspaces.get(workspace_id)
+    state = {
+        "workspace_id": workspace.id,
+        "sales_data_path": workspace.resolve(sales_file),
+        "context_data_path": workspace.resolve(context_file),
+        "backlog_data_path": workspace.resolve(backlog_file),
+        "cache_bypass": bypass_cache,
+        "incremental": incremental,
+        "run_id": resume_run_id or uuid.uuid4().hex,
         "anomalies": [],
         "context_insights": [],
         "recommendations": [],
         "final_report": []
     }
+    state["input_digests"] = input_digests(state)
+    return state
 
-    # 2. Generator Function for Streaming
-    async def event_generator():
-        try:
-            workflow = create_graph()
-            
-            # Yield initial log
-            yield json.dumps({"type": "log", "message": "--- Signal Detection Protocol Initiated ---"}) + "\n"
-            await asyncio.sleep(0.5)
-
-            # --- Step 1: Analyst ---
-            yield json.dumps({"type": "log", "message": "[Analyst] Scanning sales_2025.csv for anomalies..."}) + "\n"
-            # In a real streaming graph, we would use workflow.stream(mode="updates")
-            # For V1 linear graph, we invoke fully but can simulate steps or break it apart if needed.
-            # To imply progress, we'll yield logs before/after the full invoke, 
-            # OR ideally, we'd refactor `main.py` to call nodes manually. 
-            # Let's call nodes manually for TRUE progress updates.
-            
-            from agents.analyst import analyst_agent
-            from agents.investigator import investigator_agent
-            from agents.strategist import strategist_agent
-            from agents.ghostwriter import ghostwriter_agent
-
-            # Run Analyst
+def audit_key(initial_state: dict, resume_run_id: str = None) -> str:
+    """Identical submissions (same input file contents + options) coalesce into one run."""
+    payload = {
+        "workspace": initial_state["workspace_id"],
+        "inputs": initial_state["input_digests"],
+        "bypass": initial_state["cache_bypass"],
+        "incremental": initial_state["incremental"],
+        "resume": resume_run_id
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def audit_events(initial_state: dict):
+    """
+    Runs the multi-agent workflow and yields real-time events (log/progress/token/partial/memo/metric/usage/result/error).
+    Consumed by the job workers; clients read the events back through the job stream.
+
+    Every node is checkpointed under the run ID (thread_id). If a run with that ID failed
+    part-way and its input files are unchanged, it resumes at the failed node (only the failed
+    per-signal branches run again); otherwise the graph runs from the start and nodes whose
+    inputs are unchanged are served from the node cache.
+    Per-signal branches report progress as "done"/"total" counts on their fan-out node.
+    """
+    run_id = initial_state["run_id"]
+    workspace_id = initial_state["workspace_id"]
+    # Spans finished by this audit (nodes, LLM calls, sandbox, search, storage) as "metric" events
+    metric_events = deque()
+    listener = telemetry.listen(metric_events.append)
+    try:
+        llm_cache = get_llm_cache(workspace_id)
+        hits_before, misses_before = llm_cache.hits, llm_cache.misses
+        
+        # Yield initial log
+        yield {"type": "log", "message": "--- Signal Detection Protocol Initiated ---"}
+
+        async with AsyncSqliteSaver.from_conn_string(get_checkpoint_path(workspace_id)) as checkpointer:
+            workflow = create_graph(
+                checkpointer=checkpointer, cache=get_node_cache(workspace_id, refresh=initial_state["cache_bypass"])
+            )
+            # Bounds the parallel branches (and so the per-signal LLM calls in flight)
+            config = {"configurable": {"thread_id": run_id}, "max_concurrency": get_max_concurrency()}
+
+            graph_input = initial_state
             state = initial_state.copy()
-            state.update(analyst_agent(state))
-            anom_count = len(state.get("anomalies", []))
-            yield json.dumps({"type": "log", "message": f"[Analyst] ⚠️ Detected {anom_count} anomalies in revenue data."}) + "\n"
-            await asyncio.sleep(0.5)
-
-            if anom_count == 0:
-                 yield json.dumps({"type": "log", "message": "[Analyst] No anomalies found. Stopping."}) + "\n"
-                 yield json.dumps({"type": "result", "data": []}) + "\n"
-                 return
-
-            # Run Investigator
-            yield json.dumps({"type": "log", "message": "[Investigator] Cross-referencing internal context (Wikis, Slack, Jira)..."}) + "\n"
-            state.update(investigator_agent(state))
-            yield json.dumps({"type": "log", "message": f"[Investigator] Found relevant context: 'Zenith Labs Acquisition'."}) + "\n"
-            await asyncio.sleep(0.5)
-
-            # Run Strategist
-            yield json.dumps({"type": "log", "message": "[Strategist] Calculating Financial Impact & identifying solutions..."}) + "\n"
-            state.update(strategist_agent(state))
-            yield json.dumps({"type": "log", "message": "[Strategist] Match found: 'AI Competitive Switch-Kit' (TRANS-001)."}) + "\n"
-            yield json.dumps({"type": "log", "message": f"[Strategist] ROI Projected: 3.1x | Impact: $2.45M."}) + "\n"
-            await asyncio.sleep(0.5)
-
-            # Run Ghostwriter
-            yield json.dumps({"type": "log", "message": "[Ghostwriter] Synthesizing executive signals..."}) + "\n"
-            state.update(ghostwriter_agent(state))
-            final_report = state.get("final_report", [])
-            yield json.dumps({"type": "log", "message": f"[Ghostwriter] Generated {len(final_report)} executive brief(s)."}) + "\n"
-            
-            # Save to persistent storage
-            if final_report:
-                yield json.dumps({"type": "log", "message": "[Storage] Saving signals to persistent storage..."}) + "\n"
-                storage_stats = signal_storage.add_signals(final_report)
-                yield json.dumps({
-                    "type": "log", 
-                    "message": f"[Storage] ✓ Saved {storage_stats['added']} new, updated {storage_stats['updated']} existing. Total: {storage_stats['total']} signals."
-                }) + "\n"
-            
-            # Yield Result
-            yield json.dumps({"type": "result", "data": final_report}) + "\n"
-            yield json.dumps({"type": "log", "message": "--- Analysis Complete ---"}) + "\n"
+            snapshot = await workflow.aget_state(config)
+            if snapshot.values:
+                if snapshot.next and snapshot.values.get("input_digests") == initial_state["input_digests"]:
+                    # Resume from the last checkpoint: completed nodes are not run again
+                    graph_input = None
+                    state = dict(snapshot.values)
+                    resume_at = min(NODE_ORDER.index(node) for node in snapshot.next)
+                    yield {"type": "log", "message": f"[Checkpoint] Resuming run {run_id} at {', '.join(sorted(set(snapshot.next)))}."}
+                    for node in NODE_ORDER[:resume_at]:
+                        yield {"type": "progress", "node": node, "status": "completed"}
+                else:
+                    # Finished, or inputs changed since: start a new run (unchanged nodes hit the node cache)
+                    yield {"type": "log", "message": f"[Checkpoint] Run {run_id} is not resumable. Starting a new run."}
+                    run_id = uuid.uuid4().hex
+                    state["run_id"] = graph_input["run_id"] = run_id
+                    config = {**config, "configurable": {"thread_id": run_id}}
+            yield {"type": "run", "run_id": run_id}
+            # Token accounting and budgets of this run's LLM calls (see prompt_budget)
+            ledger = open_ledger(run_id)
+            parsers = {}  # LLM call (message id) -> incremental JSON parser of its streamed reply
+            branches = {}  # fan-out node -> {"total": branches started, "done": finished, "failed": failed}
+
+            # Drive the graph with astream: sync agent nodes run in LangGraph's executor,
+            # so the event loop stays free for other requests while LLM calls are in flight.
+            # subgraphs=True also streams the nodes inside the per-signal branches (namespace != ()).
+            async for namespace, mode, chunk in workflow.astream(
+                graph_input, config, stream_mode=["tasks", "updates", "messages", "custom"], subgraphs=True
+            ):
+                for event in drain_metrics(metric_events):
+                    yield event
+                if mode == "tasks":
+                    node = chunk["name"]
+                    if namespace:
+                        continue  # Branch internals: reported through their fan-out node
+                    if node in FAN_OUT_NODES:
+                        counts = branches.setdefault(node, {"total": 0, "done": 0, "failed": 0})
+                        if "result" not in chunk:
+                            counts["total"] += 1
+                            if counts["total"] == 1:
+                                yield {"type": "log", "message": NODE_START_LOGS[node]}
+                            status = "started"
+                        else:
+                            counts["done"] += 1
+                            counts["failed"] += bool(chunk.get("error"))
+                            status = "running"
+                            if counts["done"] == counts["total"]:
+                                status = "failed" if counts["failed"] else "completed"
+                        yield {"type": "progress", "node": node, "status": status, "done": counts["done"], "total": counts["total"]}
+                    elif "result" not in chunk:
+                        yield {"type": "progress", "node": node, "status": "started"}
+                        yield {"type": "log", "message": NODE_START_LOGS.get(node, f"[{node}] Running...")}
+                    else:
+                        status = "failed" if chunk.get("error") else "completed"
+                        yield {"type": "progress", "node": node, "status": status}
+                elif mode == "updates":
+                    cached = chunk.get("__metadata__", {}).get("cached", False)
+                    for node, update in chunk.items():
+                        if node == "__metadata__":
+                            continue
+                        if namespace:
+                            # Inside a per-signal branch: summarize that branch's own output
+                            for message in node_summary_logs(node, update or {}):
+                                yield {"type": "log", "message": message}
+                            continue
+                        for key, value in (update or {}).items():
+                            state[key] = merge_by_signal(state.get(key), value) if key in MERGED_KEYS else value
+                        if cached:
+                            yield {"type": "log", "message": f"[Cache] {node.capitalize()} inputs unchanged, reusing its output."}
+                        if node not in FAN_OUT_NODES:
+                            for message in node_summary_logs(node, state):
+                                yield {"type": "log", "message": message}
+                elif mode == "messages":
+                    message, metadata = chunk
+                    if message.content:
+                        node = metadata.get("langgraph_node")
+                        yield {"type": "token", "node": node, "call": message.id, "content": message.content}
+                        if node in JSON_NODES:
+                            # Completed top-level members (e.g. one signal of a packed reply) as soon as they parse
+                            parser = parsers.setdefault(message.id, IncrementalJSONParser())
+                            for key, value in parser.feed(message.content):
+                                yield {"type": "partial", "node": node, "call": message.id, "key": key, "data": value}
+                elif mode == "custom":
+                    # A finished executive memo (Ghostwriter), ahead of the final result
+                    yield {"type": "memo", **chunk}
+
+            # The run finished: its checkpoints are no longer needed for resuming
+            await checkpointer.adelete_thread(run_id)
 
+        usage = ledger.report()
+        yield {"type": "usage", "data": usage}
+        for message in token_usage_logs(usage):
+            yield {"type": "log", "message": message}
+
+        # Bring the dashboard views up to date with the audited sales file (new rows only)
+        try:
+            sales_path = initial_state["sales_data_path"]
+            refreshed = await asyncio.to_thread(
+                get_sales_views(workspace_id).refresh, sales_path, workspaces.get(workspace_id).is_upload(sales_path)
+            )
+            if refreshed["rows"]:
+                yield {
+                    "type": "log",
+                    "message": f"[Precompute] Dashboard views: folded {refreshed['rows']} new rows "
+                               f"({refreshed['accounts']} accounts, {refreshed['reps']} reps)."
+                }
         except Exception as e:
-            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+            yield {"type": "log", "message": f"⚠️ [Precompute] Dashboard views not updated: {e}"}
+        for event in drain_metrics(metric_events):
+            yield event
+
+        if not state.get("anomalies"):
+            yield {"type": "result", "data": []}
+            return
+
+        final_report = state.get("final_report", [])
+        
+        # Save to persistent storage (off the event loop)
+        if final_report:
+            yield {"type": "log", "message": "[Storage] Saving signals to persistent storage..."}
+            storage_stats = await asyncio.to_thread(workspaces.get(workspace_id).storage.add_signals, final_report)
+            yield {
+                "type": "log", 
+                "message": f"[Storage] ✓ Saved {storage_stats['added']} new, updated {storage_stats['updated']} existing. Total: {storage_stats['total']} signals."
+            }
+            for event in drain_metrics(metric_events):
+                yield event
+        
+        yield {
+            "type": "log",
+            "message": f"[Cache] LLM cache: {llm_cache.hits - hits_before} hits, {llm_cache.misses - misses_before} misses."
+        }
+
+        # Yield Result
+        yield {"type": "result", "data": final_report}
+        yield {"type": "log", "message": "--- Analysis Complete ---"}
+
+    except Exception as e:
+        yield {"type": "error", "message": str(e), "run_id": run_id}
+    finally:
+        close_ledger(run_id)
+        telemetry.unlisten(listener)
+
+audit_jobs = AuditJobManager(audit_events)
+
+async def submit_audit(data: dict = None):
+    # Hashing the input files (input_digests) reads them: keep it off the event loop
+    initial_state = await asyncio.to_thread(build_initial_state, data)
+    return audit_jobs.submit(initial_state, audit_key(initial_state, (data or {}).get("resume_run_id")))
+
+async def job_event_stream(job: AuditJob, offset: int = 0):
+    """NDJSON lines for a job's events; each line carries its offset for reattaching (token events are live-only)."""
+    async for position, event in job.stream(offset):
+        yield json.dumps(event if position is None else {**event, "offset": position}) + "\n"
+
+@app.post("/api/audit")
+async def run_audit(data: dict = None):
+    """
+    Triggers the multi-agent workflow and flows back real-time logs.
+    Pass "resume_run_id" (from the stream's run/error event) to resume a failed run from its last checkpoint,
+    "incremental": true to only analyse sales rows appended since the last audit, and "workspace"
+    to audit a dataset workspace's files (each workspace runs AUDIT_WORKSPACE_CONCURRENCY audits at once).
+    The run is queued as a background job, so it survives a client disconnect;
+    reattach with GET /api/audit/jobs/{job_id}/stream?offset=N.
+    Returns: NDJSON stream (Newline Delimited JSON)
+    """
+    try:
+        job, coalesced = await submit_audit(data)
+    except QueueFullError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=429)
+
+    async def event_generator():
+        yield json.dumps({"type": "job", "job_id": job.id, "coalesced": coalesced}) + "\n"
+        async for line in job_event_stream(job):
+            yield line
+
+    return StreamingResponse(event_generator(), media_type="application/x-ndjson", headers={"X-Job-Id": job.id})
+
+@app.post("/api/audit/jobs")
+async def create_audit_job(data: dict = None):
+    """Queues an audit and returns its job ID immediately."""
+    try:
+        job, coalesced = await submit_audit(data)
+    except QueueFullError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=429)
+    return JSONResponse({"status": "success", "coalesced": coalesced, **job.snapshot()}, status_code=202)
+
+@app.get("/api/audit/jobs")
+def list_audit_jobs(workspace: str = None):
+    """Jobs of a workspace, with the shared queue's and the workspace's own counters."""
+    workspace_id = workspaces.get(workspace).id
+    return {
+        "status": "success",
+        "queue": audit_jobs.stats(),
+        "workspace_queue": audit_jobs.stats(workspace_id),
+        "jobs": [job.snapshot() for job in reversed(audit_jobs.jobs.values()) if job.workspace_id == workspace_id]
+    }
+
+def _workspace_job(job_id: str, workspace: str = None):
+    """A job of the given workspace (jobs of other workspaces are not visible)."""
+    job = audit_jobs.get(job_id)
+    if job is not None and job.workspace_id != workspaces.get(workspace).id:
+        return None
+    return job
+
+@app.get("/api/audit/jobs/{job_id}")
+def get_audit_job(job_id: str, workspace: str = None):
+    """Status and per-node progress of an audit job."""
+    job = _workspace_job(job_id, workspace)
+    if job is None:
+        return JSONResponse({"status": "error", "message": f"Job {job_id} not found"}, status_code=404)
+    return {"status": "success", **job.snapshot()}
 
-    return StreamingResponse(event_generator(), media_type="application/x-ndjson")
+@app.get("/api/audit/jobs/{job_id}/stream")
+async def stream_audit_job(job_id: str, offset: int = 0, workspace: str = None):
+    """Replays a job's events from `offset`, then follows it live until it finishes."""
+    job = _workspace_job(job_id, workspace)
+    if job is None:
+        return JSONResponse({"status": "error", "message": f"Job {job_id} not found"}, status_code=404)
+    return StreamingResponse(job_event_stream(job, offset), media_type="application/x-ndjson", headers={"X-Job-Id": job.id})
 
 if __name__ == "__main__":
     import uvicorn
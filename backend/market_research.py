@@ -0,0 +1,228 @@
+import json
+import math
+import os
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from llm_cache import DEFAULT_WORKSPACE, DiskCache, env_path, file_digest, workspace_cache_path
+from llm import get_max_concurrency
+from backlog_index import tokenize
+from telemetry import record, span
+
+DEFAULT_RESULTS = 3
+
+
+def normalize_query(query: str) -> str:
+    """Cache key form of a query: case, punctuation, stopwords, numbers and word order don't matter."""
+    return " ".join(sorted(set(tokenize(query))))
+
+
+class MarketResearchProvider:
+    """Search backend for the Strategist's market research step."""
+
+    name = "none"
+
+    @property
+    def cache_scope(self) -> str:
+        """Cache key prefix: results cached under another scope (e.g. an older corpus) are not reused."""
+        return self.name
+
+    def search(self, query: str, k: int = DEFAULT_RESULTS) -> List[Dict[str, Any]]:
+        """Top-k results as [{"title", "url", "content"}]."""
+        raise NotImplementedError
+
+
+class TavilyProvider(MarketResearchProvider):
+    """Live web search through Tavily (TAVILY_API_KEY)."""
+
+    name = "tavily"
+
+    def __init__(self):
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        self._tools: Dict[int, Any] = {}
+        self._factory = TavilySearchResults
+
+    def search(self, query: str, k: int = DEFAULT_RESULTS) -> List[Dict[str, Any]]:
+        if k not in self._tools:
+            self._tools[k] = self._factory(k=k)
+        results = self._tools[k].invoke(query)
+        if isinstance(results, str):
+            # The tool reports API errors as a string instead of raising
+            raise RuntimeError(results)
+        return [
+            {"title": r.get("title", ""), "url": r.get("url", ""), "content": r.get("content", "")}
+            for r in results
+        ]
+
+
+class LocalCorpusProvider(MarketResearchProvider):
+    """
+    Offline search over a local corpus (air-gapped deployments, tests).
+    MARKET_CORPUS_PATH: a JSON list / JSON lines of {"title", "url", "content"} documents,
+    or a text file with documents separated by '---' lines. Ranked with BM25.
+    """
+
+    name = "local"
+
+    def __init__(self, corpus_path: str, digest: str = None):
+        self.corpus_path = corpus_path
+        self.digest = digest or file_digest(corpus_path)
+        self.documents = self._load(corpus_path)
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        for position, doc in enumerate(self.documents):
+            for token, tf in Counter(tokenize(f"{doc['title']} {doc['content']}")).items():
+                self.postings[token][position] = tf
+        self.lengths = [len(tokenize(f"{d['title']} {d['content']}")) for d in self.documents]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 1.0
+
+    @staticmethod
+    def _load(path: str) -> List[Dict[str, str]]:
+        with open(path, "r") as f:
+            text = f.read()
+        stripped = text.lstrip()
+        if stripped.startswith("["):
+            records = json.loads(text)
+        elif stripped.startswith("{"):
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            records = [{"content": block.strip()} for block in text.split("\n---") if block.strip(" -\n")]
+        return [
+            {"title": r.get("title", ""), "url": r.get("url", f"corpus://{os.path.basename(path)}#{i}"),
+             "content": r.get("content", "")}
+            for i, r in enumerate(records)
+        ]
+
+    def search(self, query: str, k: int = DEFAULT_RESULTS) -> List[Dict[str, Any]]:
+        n = len(self.documents)
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for position, tf in docs.items():
+                norm = 1.2 * (0.25 + 0.75 * self.lengths[position] / self.avg_length)
+                scores[position] += idf * tf * 2.2 / (tf + norm)
+        best = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))[:k]
+        return [dict(self.documents[position]) for position, _ in best]
+
+    @property
+    def cache_scope(self) -> str:
+        # Re-indexing an edited corpus invalidates the results cached for the old one
+        return f"{self.name}@{(self.digest or '')[:16]}"
+
+
+class MarketResearch:
+    """
+    Market research lookups with a persisted result cache.
+    - Keyed on provider (+ corpus digest for the local index) + normalized query; entries expire after the TTL, least recently used are evicted.
+    - lookup_many() de-duplicates queries, serves cached ones and runs the rest concurrently;
+      a failed lookup yields [] for its queries only.
+    """
+
+    def __init__(self, provider: Optional[MarketResearchProvider], cache: Optional[DiskCache] = None):
+        self.provider = provider
+        self.cache = cache
+
+    @property
+    def available(self) -> bool:
+        return self.provider is not None
+
+    def _key(self, query: str, k: int) -> str:
+        return f"{self.provider.cache_scope}:{k}:{normalize_query(query)}"
+
+    def lookup_many(self, queries: List[str], k: int = DEFAULT_RESULTS, bypass: bool = False) -> List[List[Dict[str, Any]]]:
+        if not self.provider or not queries:
+            return [[] for _ in queries]
+        keys = [self._key(q, k) for q in queries]
+        found: Dict[str, List[Dict[str, Any]]] = {}
+        misses: Dict[str, str] = {}
+        for key, query in zip(keys, queries):
+            if key in found or key in misses:
+                continue
+            cached = None if (bypass or self.cache is None) else self.cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                misses[key] = query
+
+        def fetch(item):
+            key, query = item
+            with span("search", self.provider.name) as current:
+                try:
+                    results = self.provider.search(query, k)
+                except Exception as e:
+                    current.add("errors")
+                    return key, [], e
+                current.add("results", len(results))
+                return key, results, None
+
+        record("search", self.provider.name, "cache_hits", len(set(keys)) - len(misses))
+        if misses:
+            # Context-propagating threads: search spans still reach the audit's metric listener
+            with ContextThreadPoolExecutor(max_workers=min(len(misses), get_max_concurrency())) as pool:
+                for key, results, error in pool.map(fetch, misses.items()):
+                    found[key] = results
+                    if error is not None:
+                        print(f"Market research error ({self.provider.name}) for '{misses[key][:80]}': {error}")
+                    elif self.cache is not None:
+                        self.cache.set(key, results)
+        print(f"Market research: {len(misses)} lookups, {len(set(keys)) - len(misses)} served from cache.")
+        return [found[key] for key in keys]
+
+    def lookup(self, query: str, k: int = DEFAULT_RESULTS, bypass: bool = False) -> List[Dict[str, Any]]:
+        return self.lookup_many([query], k, bypass)[0]
+
+
+def get_provider() -> Optional[MarketResearchProvider]:
+    """
+    MARKET_RESEARCH_PROVIDER: "tavily", "local" (MARKET_CORPUS_PATH) or "none".
+    Default: Tavily when TAVILY_API_KEY is set, else the local corpus when configured.
+    """
+    corpus_path = env_path("MARKET_CORPUS_PATH")
+    choice = os.getenv("MARKET_RESEARCH_PROVIDER", "").strip().lower()
+    if not choice:
+        choice = "tavily" if os.getenv("TAVILY_API_KEY") else ("local" if corpus_path else "none")
+    if choice == "tavily":
+        try:
+            return TavilyProvider()
+        except ImportError:
+            print("⚠️ Tavily provider needs langchain-community. Market research disabled.", flush=True)
+            return None
+    if choice == "local":
+        if not corpus_path or not os.path.exists(corpus_path):
+            print(f"⚠️ MARKET_CORPUS_PATH not found ({corpus_path}). Market research disabled.", flush=True)
+            return None
+        return _corpus_provider(corpus_path)
+    return None
+
+
+_corpora: Dict[str, LocalCorpusProvider] = {}
+
+
+def _corpus_provider(corpus_path: str) -> LocalCorpusProvider:
+    """One indexed corpus per file content."""
+    digest = file_digest(corpus_path)
+    if digest not in _corpora:
+        _corpora[digest] = LocalCorpusProvider(corpus_path, digest)
+    return _corpora[digest]
+
+
+_market_caches: Dict[str, DiskCache] = {}
+
+
+def get_market_cache(workspace_id: str = None) -> DiskCache:
+    """Search result cache of a workspace (MARKET_CACHE_PATH, MARKET_CACHE_MAX_MB, MARKET_CACHE_TTL_HOURS)."""
+    workspace_id = workspace_id or DEFAULT_WORKSPACE
+    if workspace_id not in _market_caches:
+        _market_caches[workspace_id] = DiskCache(
+            workspace_cache_path(workspace_id, "market_cache.sqlite", "MARKET_CACHE_PATH"),
+            max_bytes=int(float(os.getenv("MARKET_CACHE_MAX_MB", "16")) * 1024 * 1024),
+            ttl_seconds=int(float(os.getenv("MARKET_CACHE_TTL_HOURS", "168")) * 3600)
+        )
+    return _market_caches[workspace_id]
+
+
+def get_market_research(workspace_id: str = None) -> MarketResearch:
+    """Configured provider behind the workspace's result cache."""
+    return MarketResearch(get_provider(), get_market_cache(workspace_id))
@@ -0,0 +1,111 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+COST_PER_POINT = 20_000  # $ per complexity point
+DEFAULT_COMPLEXITY = 5
+# Feasibility adjustment per strategic alignment (sponsorship makes delivery likelier)
+ALIGNMENT_FEASIBILITY = {"critical": 1, "high": 1, "medium": 0, "low": -1}
+
+
+def get_budget() -> Optional[float]:
+    """Portfolio budget in USD (PORTFOLIO_BUDGET_USD); None = fund every positive-value project."""
+    try:
+        budget = float(os.getenv("PORTFOLIO_BUDGET_USD", ""))
+    except ValueError:
+        return None
+    return budget if budget > 0 else None
+
+
+def score_pairs(
+    items: List[Dict[str, Any]],
+    relevance: np.ndarray,
+    complexity_overrides: Dict[Tuple[int, int], float] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Scores every (signal, backlog item) pair in one pass. All outputs are (signals x items) matrices.
+    - relevance: match scores from the backlog matcher (signals x items).
+    - cost = complexity_points x $20k, roi = impact / cost, nsv = impact - cost.
+    - feasibility 1-10: fewer complexity points and stronger strategic alignment score higher.
+    - complexity_overrides: {(signal row, item column): points}, e.g. the LLM's estimate for its pick.
+    """
+    shape = relevance.shape
+    impact = np.array([float(i.get("impact_usd") or 0) for i in items], dtype=np.float64)
+    complexity = np.array([float(i.get("complexity_points") or DEFAULT_COMPLEXITY) for i in items], dtype=np.float64)
+    bonus = np.array([
+        ALIGNMENT_FEASIBILITY.get(str(i.get("strategic_alignment", "")).lower(), 0) for i in items
+    ], dtype=np.float64)
+
+    complexity = np.broadcast_to(complexity, shape).copy()
+    for (row, column), points in (complexity_overrides or {}).items():
+        complexity[row, column] = points
+    impact = np.broadcast_to(impact, shape)
+    cost = complexity * COST_PER_POINT
+    return {
+        "relevance": relevance,
+        "impact": impact,
+        "cost": cost,
+        "roi": np.divide(impact, cost, out=np.zeros(shape), where=cost > 0),
+        "nsv": impact - cost,
+        "feasibility": np.clip(np.rint(10 - complexity / 10) + bonus, 1, 10).astype(int),
+    }
+
+
+def select_within_budget(cost: np.ndarray, value: np.ndarray, budget: Optional[float]) -> np.ndarray:
+    """
+    0/1 knapsack: the set of items maximizing total value with total cost <= budget.
+    Costs are counted in whole complexity points; each DP row is one vectorized update.
+    Returns a boolean mask over items.
+    """
+    chosen = value > 0
+    if budget is None:
+        return chosen
+    candidates = np.flatnonzero(chosen)
+    weights = np.ceil(cost[candidates] / COST_PER_POINT).astype(np.int64)
+    capacity = int(budget // COST_PER_POINT)
+    best = np.zeros(capacity + 1, dtype=np.float64)  # best[c] = max value within c points
+    take = np.zeros((len(candidates), capacity + 1), dtype=bool)
+    for row, (weight, item_value) in enumerate(zip(weights, value[candidates])):
+        if weight > capacity:
+            continue
+        with_item = np.full(capacity + 1, -np.inf)
+        with_item[weight:] = best[:capacity + 1 - weight] + item_value
+        take[row] = with_item > best
+        best = np.maximum(best, with_item)
+
+    chosen = np.zeros(len(value), dtype=bool)
+    remaining = capacity
+    for row in range(len(candidates) - 1, -1, -1):
+        if take[row, remaining]:
+            chosen[candidates[row]] = True
+            remaining -= weights[row]
+    return chosen
+
+
+def plan_portfolio(items: List[Dict[str, Any]], scores: Dict[str, np.ndarray], budget: Optional[float]) -> Dict[str, Any]:
+    """
+    Budget-constrained selection over the whole backlog.
+    An item is worth its NSV scaled by how well it matches its best signal (relative to that
+    signal's best match); items no signal matches are worth nothing.
+    """
+    relevance = scores["relevance"]
+    fit = np.zeros(len(items))
+    if len(relevance):
+        best_per_signal = relevance.max(axis=1, keepdims=True)
+        fit = np.divide(relevance, best_per_signal, out=np.zeros(relevance.shape), where=best_per_signal > 0).max(axis=0)
+    # Base economics per item (complexity overrides only apply to one signal's own pick)
+    cost = np.array([float(i.get("complexity_points") or DEFAULT_COMPLEXITY) for i in items]) * COST_PER_POINT
+    nsv = np.array([float(i.get("impact_usd") or 0) for i in items]) - cost
+    value = np.where(fit > 0, nsv * fit, 0.0)
+
+    chosen = select_within_budget(cost, value, budget)
+    order = np.flatnonzero(chosen)
+    order = order[np.argsort(-value[order], kind="stable")]
+    return {
+        "budget_usd": budget,
+        "positions": order.tolist(),
+        "projects": [items[p].get("id") for p in order],
+        "total_cost_usd": float(cost[order].sum()),
+        "total_nsv_usd": float(nsv[order].sum()),
+        "candidates": int((value > 0).sum())
+    }
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_ENCODING = "o200k_base"  # gpt-4o tokenizer
+CHARS_PER_TOKEN = 4  # Estimate used when the tokenizer's encoding can't be loaded (e.g. offline)
+MESSAGE_OVERHEAD = 3  # Tokens per chat message (role and separators)
+REPLY_OVERHEAD = 3  # Every reply is primed with <|start|>assistant<|message|>
+# USD per 1M tokens (gpt-4o list prices)
+DEFAULT_INPUT_PRICE = 2.50
+DEFAULT_OUTPUT_PRICE = 10.00
+
+
+class TokenBudgetExceeded(RuntimeError):
+    """An LLM call would take its agent or its audit past the token budget."""
+
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    Local tokenizer (tiktoken, LLM_TOKENIZER_ENCODING). False when it can't be loaded:
+    token counts are then estimated from the text length.
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                name = os.getenv("LLM_TOKENIZER_ENCODING", DEFAULT_ENCODING)
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(name)
+                except Exception as e:
+                    print(f"⚠️ Tokenizer {name} unavailable ({type(e).__name__}). Estimating tokens from text length.", flush=True)
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def count_messages(messages: list) -> int:
+    """Prompt tokens of a chat call (message contents plus the chat format overhead)."""
+    return sum(MESSAGE_OVERHEAD + count_tokens(str(m.content)) for m in messages) + REPLY_OVERHEAD
+
+
+def _env_float(name: str, default: float = None) -> Optional[float]:
+    try:
+        return float(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+def get_prices() -> tuple:
+    """USD per 1M (input, output) tokens (LLM_PRICE_INPUT_PER_1M, LLM_PRICE_OUTPUT_PER_1M)."""
+    return (
+        _env_float("LLM_PRICE_INPUT_PER_1M", DEFAULT_INPUT_PRICE),
+        _env_float("LLM_PRICE_OUTPUT_PER_1M", DEFAULT_OUTPUT_PRICE)
+    )
+
+
+def get_token_budget(agent: str = None) -> Optional[int]:
+    """
+    Tokens (prompt + completion) one audit may spend: LLM_AUDIT_TOKEN_BUDGET overall,
+    LLM_TOKEN_BUDGET_<AGENT> (e.g. LLM_TOKEN_BUDGET_INVESTIGATOR) per agent. None = unlimited.
+    """
+    name = f"LLM_TOKEN_BUDGET_{agent.upper()}" if agent else "LLM_AUDIT_TOKEN_BUDGET"
+    budget = _env_float(name)
+    return int(budget) if budget and budget > 0 else None
+
+
+def compact_json(data: Any) -> str:
+    """Minified JSON for prompts (no indentation or spaces after separators)."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def compact_prompt(text: str) -> str:
+    """
+    Prompt text without its source-code layout: the first line's indentation is removed from every
+    line indented at least as deep (relative indentation is kept), as are trailing spaces and
+    repeated blank lines. Less indented lines (e.g. embedded logs or CSV rows) are left as they are.
+    """
+    lines = [line.rstrip() for line in text.split("\n")]
+    first = next((line for line in lines if line), "")
+    margin = " " * (len(first) - len(first.lstrip(" ")))
+    compacted: List[str] = []
+    for line in lines:
+        if line or (compacted and compacted[-1]):
+            compacted.append(line[len(margin):] if margin and line.startswith(margin) else line)
+    return "\n".join(compacted).strip("\n")
+
+
+def compact_messages(messages: list) -> list:
+    """Chat messages with compact_prompt() applied to their text content."""
+    return [
+        m.model_copy(update={"content": compact_prompt(m.content)}) if isinstance(m.content, str) else m
+        for m in messages
+    ]
+
+
+def fit_to_budget(items: List[Any], render: Callable[[List[Any]], str], budget: Optional[int]) -> List[Any]:
+    """Longest prefix of items (most relevant first) whose rendering fits in `budget` tokens (at least one item)."""
+    if budget is None or len(items) <= 1 or count_tokens(render(items)) <= budget:
+        return items
+    low, high = 1, len(items) - 1  # The largest fitting prefix, by binary search over its length
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(render(items[:middle])) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return items[:low]
+
+
+class TokenLedger:
+    """
+    Token accounting of one audit, per agent (graph node).
+    - charge() counts a prompt before it is sent and refuses it when it would exceed the
+      agent's or the audit's budget (the call then fails on its own, see llm.batch_invoke).
+    - settle() records the reply: the provider's usage when reported, the local count otherwise.
+    - Cache hits are free; their prompt tokens are reported as saved.
+    """
+
+    def __init__(self, audit_budget: Optional[int] = None, agent_budgets: Dict[str, Optional[int]] = None):
+        self.audit_budget = audit_budget
+        self._agent_budgets = dict(agent_budgets or {})
+        self._usage: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _agent(self, agent: str) -> Dict[str, int]:
+        return self._usage.setdefault(agent, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                              "cache_hits": 0, "saved_tokens": 0, "refused": 0})
+
+    def _budget(self, agent: str) -> Optional[int]:
+        if agent not in self._agent_budgets:
+            self._agent_budgets[agent] = get_token_budget(agent)
+        return self._agent_budgets[agent]
+
+    def spent(self, agent: str = None) -> int:
+        usages = [self._usage.get(agent, {})] if agent else list(self._usage.values())
+        return sum(u.get("prompt_tokens", 0) + u.get("completion_tokens", 0) for u in usages)
+
+    def charge(self, agent: str, messages: list) -> int:
+        """Reserves the prompt's tokens; raises TokenBudgetExceeded instead when they don't fit."""
+        tokens = count_messages(messages)
+        with self._lock:
+            usage = self._agent(agent)
+            for scope, budget, spent in (
+                (agent, self._budget(agent), self.spent(agent)),
+                ("audit", self.audit_budget, self.spent())
+            ):
+                if budget is not None and spent + tokens > budget:
+                    usage["refused"] += 1
+                    raise TokenBudgetExceeded(
+                        f"{tokens} prompt tokens would exceed the {scope} token budget ({spent}/{budget} spent)"
+                    )
+            usage["calls"] += 1
+            usage["prompt_tokens"] += tokens
+        return tokens
+
+    def settle(self, agent: str, charged: int, reply: Any) -> tuple:
+        """
+        Replaces a charged estimate with the reply's actual usage (a failed call is refunded).
+        Returns the call's (prompt, completion) tokens.
+        """
+        if isinstance(reply, Exception):
+            prompt_tokens = completion_tokens = 0
+        else:
+            reported = getattr(reply, "usage_metadata", None) or {}
+            prompt_tokens = reported.get("input_tokens", charged)
+            completion_tokens = reported.get("output_tokens") or count_tokens(str(reply.content))
+        with self._lock:
+            usage = self._agent(agent)
+            if isinstance(reply, Exception):
+                usage["calls"] -= 1
+            usage["prompt_tokens"] += prompt_tokens - charged
+            usage["completion_tokens"] += completion_tokens
+        return prompt_tokens, completion_tokens
+
+    def cached(self, agent: str, messages: list):
+        tokens = count_messages(messages)
+        with self._lock:
+            usage = self._agent(agent)
+            usage["cache_hits"] += 1
+            usage["saved_tokens"] += tokens
+
+    def report(self) -> Dict[str, Any]:
+        """{"nodes": {agent: usage + cost_usd}, "total": ...}; costs are estimates from get_prices()."""
+        input_price, output_price = get_prices()
+        with self._lock:
+            nodes = {agent: dict(usage) for agent, usage in self._usage.items()}
+        total = {key: sum(u[key] for u in nodes.values()) for key in
+                 ("calls", "prompt_tokens", "completion_tokens", "cache_hits", "saved_tokens", "refused")}
+        for usage in list(nodes.values()) + [total]:
+            usage["cost_usd"] = round(
+                (usage["prompt_tokens"] * input_price + usage["completion_tokens"] * output_price) / 1_000_000, 6
+            )
+        total["budget"] = self.audit_budget
+        return {"nodes": nodes, "total": total}
+
+
+_ledgers: Dict[str, TokenLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def open_ledger(run_id: str) -> TokenLedger:
+    """Starts (or continues, for a resumed run) the token accounting of an audit run."""
+    with _ledgers_lock:
+        if run_id not in _ledgers:
+            _ledgers[run_id] = TokenLedger(get_token_budget())
+        return _ledgers[run_id]
+
+
+def get_ledger(run_id: str = None) -> Optional[TokenLedger]:
+    """Ledger of a running audit; None outside an audit (calls are then neither counted nor limited)."""
+    if not run_id:
+        return None
+    with _ledgers_lock:
+        return _ledgers.get(run_id)
+
+
+def close_ledger(run_id: str) -> Optional[TokenLedger]:
+    with _ledgers_lock:
+        return _ledgers.pop(run_id, None)
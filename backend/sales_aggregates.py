@@ -0,0 +1,304 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+from llm_cache import DEFAULT_WORKSPACE, workspace_cache_path
+from sales_data import canonical_columns, iter_sales_chunks
+
+TAIL_BYTES = 4096
+
+
+class _ByteRange(io.RawIOBase):
+    """Read-only view of the next `length` bytes of an open binary file."""
+
+    def __init__(self, f, length: int):
+        self._f = f
+        self._remaining = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        data = self._f.read(size)
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+class IncrementalSalesStore:
+    """
+    Base for persisted aggregates folded incrementally from append-only sales CSVs.
+    - sources: per-file watermark (byte offset of the last ingested row) so only appended rows are read.
+    - Subclasses create their per-source tables (listed in `tables`) and fold deltas from read_delta().
+    A file that was rewritten rather than appended to (header or bytes before the watermark changed)
+    is re-ingested from scratch. A delta is folded only if the watermark it was read from is still
+    current, so two concurrent readers of the same rows can't count them twice.
+    """
+
+    tables: Tuple[str, ...] = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ensure_storage_exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ensure_storage_exists(self):
+        """Create database and tables if they don't exist"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                " source TEXT PRIMARY KEY,"
+                " header TEXT NOT NULL,"
+                " byte_offset INTEGER NOT NULL,"
+                " tail_digest TEXT NOT NULL,"
+                " row_count INTEGER NOT NULL,"
+                " updated_at TEXT NOT NULL)"
+            )
+            self._create_tables(conn)
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        pass
+
+    @staticmethod
+    def _source(csv_path: str) -> str:
+        return os.path.abspath(csv_path)
+
+    @staticmethod
+    def _tail_digest(f, offset: int) -> str:
+        f.seek(max(0, offset - TAIL_BYTES))
+        return hashlib.sha256(f.read(min(offset, TAIL_BYTES))).hexdigest()
+
+    def read_delta(self, csv_path: str, immutable: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Rows appended to csv_path since the last watermark, as typed chunks (see sales_data.iter_sales_chunks).
+        Returns {"frames": iterator of DataFrames, "columns", "reset": bool, "first_seq": int, ...} (pass it back
+        to apply()), or None when there is nothing new. Only complete lines are read, unless the file is
+        immutable (e.g. a content-addressed upload), where a last line without a newline is a row too.
+        """
+        source = self._source(csv_path)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT header, byte_offset, tail_digest, row_count FROM sources WHERE source = ?", (source,)
+            ).fetchone()
+
+        with open(csv_path, "rb") as f:
+            header_line = f.readline()
+            header = header_line.decode("utf-8-sig").strip()
+            size = os.fstat(f.fileno()).st_size
+
+            reset = (
+                row is None
+                or row[0] != header
+                or row[1] > size
+                or self._tail_digest(f, row[1]) != row[2]
+            )
+            start = len(header_line) if reset else row[1]
+            previous = (row[1], row[2]) if row else None
+            first_seq = 0 if reset else row[3]
+
+            # Stop at the last newline so a row that is still being written is left for next time
+            new_offset = size if immutable else self._last_line_end(f, start, size)
+            if not reset and new_offset == start:
+                return None
+            tail_digest = self._tail_digest(f, new_offset)
+
+        raw_columns = list(pd.read_csv(io.StringIO(header), nrows=0).columns)
+        return {
+            "source": source,
+            "header": header,
+            "reset": reset,
+            "first_seq": first_seq,
+            "previous": previous,
+            "byte_offset": new_offset,
+            "tail_digest": tail_digest,
+            "bytes": new_offset - start,
+            "columns": canonical_columns(raw_columns),
+            "frames": self._iter_range(csv_path, start, new_offset, raw_columns)
+        }
+
+    @staticmethod
+    def _last_line_end(f, start: int, size: int) -> int:
+        """Offset just past the last newline in [start, size), scanning backwards (start if none)."""
+        position = size
+        while position > start:
+            block_start = max(start, position - TAIL_BYTES)
+            f.seek(block_start)
+            found = f.read(position - block_start).rfind(b"\n")
+            if found >= 0:
+                return block_start + found + 1
+            position = block_start
+        return start
+
+    @staticmethod
+    def _iter_range(csv_path: str, start: int, end: int, raw_columns: List[str]):
+        """Typed chunks of the rows in bytes [start, end) of the file, streamed (never loaded whole)."""
+        if end <= start:
+            return
+        with open(csv_path, "rb") as f:
+            f.seek(start)
+            reader = io.BufferedReader(_ByteRange(f, end - start))
+            yield from iter_sales_chunks(reader, names=raw_columns, float_dtype='float64')
+
+    def _advance(self, conn: sqlite3.Connection, delta: Dict[str, Any], row_count: int) -> bool:
+        """
+        Moves the source's watermark past a delta (call first in the transaction that folds it).
+        Returns False, changing nothing, when the watermark moved since the delta was read: its rows
+        were folded by someone else and must be skipped.
+        """
+        source = delta["source"]
+        conn.execute("BEGIN IMMEDIATE")  # Check and move the watermark under the database's write lock
+        row = conn.execute("SELECT byte_offset, tail_digest FROM sources WHERE source = ?", (source,)).fetchone()
+        if (tuple(row) if row else None) != delta["previous"]:
+            return False
+        if delta["reset"]:
+            for table in self.tables:
+                conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+        conn.execute(
+            "INSERT OR REPLACE INTO sources (source, header, byte_offset, tail_digest, row_count, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (source, delta["header"], delta["byte_offset"], delta["tail_digest"],
+             delta["first_seq"] + row_count, datetime.now().isoformat())
+        )
+        return True
+
+    def watermark(self, csv_path: str) -> Optional[Dict[str, Any]]:
+        """Rows ingested so far and when, or None if the source was never ingested."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT row_count, updated_at FROM sources WHERE source = ?", (self._source(csv_path),)
+            ).fetchone()
+        return {"row_count": row[0], "updated_at": row[1]} if row else None
+
+    def clear(self, csv_path: str = None):
+        """Forget the aggregates of one source (or all of them); the next run re-ingests from scratch."""
+        with self._lock, self._connect() as conn:
+            for table in ("sources", *self.tables):
+                if csv_path:
+                    conn.execute(f"DELETE FROM {table} WHERE source = ?", (self._source(csv_path),))
+                else:
+                    conn.execute(f"DELETE FROM {table}")
+
+
+class SalesAggregateStore(IncrementalSalesStore):
+    """
+    Persisted per-segment monthly aggregates of a sales CSV (incremental audits).
+    - segment_months: running revenue sum and deal count per (Region, Product_Tier, month).
+    - cell_deals: the largest deals per cell, kept for evidence_csv.
+    """
+
+    tables = ("segment_months", "cell_deals")
+
+    def __init__(self, path: str, deals_per_cell: int = 10):
+        self.deals_per_cell = deals_per_cell
+        super().__init__(path)
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS segment_months ("
+            " source TEXT NOT NULL,"
+            " region TEXT NOT NULL,"
+            " tier TEXT NOT NULL,"
+            " month TEXT NOT NULL,"
+            " revenue REAL NOT NULL,"
+            " deals INTEGER NOT NULL,"
+            " PRIMARY KEY (source, region, tier, month))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cell_deals ("
+            " source TEXT NOT NULL,"
+            " region TEXT NOT NULL,"
+            " tier TEXT NOT NULL,"
+            " month TEXT NOT NULL,"
+            " deal_size REAL NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " row TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cell_deals_cell ON cell_deals(source, region, tier, month)")
+
+    def apply(
+        self,
+        delta: Dict[str, Any],
+        cells: List[Tuple[str, str, str, float, int]],
+        deals: List[Tuple[str, str, str, float, int, str]],
+        row_count: int
+    ) -> bool:
+        """
+        Folds a delta into the aggregates and advances the watermark in one transaction.
+        cells: (region, tier, month, revenue, deals); deals: (region, tier, month, deal_size, seq, row_json).
+        Returns False (nothing folded) when the delta was already folded (see _advance).
+        """
+        source = delta["source"]
+        with self._lock, self._connect() as conn:
+            if not self._advance(conn, delta, row_count):
+                return False
+            conn.executemany(
+                "INSERT INTO segment_months (source, region, tier, month, revenue, deals) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(source, region, tier, month) DO UPDATE SET "
+                " revenue = revenue + excluded.revenue, deals = deals + excluded.deals",
+                [(source, *cell) for cell in cells]
+            )
+            conn.executemany(
+                "INSERT INTO cell_deals (source, region, tier, month, deal_size, seq, row) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(source, *deal) for deal in deals]
+            )
+            # Keep only the top deals of the cells that changed
+            touched = {(d[0], d[1], d[2]) for d in deals}
+            for region, tier, month in touched:
+                conn.execute(
+                    "DELETE FROM cell_deals WHERE rowid IN ("
+                    " SELECT rowid FROM cell_deals WHERE source = ? AND region = ? AND tier = ? AND month = ?"
+                    " ORDER BY deal_size DESC, seq ASC LIMIT -1 OFFSET ?)",
+                    (source, region, tier, month, self.deals_per_cell)
+                )
+        return True
+
+    def monthly_revenue(self, csv_path: str) -> pd.DataFrame:
+        """All (region, tier, month, revenue) aggregates of a source (segments x months, not rows)."""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT region, tier, month, revenue FROM segment_months WHERE source = ?",
+                conn, params=(self._source(csv_path),)
+            )
+
+    def top_deals(self, csv_path: str, cells: List[Tuple[str, str, str]]) -> Dict[tuple, List[Dict[str, Any]]]:
+        """Stored evidence rows (largest deals first) for the given (region, tier, month) cells."""
+        source = self._source(csv_path)
+        evidence = {}
+        with self._connect() as conn:
+            for region, tier, month in cells:
+                rows = conn.execute(
+                    "SELECT row FROM cell_deals WHERE source = ? AND region = ? AND tier = ? AND month = ? "
+                    "ORDER BY deal_size DESC, seq ASC",
+                    (source, region, tier, month)
+                ).fetchall()
+                evidence[(region, tier, month)] = [json.loads(r[0]) for r in rows]
+        return evidence
+
+
+_stores: Dict[str, SalesAggregateStore] = {}
+
+
+def get_sales_aggregates(deals_per_cell: int = 10, workspace_id: str = None) -> SalesAggregateStore:
+    """Aggregate store of a workspace (SALES_AGGREGATES_PATH)."""
+    workspace_id = workspace_id or DEFAULT_WORKSPACE
+    if workspace_id not in _stores:
+        _stores[workspace_id] = SalesAggregateStore(
+            workspace_cache_path(workspace_id, "sales_aggregates.sqlite", "SALES_AGGREGATES_PATH"),
+            deals_per_cell=deals_per_cell
+        )
+    return _stores[workspace_id]
@@ -0,0 +1,223 @@
+import os
+from typing import Any, Dict, Iterator, List, Optional
+import pandas as pd
+from llm_cache import DEFAULT_CACHE_DIR, env_path, file_digest
+from telemetry import traced
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Columnar cache is optional; fall back to parsing the CSV
+    pa = pq = None
+
+# Map uploaded column variations onto the canonical sales schema
+SALES_COLUMN_MAP = {
+    'Deal_Size': 'Deal_Size_USD',
+    'Deal Size': 'Deal_Size_USD',
+    'Class': 'Product_Tier',
+    'Product Tier': 'Product_Tier',
+    'Account': 'Account_Name',
+    'Rep': 'Sales_Rep',
+    'Sales Rep': 'Sales_Rep'
+}
+REQUIRED_SALES_COLUMNS = ['Date', 'Region', 'Product_Tier', 'Deal_Size_USD']
+
+# Explicit schema instead of inferred dtypes (low-cardinality text as categoricals)
+SALES_DATE_FORMAT = '%m/%d/%y'
+CATEGORICAL_COLUMNS = ['Region', 'Product_Tier', 'Sales_Rep']
+FLOAT_COLUMNS = ['Deal_Size_USD']
+DEFAULT_CHUNK_ROWS = 250_000
+COLUMNAR_CACHE_FILES = 8  # Most recent converted datasets kept on disk
+
+
+def get_chunk_rows() -> int:
+    """Rows per chunk when streaming sales files (SALES_CHUNK_ROWS); bounds peak memory."""
+    try:
+        return max(1, int(os.getenv("SALES_CHUNK_ROWS", DEFAULT_CHUNK_ROWS)))
+    except ValueError:
+        return DEFAULT_CHUNK_ROWS
+
+
+def parse_sales_dates(dates: pd.Series) -> pd.Series:
+    """Parse the sales 'Date' column (%m/%d/%y export format, ISO dates as a fallback)."""
+    parsed = pd.to_datetime(dates, format=SALES_DATE_FORMAT, errors='coerce')
+    if parsed.isna().all():
+        parsed = pd.to_datetime(dates, errors='coerce')
+    return parsed
+
+
+def parse_amounts(values: pd.Series, float_dtype: str = 'float64') -> pd.Series:
+    """Amount columns as floats, NaN where unparseable (no currency symbols or thousands separators)."""
+    return pd.to_numeric(values, errors='coerce').astype(float_dtype)
+
+
+def canonical_columns(raw_columns: List[str]) -> List[str]:
+    return [SALES_COLUMN_MAP.get(c, c) for c in raw_columns]
+
+
+def read_sales_columns(csv_path: str) -> List[str]:
+    """Canonical column names of a sales CSV (reads the header only)."""
+    return canonical_columns(list(pd.read_csv(csv_path, nrows=0).columns))
+
+
+def iter_sales_chunks(
+    source,
+    columns: List[str] = None,
+    chunksize: int = None,
+    names: List[str] = None,
+    float_dtype: str = 'float32'
+) -> Iterator[pd.DataFrame]:
+    """
+    Streams a sales CSV as typed chunks with canonical column names.
+    - columns: canonical columns to load (projection); None loads every column.
+    - names: raw header for headerless input (e.g. a byte range appended to a file).
+    - Region/Product_Tier/Sales_Rep are categoricals, Deal_Size_USD is float32 (unparseable -> NaN),
+      Date is datetime64 (NaT where unparseable).
+    - float_dtype='float64' keeps exact amounts, for passes that quote rows (evidence).
+    - Chunks are indexed by their row position in the file.
+    - A path with a columnar cache (see build_columnar_cache) is read from the cache instead of the CSV.
+    """
+    cached = columnar_path(source) if names is None and isinstance(source, str) else None
+    if cached and os.path.exists(cached):
+        yield from _iter_columnar(cached, columns, chunksize, float_dtype)
+        return
+
+    raw = names if names is not None else list(pd.read_csv(source, nrows=0).columns)
+    wanted = [c for c in raw if columns is None or SALES_COLUMN_MAP.get(c, c) in columns]
+    dtype = {c: 'category' for c in wanted if SALES_COLUMN_MAP.get(c, c) in CATEGORICAL_COLUMNS}
+
+    reader = pd.read_csv(
+        source,
+        usecols=wanted,
+        dtype=dtype,
+        header=None if names is not None else 'infer',
+        names=names,
+        chunksize=chunksize or get_chunk_rows()
+    )
+    position = 0
+    for chunk in reader:
+        chunk = chunk.rename(columns=SALES_COLUMN_MAP)
+        chunk.index = pd.RangeIndex(position, position + len(chunk))
+        position += len(chunk)
+        for column in FLOAT_COLUMNS:
+            if column in chunk.columns:
+                chunk[column] = parse_amounts(chunk[column], float_dtype)
+        if 'Date' in chunk.columns:
+            chunk['Date'] = parse_sales_dates(chunk['Date'])
+        yield chunk
+
+
+@traced("load")
+def inspect_sales(csv_path: str, rows: int = 5) -> Dict[str, Any]:
+    """Columns, dtypes, head and tail of a sales file without holding it in memory."""
+    head = None
+    tail = None
+    total = 0
+    for chunk in iter_sales_chunks(csv_path, float_dtype='float64'):
+        if head is None:
+            head = chunk.head(rows)
+        tail = chunk.tail(rows) if tail is None else pd.concat([tail, chunk.tail(rows)]).tail(rows)
+        total += len(chunk)
+    head = head if head is not None else pd.DataFrame(columns=read_sales_columns(csv_path))
+    return {
+        "columns": list(head.columns),
+        "dtypes": {column: str(dtype) for column, dtype in head.dtypes.items()},
+        "head": head,
+        "tail": tail if tail is not None else head,
+        "rows": total
+    }
+
+
+def columnar_path(csv_path: str) -> Optional[str]:
+    """Location of the columnar (Parquet) copy of a sales file, keyed by its content digest."""
+    if pq is None:
+        return None
+    digest = file_digest(csv_path)
+    if digest is None:
+        return None
+    cache_dir = env_path("SALES_COLUMNAR_DIR", os.path.join(DEFAULT_CACHE_DIR, "columnar"))
+    return os.path.join(cache_dir, f"{digest}.parquet")
+
+
+def _arrow_type(dtype):
+    """Fixed Arrow type per pandas dtype so every chunk (row group) shares one schema."""
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pa.dictionary(pa.int32(), pa.string())
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return pa.timestamp('us')
+    if pd.api.types.is_bool_dtype(dtype):
+        return pa.bool_()
+    if pd.api.types.is_numeric_dtype(dtype):
+        return pa.float64()
+    return pa.string()
+
+
+@traced("load")
+def build_columnar_cache(csv_path: str) -> Optional[str]:
+    """
+    Converts a sales CSV once into a typed Parquet file (parsed dates, dictionary-encoded
+    categoricals, exact float64 amounts), streamed chunk by chunk.
+    Returns the cache path, or None if pyarrow is unavailable or the conversion failed.
+    """
+    path = columnar_path(csv_path)
+    if path is None:
+        return None
+    if os.path.exists(path):
+        os.utime(path)  # Recently used datasets survive pruning
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    writer = None
+    try:
+        for chunk in iter_sales_chunks(csv_path, float_dtype='float64'):
+            if writer is None:
+                schema = pa.schema([(name, _arrow_type(dtype)) for name, dtype in chunk.dtypes.items()])
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        if writer is None:
+            return None
+        writer.close()
+        writer = None
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Columnar cache conversion failed for {os.path.basename(csv_path)}: {e}", flush=True)
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _prune_columnar_cache(os.path.dirname(path))
+    print(f"🗂️ Cached {os.path.basename(csv_path)} as columnar data.", flush=True)
+    return path
+
+
+def _prune_columnar_cache(cache_dir: str):
+    files = sorted(
+        (os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".parquet")),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for stale in files[COLUMNAR_CACHE_FILES:]:
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+
+def _iter_columnar(path: str, columns: List[str], chunksize: int, float_dtype: str) -> Iterator[pd.DataFrame]:
+    """Memory-mapped, column-projected read of a columnar cache file (no CSV parsing)."""
+    parquet = pq.ParquetFile(path, memory_map=True)
+    available = parquet.schema_arrow.names
+    wanted = [c for c in available if columns is None or c in columns]
+    position = 0
+    for batch in parquet.iter_batches(batch_size=chunksize or get_chunk_rows(), columns=wanted):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(position, position + len(chunk))
+        position += len(chunk)
+        for column in FLOAT_COLUMNS:
+            if column in chunk.columns:
+                chunk[column] = chunk[column].astype(float_dtype)
+        yield chunk
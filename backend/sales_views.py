@@ -0,0 +1,282 @@
+import base64
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+import pandas as pd
+from llm_cache import DEFAULT_WORKSPACE, workspace_cache_path
+from sales_aggregates import IncrementalSalesStore
+from telemetry import traced
+
+MAX_PAGE_SIZE = 200
+# Account status by lifetime spend (USD)
+STRATEGIC_SPEND = 100_000
+ACTIVE_SPEND = 50_000
+
+# Sortable fields -> column (every customers sort column is indexed per source)
+CUSTOMER_SORTS = {
+    "total_spend": "total_spend",
+    "last_active": "last_active",
+    "deals": "deals",
+    "name": "name"
+}
+TEAM_SORTS = {
+    "total_revenue": "total_revenue",
+    "deals_closed": "deals_closed",
+    "avg_deal_size": "avg_deal_size",
+    "avg_cycle_days": "IFNULL(avg_cycle_days, -1)",  # Files without Cycle_Days sort last
+    "name": "name"
+}
+
+
+def account_status(total_spend: float) -> str:
+    if total_spend > STRATEGIC_SPEND:
+        return "Strategic"
+    return "Active" if total_spend > ACTIVE_SPEND else "Standard"
+
+
+class SalesViewStore(IncrementalSalesStore):
+    """
+    Dashboard views of a sales CSV, kept up to date from appended rows only.
+    - accounts: lifetime spend, deal count and last activity per (Account_Name, Region, Product_Tier).
+    - reps: revenue, deals and sales-cycle totals per Sales_Rep (cycle only when the file has Cycle_Days).
+    - customers() / team() serve one keyset-paginated page straight from an index,
+      so page cost does not grow with the number of accounts.
+    """
+
+    tables = ("accounts", "reps")
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        # One refresh per store at a time: a delta must not be folded twice
+        self._refresh_lock = threading.Lock()
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS accounts ("
+            " id INTEGER PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " region TEXT NOT NULL,"
+            " segment TEXT NOT NULL,"
+            " total_spend REAL NOT NULL,"
+            " deals INTEGER NOT NULL,"
+            " last_active TEXT NOT NULL,"
+            " UNIQUE (source, name, region, segment))"
+        )
+        for column in ("total_spend", "last_active", "deals", "name"):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_accounts_{column} ON accounts(source, {column}, id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS reps ("
+            " id INTEGER PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " total_revenue REAL NOT NULL,"
+            " deals_closed INTEGER NOT NULL,"
+            " avg_deal_size REAL NOT NULL,"
+            " cycle_total REAL NOT NULL,"
+            " cycle_count INTEGER NOT NULL,"
+            " avg_cycle_days REAL,"
+            " UNIQUE (source, name))"
+        )
+
+    @traced("load", "sales_views")
+    def refresh(self, csv_path: str, immutable: bool = False) -> Dict[str, Any]:
+        """
+        Folds the rows appended since the last refresh into the views (the first run ingests the whole file).
+        immutable: the file never changes (uploads), so its last line counts even without a newline.
+        Returns {"rows": new rows, "reset": bool, "accounts": touched, "reps": touched}.
+        """
+        with self._refresh_lock:
+            delta = self.read_delta(csv_path, immutable)
+            if delta is None:
+                return {"rows": 0, "reset": False, "accounts": 0, "reps": 0}
+
+            accounts: Dict[tuple, list] = {}
+            reps: Dict[str, list] = {}
+            rows = 0
+            for chunk in delta["frames"]:
+                rows += len(chunk)
+                spend = chunk["Deal_Size_USD"]  # Unparseable amounts count as neither spend nor a deal
+                if "Account_Name" in chunk.columns:
+                    keys = [chunk["Account_Name"].astype(str), chunk["Region"].astype(str), chunk["Product_Tier"].astype(str)]
+                    grouped = pd.DataFrame({"spend": spend, "date": chunk["Date"]}).groupby(keys, observed=True).agg(
+                        spend=("spend", "sum"), deals=("spend", "count"), last=("date", "max")
+                    )
+                    for key, (total, count, last) in grouped.iterrows():
+                        last = last.strftime("%Y-%m-%d") if pd.notna(last) else ""
+                        entry = accounts.setdefault(key, [0.0, 0, ""])
+                        entry[0] += float(total)
+                        entry[1] += int(count)
+                        entry[2] = max(entry[2], last)
+                if "Sales_Rep" in chunk.columns:
+                    cycle = pd.to_numeric(chunk["Cycle_Days"], errors="coerce") if "Cycle_Days" in chunk.columns \
+                        else pd.Series(float("nan"), index=chunk.index)
+                    grouped = pd.DataFrame({"spend": spend, "cycle": cycle}).groupby(chunk["Sales_Rep"], observed=True).agg(
+                        total=("spend", "sum"), deals=("spend", "count"),
+                        cycle_total=("cycle", "sum"), cycle_count=("cycle", "count")
+                    )
+                    for rep, (total, count, cycle_total, cycle_count) in grouped.iterrows():
+                        entry = reps.setdefault(str(rep), [0.0, 0, 0.0, 0])
+                        entry[0] += float(total)
+                        entry[1] += int(count)
+                        entry[2] += float(cycle_total)
+                        entry[3] += int(cycle_count)
+
+            with self._lock, self._connect() as conn:
+                if not self._advance(conn, delta, rows):
+                    return {"rows": 0, "reset": False, "accounts": 0, "reps": 0}
+                source = delta["source"]
+                conn.executemany(
+                    "INSERT INTO accounts (source, name, region, segment, total_spend, deals, last_active) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(source, name, region, segment) DO UPDATE SET "
+                    " total_spend = total_spend + excluded.total_spend, deals = deals + excluded.deals,"
+                    " last_active = MAX(last_active, excluded.last_active)",
+                    [(source, *key, *values) for key, values in accounts.items()]
+                )
+                # Averages are stored (not computed per query) so they can be sorted on
+                conn.executemany(
+                    "INSERT INTO reps (source, name, total_revenue, deals_closed, avg_deal_size,"
+                    " cycle_total, cycle_count, avg_cycle_days) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(source, name) DO UPDATE SET "
+                    " total_revenue = total_revenue + excluded.total_revenue,"
+                    " deals_closed = deals_closed + excluded.deals_closed,"
+                    " avg_deal_size = CASE WHEN deals_closed + excluded.deals_closed > 0"
+                    "  THEN (total_revenue + excluded.total_revenue) / (deals_closed + excluded.deals_closed) ELSE 0 END,"
+                    " cycle_total = cycle_total + excluded.cycle_total,"
+                    " cycle_count = cycle_count + excluded.cycle_count,"
+                    " avg_cycle_days = CASE WHEN cycle_count + excluded.cycle_count > 0"
+                    "  THEN (cycle_total + excluded.cycle_total) / (cycle_count + excluded.cycle_count) END",
+                    [
+                        (source, rep, total, count, total / count if count else 0.0,
+                         cycle_total, cycle_count, cycle_total / cycle_count if cycle_count else None)
+                        for rep, (total, count, cycle_total, cycle_count) in reps.items()
+                    ]
+                )
+            return {"rows": rows, "reset": delta["reset"], "accounts": len(accounts), "reps": len(reps)}
+
+    @staticmethod
+    def encode_cursor(value: Any, row_id: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, row_id
+
+    def _page(
+        self,
+        table: str,
+        columns: str,
+        sort_sql: str,
+        descending: bool,
+        csv_path: str,
+        limit: int,
+        cursor: Optional[str],
+        where: List[str],
+        params: List[Any]
+    ) -> tuple:
+        """Keyset pagination on (sort value, id); ties are broken by id in the same direction."""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = ["source = ?"] + where
+        params = [self._source(csv_path)] + params
+        op, direction = ("<", "DESC") if descending else (">", "ASC")
+        if cursor:
+            value, row_id = self.decode_cursor(cursor)
+            where.append(f"({sort_sql} {op} ? OR ({sort_sql} = ? AND id {op} ?))")
+            params.extend([value, value, row_id])
+        sql = (
+            f"SELECT {columns}, {sort_sql}, id FROM {table} WHERE {' AND '.join(where)} "
+            f"ORDER BY {sort_sql} {direction}, id {direction} LIMIT ?"
+        )
+        with self._connect() as conn:
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1][-2], rows[-1][-1])
+        return [row[:-2] for row in rows], next_cursor
+
+    def customers(
+        self,
+        csv_path: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        sort: str = "total_spend",
+        descending: bool = True,
+        region: Optional[List[str]] = None,
+        segment: Optional[List[str]] = None,
+        status: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        One page of accounts. Filters: region, segment (Product_Tier), status (Strategic/Active/Standard).
+        Returns {"customers": [...], "next_cursor": str | None}.
+        """
+        where, params = [], []
+        for column, values in (("region", region), ("segment", segment)):
+            if values:
+                where.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if status:
+            bands = {
+                "strategic": ("total_spend > ?", [STRATEGIC_SPEND]),
+                "active": ("(total_spend > ? AND total_spend <= ?)", [ACTIVE_SPEND, STRATEGIC_SPEND]),
+                "standard": ("total_spend <= ?", [ACTIVE_SPEND])
+            }
+            chosen = [bands[s.lower()] for s in status if s.lower() in bands]
+            where.append("(" + " OR ".join(sql for sql, _ in chosen) + ")" if chosen else "0")
+            params.extend(p for _, band_params in chosen for p in band_params)
+
+        rows, next_cursor = self._page(
+            "accounts", "name, region, segment, total_spend, deals, last_active",
+            CUSTOMER_SORTS[sort], descending, csv_path, limit, cursor, where, params
+        )
+        return {
+            "customers": [
+                {"name": name, "region": region, "segment": segment, "total_spend": round(spend, 2),
+                 "deals": deals, "last_active": last_active or None, "status": account_status(spend)}
+                for name, region, segment, spend, deals, last_active in rows
+            ],
+            "next_cursor": next_cursor
+        }
+
+    def team(
+        self,
+        csv_path: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        sort: str = "total_revenue",
+        descending: bool = True
+    ) -> Dict[str, Any]:
+        """
+        One page of sales reps. avg_cycle_days is None when the file has no Cycle_Days column
+        (no win rate: the sales file only holds closed deals).
+        Returns {"team": [...], "next_cursor": str | None}.
+        """
+        rows, next_cursor = self._page(
+            "reps", "name, total_revenue, deals_closed, avg_deal_size, avg_cycle_days",
+            TEAM_SORTS[sort], descending, csv_path, limit, cursor, [], []
+        )
+        return {
+            "team": [
+                {"name": name, "total_revenue": round(total, 2), "deals_closed": deals,
+                 "avg_deal_size": round(avg_deal, 2),
+                 "avg_cycle_days": round(avg_cycle, 1) if avg_cycle is not None else None}
+                for name, total, deals, avg_deal, avg_cycle in rows
+            ],
+            "next_cursor": next_cursor
+        }
+
+
+_views: Dict[str, SalesViewStore] = {}
+
+
+def get_sales_views(workspace_id: str = None) -> SalesViewStore:
+    """Dashboard view store of a workspace (SALES_VIEWS_PATH)."""
+    workspace_id = workspace_id or DEFAULT_WORKSPACE
+    if workspace_id not in _views:
+        _views[workspace_id] = SalesViewStore(
+            workspace_cache_path(workspace_id, "sales_views.sqlite", "SALES_VIEWS_PATH")
+        )
+    return _views[workspace_id]
@@ -0,0 +1,328 @@
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+from telemetry import span
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: workers run without CPU/memory caps
+    resource = None
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_LIMIT = 20_000  # Captured stdout characters returned per execution
+# The only variables the workers inherit (plus LC_*): the interpreter's and the sales loader's settings.
+# API keys and every other server setting stay out of reach of the generated code.
+WORKER_ENV_VARS = ("PATH", "PYTHONPATH", "LANG", "LANGUAGE", "SYSTEMROOT", "SALES_COLUMNAR_DIR", "SALES_CHUNK_ROWS")
+
+
+def worker_env() -> Dict[str, str]:
+    return {k: v for k, v in os.environ.items() if k in WORKER_ENV_VARS or k.startswith("LC_")}
+
+
+class SandboxWorker:
+    """
+    One pre-warmed interpreter (pandas/numpy imported, current dataset kept in memory),
+    driven with JSON lines over its stdin/stdout.
+    """
+
+    def __init__(self, memory_mb: int):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(memory_mb)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=BACKEND_DIR,
+            env=worker_env(),
+            text=True,
+            bufsize=1
+        )
+        self._replies: "queue.Queue[Optional[str]]" = queue.Queue()
+        threading.Thread(target=self._read_replies, daemon=True).start()
+
+    def _read_replies(self):
+        for line in self.process.stdout:
+            self._replies.put(line)
+        self._replies.put(None)  # Worker exited
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, message: Dict[str, Any]) -> bool:
+        try:
+            self.process.stdin.write(json.dumps(message) + "\n")
+            self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            return False
+
+    def receive(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Next reply; None if the worker died. Raises queue.Empty on timeout."""
+        line = self._replies.get(timeout=timeout)
+        return json.loads(line) if line is not None else None
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+
+
+class SandboxPool:
+    """
+    Fixed pool of sandboxed worker processes for LLM-generated analysis code.
+    - Workers start with pandas/numpy imported; load() preloads a sales dataset in each idle
+      worker (from its columnar cache when present), so retries skip start-up and CSV parsing.
+    - Per execution: wall-clock timeout (the worker is killed and replaced), CPU-seconds limit
+      and address-space cap (a runaway script can't take the API server down with it).
+    - run() returns a structured result: the script's `result` variable, not scraped stdout.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        timeout: float = None,
+        cpu_seconds: int = None,
+        memory_mb: int = None
+    ):
+        self.worker_count = workers or int(os.getenv("SANDBOX_WORKERS", "2"))
+        self.timeout = timeout or float(os.getenv("SANDBOX_TIMEOUT_SECONDS", "120"))
+        self.cpu_seconds = cpu_seconds or int(os.getenv("SANDBOX_CPU_SECONDS", "60"))
+        self.memory_mb = memory_mb or int(os.getenv("SANDBOX_MEMORY_MB", "4096"))
+        self._idle: "queue.Queue[SandboxWorker]" = queue.Queue()
+        self._dataset: Optional[str] = None
+        for _ in range(self.worker_count):
+            self._idle.put(SandboxWorker(self.memory_mb))
+
+    def _spawn(self) -> SandboxWorker:
+        worker = SandboxWorker(self.memory_mb)
+        if self._dataset:
+            worker.send({"op": "load", "path": self._dataset})
+        return worker
+
+    def load(self, csv_path: str):
+        """Preload a dataset in the idle workers (non-blocking; overlaps with code generation)."""
+        self._dataset = os.path.abspath(csv_path)
+        workers: List[SandboxWorker] = []
+        while True:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in workers:
+            worker.send({"op": "load", "path": self._dataset})
+            self._idle.put(worker)
+
+    def run(self, code: str, csv_path: str = None) -> Dict[str, Any]:
+        """
+        Executes code in a worker. The dataset is available as `df` (and its path as CSV_PATH);
+        the script reports by assigning `result`.
+        Returns {"ok", "result", "stdout", "error", "duration_s", "peak_rss_mb", "timed_out"}.
+        """
+        with span("repl", "sandbox") as current:
+            execution = self._run(code, csv_path)
+            current.set("ok", execution.get("ok"))
+            current.set("timed_out", execution.get("timed_out", False))
+            current.set("peak_rss_mb", execution.get("peak_rss_mb"))
+            current.add("errors", 0 if execution.get("ok") else 1)
+        return execution
+
+    def _run(self, code: str, csv_path: str = None) -> Dict[str, Any]:
+        path = os.path.abspath(csv_path) if csv_path else None
+        worker = self._idle.get()
+        try:
+            if not worker.alive:
+                worker = self._spawn()
+            message = {"op": "exec", "code": code, "path": path, "cpu_seconds": self.cpu_seconds}
+            if not worker.send(message):
+                worker.kill()
+                worker = self._spawn()
+                worker.send(message)
+            try:
+                reply = worker.receive(self.timeout)
+            except queue.Empty:
+                worker.kill()
+                worker = self._spawn()
+                return self._failure(f"Execution timed out after {self.timeout:.0f}s (worker killed)", timed_out=True)
+            if reply is None:
+                worker.kill()
+                exit_code = worker.process.returncode
+                worker = self._spawn()
+                return self._failure(f"Worker exited with code {exit_code} (CPU or memory limit exceeded?)")
+            return reply
+        finally:
+            self._idle.put(worker)
+
+    @staticmethod
+    def _failure(error: str, timed_out: bool = False) -> Dict[str, Any]:
+        return {"ok": False, "result": None, "stdout": "", "error": error, "timed_out": timed_out}
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+
+_pool: Optional[SandboxPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """Process-wide sandbox pool (SANDBOX_WORKERS pre-warmed workers, started on first use)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import atexit
+            _pool = SandboxPool()
+            atexit.register(_pool.close)
+    return _pool
+
+
+# --- Worker process -------------------------------------------------------------------------
+
+
+class CpuLimitExceeded(Exception):
+    pass
+
+
+def _virtual_memory_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _limit_memory(memory_mb: int):
+    """Caps the address space at the warm interpreter's size plus memory_mb (Linux)."""
+    current = _virtual_memory_mb()
+    if resource is None or current is None:
+        return
+    limit = int((current + memory_mb) * 1024 * 1024)
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _limit_cpu(seconds: Optional[int]):
+    """Soft CPU limit `seconds` from now (SIGXCPU -> CpuLimitExceeded); None lifts it."""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime) + seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _worker_main(memory_mb: int):
+    import contextlib
+    import io
+    import signal
+    import time
+    import traceback
+    import numpy as np
+    import pandas as pd
+    sys.path.insert(0, BACKEND_DIR)
+    from sales_data import iter_sales_chunks
+
+    # Replies go over a private copy of stdout; stray writes to fd 1 land on stderr instead
+    channel = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    def on_cpu_limit(signum, frame):
+        raise CpuLimitExceeded("CPU time limit exceeded")
+
+    if hasattr(signal, "SIGXCPU"):
+        signal.signal(signal.SIGXCPU, on_cpu_limit)
+    _limit_memory(memory_mb)
+
+    datasets: Dict[str, pd.DataFrame] = {}
+
+    def dataset(path: str) -> pd.DataFrame:
+        if path not in datasets:
+            datasets.clear()
+            df = pd.concat(list(iter_sales_chunks(path, float_dtype='float64')))
+            # Plain strings so generated code can concatenate/compare text columns freely
+            for column in df.select_dtypes("category").columns:
+                df[column] = df[column].astype(df[column].cat.categories.dtype)
+            datasets[path] = df
+        return datasets[path]
+
+    def to_native(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, (pd.Timestamp, np.datetime64)):
+            return str(pd.Timestamp(value).date()) if pd.notna(value) else None
+        if isinstance(value, pd.DataFrame):
+            return value.to_dict("records")
+        if isinstance(value, (pd.Series, np.ndarray)):
+            return value.tolist()
+        return str(value)
+
+    for line in sys.stdin:
+        message = json.loads(line)
+        path = message.get("path")
+        if message["op"] == "load":
+            try:
+                dataset(path)
+            except Exception as e:
+                print(f"⚠️ Sandbox worker could not preload {os.path.basename(path)}: {e}", file=sys.stderr, flush=True)
+            continue
+
+        started = time.perf_counter()
+        stdout = io.StringIO()
+        reply: Dict[str, Any] = {"ok": False, "result": None, "error": None, "timed_out": False}
+        try:
+            scope = {"__name__": "__main__", "pd": pd, "np": np, "json": json, "CSV_PATH": path}
+            if path:
+                scope["df"] = dataset(path).copy()
+            _limit_cpu(message.get("cpu_seconds"))
+            try:
+                with contextlib.redirect_stdout(stdout):
+                    exec(compile(message["code"], "<analyst>", "exec"), scope)
+            finally:
+                _limit_cpu(None)
+            result = scope.get("result")
+            if result is None:
+                # Scripts that still print their JSON instead of assigning `result`
+                try:
+                    result = json.loads(stdout.getvalue().strip())
+                except ValueError:
+                    result = None
+            reply.update(ok=True, result=result)
+        except BaseException as e:
+            tail = traceback.format_exc(limit=-3)
+            reply["error"] = f"{type(e).__name__}: {e}\n{tail}"
+        reply["stdout"] = stdout.getvalue()[-OUTPUT_LIMIT:]
+        reply["duration_s"] = round(time.perf_counter() - started, 3)
+        reply["peak_rss_mb"] = _peak_rss_mb()
+        try:
+            payload = json.dumps(reply, default=to_native)
+        except (TypeError, ValueError) as e:
+            payload = json.dumps({**reply, "ok": False, "result": None, "error": f"Result is not JSON serializable: {e}"})
+        channel.write(payload + "\n")
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["--worker"]:
+    _worker_main(int(sys.argv[2]))
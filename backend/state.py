@@ -1,4 +1,16 @@
-from typing import List, Dict, Any, Optional, TypedDict
+import operator
+from typing import List, Dict, Any, Optional
+from typing_extensions import Annotated, NotRequired, TypedDict  # NotRequired on Python 3.10
+
+
+def merge_by_signal(left: List[Dict[str, Any]], right: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Reducer for lists written by the parallel per-signal branches (see graph.py):
+    entries replace earlier ones with the same signal_id, new ones are appended.
+    """
+    replaced = {item.get("signal_id") for item in right or []}
+    return [item for item in left or [] if item.get("signal_id") not in replaced] + list(right or [])
+
 
 class WarningSignal(TypedDict):
     id: str
@@ -8,15 +20,25 @@ class WarningSignal(TypedDict):
     segment: str
     description: str
     severity: str # "CRITICAL", "HIGH", "MEDIUM" (Mapped to Red/Green/Yellow)
+    impact_usd: NotRequired[float]
+    evidence_csv: NotRequired[Dict[str, Any]] # {"rows": [...], "summary": str, "extraction_method": str}
 
 class ContextInsight(TypedDict):
     signal_id: str # Links back to the anomalies
     source: str # "Slack", "Email", etc.
     content: str
-    date: str
+    date: NotRequired[str] # "YYYY-MM-DD" when the logs mention one
     relevance_score: float
+    evidence_txt: NotRequired[Optional[Dict[str, Any]]] # {"file", "excerpt", "context"}
+    employee_attribution: NotRequired[Optional[Dict[str, Any]]]
+
+class BacklogMatch(TypedDict):
+    # Strategist LLM reply: the backlog item selected for a signal
+    project_id: str
+    complexity_points: NotRequired[int] # Strategist defaults to 5
 
 class Recommendation(TypedDict):
+    signal_id: str # Links back to the anomalies
     project_title: str
     impact_usd: float
     feasibility_score: int # 1-10
@@ -24,17 +46,32 @@ class Recommendation(TypedDict):
     technical_spec: str
     roi_metric: str # Kept for backward compatibility if needed, or derived
     net_strategic_value: float # Sorting metric
+    in_portfolio: NotRequired[bool] # Project is in the budget-constrained portfolio (see portfolio.py)
 
 class AgentState(TypedDict):
     # Input
     sales_data_path: str
     context_data_path: str
     backlog_data_path: str
+    cache_bypass: bool # Skip LLM cache lookups for this run (responses are still refreshed)
+    run_id: str # Checkpoint thread ID; pass it back as resume_run_id to resume a failed run
+    input_digests: Dict[str, str] # Content digests of the input files (node cache keys)
+    incremental: bool # Analyst only re-analyses sales rows appended since the last audit
+    regions: List[str] # Sales regions across the whole audit (shared with every per-signal branch)
+    workspace_id: str # Dataset workspace the run belongs to (its data, caches and signal history)
     
     # Internal State
     anomalies: List[WarningSignal]
-    context_insights: List[ContextInsight]
-    recommendations: List[Recommendation]
+    context_insights: Annotated[List[ContextInsight], merge_by_signal]
+    recommendations: Annotated[List[Recommendation], merge_by_signal]
+    portfolio: Dict[str, Any] # Budget-constrained project selection over the whole backlog
+    degraded: Annotated[List[str], operator.add] # Fallbacks taken by the nodes (their outputs aren't node-cached)
     
     # Output
     final_report: List[Dict[str, Any]] # Structure for the UI
+
+class BranchOutput(TypedDict):
+    # What a per-signal branch hands back to the main graph (merged by signal_id)
+    context_insights: Annotated[List[ContextInsight], merge_by_signal]
+    recommendations: Annotated[List[Recommendation], merge_by_signal]
+    degraded: Annotated[List[str], operator.add] # Concatenated across branches
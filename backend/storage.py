@@ -1,97 +1,288 @@
+import base64
 import json
 import os
+import re
+import sqlite3
+import threading
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from telemetry import traced
+
+SIGNAL_REGION = re.compile(r'^SIG-([A-Za-z]+)-')
+# Legacy IDs minted per product tier or for the whole dataset carry no region part
+NON_REGION_ID_PARTS = {'OVERALL', 'ENTERPRISE', 'PROFESSIONAL', 'STARTER'}
+
+# Large evidence payloads left out by the "summary" sparse-fields view
+EVIDENCE_PATHS = ('$.evidence_csv', '$.evidence_txt', '$.evidence_json', '$.recommendation.evidence_json')
+MAX_PAGE_SIZE = 500
+
 
 class SignalStorage:
     """
-    Manages persistent storage of signals in a JSON file.
-    Handles deduplication based on signal_id.
+    Manages persistent storage of signals in a SQLite database (WAL mode).
+    - signal_id is the primary key, so upserts deduplicate and lookups are O(log n).
+    - Indexed on last_updated, severity and region for listing/filtering.
+    - Upserts keep the original first_detected timestamp.
+    - A legacy signals_history.json is migrated once on first start.
+    - One store (database file) per dataset workspace; workspace_id tags its revisions.
     """
-    
-    def __init__(self, storage_path: str):
-        self.storage_path = storage_path
+
+    def __init__(self, storage_path: str, workspace_id: str = "default"):
+        self.workspace_id = workspace_id
+        # Accept the legacy JSON path and keep the database next to it
+        root, ext = os.path.splitext(storage_path)
+        self.legacy_json_path = storage_path if ext == '.json' else None
+        self.storage_path = f"{root}.db" if ext == '.json' else storage_path
+        self._lock = threading.Lock()
         self._ensure_storage_exists()
-    
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.storage_path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
     def _ensure_storage_exists(self):
-        """Create storage file if it doesn't exist"""
-        if not os.path.exists(self.storage_path):
-            os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
-            self._write_signals([])
-    
-    def _read_signals(self) -> List[Dict[str, Any]]:
-        """Read all signals from storage"""
-        try:
-            with open(self.storage_path, 'r') as f:
-                data = json.load(f)
-                return data.get('signals', [])
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-    
-    def _write_signals(self, signals: List[Dict[str, Any]]):
-        """Write signals to storage with metadata"""
-        data = {
-            'last_updated': datetime.now().isoformat(),
-            'total_signals': len(signals),
-            'signals': signals
-        }
-        with open(self.storage_path, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        """Create database, tables and indexes if they don't exist"""
+        os.makedirs(os.path.dirname(self.storage_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS signals ("
+                " signal_id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " severity TEXT,"
+                " status TEXT,"
+                " region TEXT,"
+                " date TEXT,"
+                " first_detected TEXT NOT NULL,"
+                " last_updated TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_last_updated ON signals(last_updated, signal_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_severity ON signals(severity)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_region ON signals(region)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_date ON signals(date)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Rows migrated before tier/overall IDs were told apart from regions
+            parts = sorted(NON_REGION_ID_PARTS)
+            conn.execute(
+                f"UPDATE signals SET region = NULL WHERE region IN ({','.join('?' * len(parts))})"
+                " AND json_extract(payload, '$.region') IS NULL",
+                parts
+            )
+        self._migrate_legacy_json()
+
+    def _migrate_legacy_json(self):
+        """One-shot import of the old signals_history.json (keeps its timestamps)"""
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        with self._lock, self._connect() as conn:
+            if conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+                return
+            try:
+                with open(self.legacy_json_path, 'r') as f:
+                    signals = json.load(f).get('signals', [])
+            except (FileNotFoundError, json.JSONDecodeError):
+                signals = []
+            now = datetime.now().isoformat()
+            rows = [
+                self._row(s, s.get('first_detected', now), s.get('last_updated', now))
+                for s in signals if s.get('signal_id')
+            ]
+            conn.executemany(
+                "INSERT OR IGNORE INTO signals "
+                "(signal_id, payload, severity, status, region, date, first_detected, last_updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (self.legacy_json_path,)
+            )
+            self._bump_revision(conn)
+        print(f"[Storage] Migrated {len(rows)} signals from {os.path.basename(self.legacy_json_path)}", flush=True)
+
+    @staticmethod
+    def _region(signal: Dict[str, Any]) -> str | None:
+        region = signal.get('region')
+        if not region:
+            match = SIGNAL_REGION.match(signal.get('signal_id', ''))
+            region = match.group(1) if match and match.group(1).upper() not in NON_REGION_ID_PARTS else None
+        return region.upper() if region else None
+
+    def _row(self, signal: Dict[str, Any], first_detected: str, last_updated: str) -> tuple:
+        payload = {k: v for k, v in signal.items() if k not in ('first_detected', 'last_updated')}
+        return (
+            signal['signal_id'],
+            json.dumps(payload),
+            (signal.get('severity') or '').lower() or None,
+            (signal.get('status') or '').lower() or None,
+            self._region(signal),
+            signal.get('date'),
+            first_detected,
+            last_updated
+        )
+
+    @staticmethod
+    def _to_signal(payload: str, first_detected: str, last_updated: str) -> Dict[str, Any]:
+        signal = json.loads(payload)
+        signal['first_detected'] = first_detected
+        signal['last_updated'] = last_updated
+        return signal
+
+    @traced("storage")
     def get_all_signals(self) -> List[Dict[str, Any]]:
-        """Retrieve all stored signals"""
-        return self._read_signals()
-    
+        """Retrieve all stored signals (newest first)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT payload, first_detected, last_updated FROM signals "
+                "ORDER BY last_updated DESC, signal_id DESC"
+            ).fetchall()
+        return [self._to_signal(*row) for row in rows]
+
+    @traced("storage")
     def add_signals(self, new_signals: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
-        Add new signals to storage, deduplicating by signal_id.
+        Upsert signals by signal_id (O(changed signals)).
         Returns statistics about the operation.
         """
-        existing_signals = self._read_signals()
-        existing_ids = {s['signal_id']: i for i, s in enumerate(existing_signals)}
-        
-        added_count = 0
-        updated_count = 0
-        
-        for signal in new_signals:
-            signal_id = signal.get('signal_id')
-            if not signal_id:
-                continue
-            
-            # Add timestamp metadata
-            if signal_id in existing_ids:
-                # Update existing signal
-                idx = existing_ids[signal_id]
-                signal['last_updated'] = datetime.now().isoformat()
-                signal['first_detected'] = existing_signals[idx].get('first_detected', datetime.now().isoformat())
-                existing_signals[idx] = signal
-                updated_count += 1
-            else:
-                # Add new signal
-                signal['first_detected'] = datetime.now().isoformat()
-                signal['last_updated'] = datetime.now().isoformat()
-                existing_signals.append(signal)
-                added_count += 1
-        
-        # Sort by last_updated (newest first)
-        existing_signals.sort(key=lambda x: x.get('last_updated', ''), reverse=True)
-        
-        self._write_signals(existing_signals)
-        
+        signals = [s for s in new_signals if s.get('signal_id')]
+        now = datetime.now().isoformat()
+
+        with self._lock, self._connect() as conn:
+            existing = {}
+            ids = [s['signal_id'] for s in signals]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                existing.update(conn.execute(
+                    f"SELECT signal_id, first_detected FROM signals WHERE signal_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+
+            rows = []
+            for signal in signals:
+                # Add timestamp metadata (first_detected survives updates)
+                signal['first_detected'] = existing.get(signal['signal_id'], now)
+                signal['last_updated'] = now
+                rows.append(self._row(signal, signal['first_detected'], now))
+
+            conn.executemany(
+                "INSERT INTO signals "
+                "(signal_id, payload, severity, status, region, date, first_detected, last_updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(signal_id) DO UPDATE SET "
+                " payload = excluded.payload, severity = excluded.severity, status = excluded.status,"
+                " region = excluded.region, date = excluded.date, last_updated = excluded.last_updated",
+                rows
+            )
+            if rows:
+                self._bump_revision(conn)
+            total = conn.execute("SELECT COUNT(*) FROM signals").fetchone()[0]
+
+        updated_count = sum(1 for s in signals if s['signal_id'] in existing)
         return {
-            'total': len(existing_signals),
-            'added': added_count,
+            'total': total,
+            'added': len(signals) - updated_count,
             'updated': updated_count
         }
-    
+
+    @traced("storage")
     def get_signal_by_id(self, signal_id: str) -> Dict[str, Any] | None:
-        """Retrieve a specific signal by ID"""
-        signals = self._read_signals()
-        for signal in signals:
-            if signal.get('signal_id') == signal_id:
-                return signal
-        return None
-    
+        """Retrieve a specific signal by ID (primary key lookup)"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, first_detected, last_updated FROM signals WHERE signal_id = ?", (signal_id,)
+            ).fetchone()
+        return self._to_signal(*row) if row else None
+
+    @traced("storage")
     def clear_all(self):
         """Clear all signals (use with caution)"""
-        self._write_signals([])
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM signals")
+            self._bump_revision(conn)
+
+    @staticmethod
+    def _bump_revision(conn: sqlite3.Connection):
+        """Every write bumps a revision counter used for ETag / Last-Modified"""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('revision', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('modified_at', ?)",
+            (datetime.now().astimezone().isoformat(),)
+        )
+
+    @traced("storage")
+    def get_revision(self) -> Dict[str, Any]:
+        """Current write revision and modification time of the store (cheap, no table scan)"""
+        with self._connect() as conn:
+            meta = dict(conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('revision', 'modified_at')"
+            ).fetchall())
+        return {
+            'workspace_id': self.workspace_id,
+            'revision': int(meta.get('revision', 0)),
+            'modified_at': meta.get('modified_at')
+        }
+
+    @staticmethod
+    def encode_cursor(last_updated: str, signal_id: str) -> str:
+        return base64.urlsafe_b64encode(f"{last_updated}|{signal_id}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        last_updated, signal_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return last_updated, signal_id
+
+    @traced("storage")
+    def query_signals(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        severity: Optional[List[str]] = None,
+        status: Optional[List[str]] = None,
+        region: Optional[List[str]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        include_evidence: bool = True
+    ) -> Dict[str, Any]:
+        """
+        One page of signals (newest first) using keyset pagination on (last_updated, signal_id),
+        so page cost is independent of how much history is stored.
+        Returns {"signals": [...], "next_cursor": str | None}.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where, params = [], []
+        for column, values in (('severity', severity), ('status', status), ('region', region)):
+            if values:
+                where.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(v.upper() if column == 'region' else v.lower() for v in values)
+        if date_from:
+            where.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("date <= ?")
+            params.append(date_to)
+        if cursor:
+            last_updated, signal_id = self.decode_cursor(cursor)
+            where.append("(last_updated < ? OR (last_updated = ? AND signal_id < ?))")
+            params.extend([last_updated, last_updated, signal_id])
+
+        payload_sql = "payload" if include_evidence else f"json_remove(payload, {', '.join('?' * len(EVIDENCE_PATHS))})"
+        sql = f"SELECT {payload_sql}, first_detected, last_updated, signal_id FROM signals"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY last_updated DESC, signal_id DESC LIMIT ?"
+        params = ([] if include_evidence else list(EVIDENCE_PATHS)) + params + [limit + 1]
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1][2], rows[-1][3])
+        return {
+            'signals': [self._to_signal(payload, first, last) for payload, first, last, _ in rows],
+            'next_cursor': next_cursor
+        }
@@ -0,0 +1,179 @@
+import json
+from typing import Any, Dict, List, Tuple, Union, get_args, get_origin, get_type_hints
+from typing_extensions import is_typeddict
+
+
+class SchemaError(ValueError):
+    """A parsed LLM reply does not match the expected TypedDict."""
+
+
+def parse_json(content: str) -> Any:
+    """
+    Parses an LLM reply as JSON: the whole reply, or else the first complete JSON
+    object/array in it (markdown fences or surrounding prose are skipped).
+    """
+    content = content.strip()
+    try:
+        return json.loads(content)
+    except ValueError:
+        pass
+    decoder = json.JSONDecoder()
+    for start, char in enumerate(content):
+        if char in "{[":
+            try:
+                return decoder.raw_decode(content, start)[0]
+            except ValueError:
+                continue
+    raise ValueError(f"No JSON found in LLM response: {content[:200]}")
+
+
+def _coerce(value: Any, hint: Any, path: str) -> Any:
+    if hint is Any:
+        return value
+    origin = get_origin(hint)
+    if origin is Union:
+        options = [a for a in get_args(hint) if a is not type(None)]
+        if value is None:
+            if len(options) < len(get_args(hint)):
+                return None
+            raise SchemaError(f"'{path}' is null")
+        return _coerce(value, options[0], path) if len(options) == 1 else value
+    if value is None:
+        raise SchemaError(f"'{path}' is null")
+    if is_typeddict(hint):
+        return validate_typed(value, hint, path=path)
+    if origin in (list, List):
+        if not isinstance(value, list):
+            raise SchemaError(f"'{path}' should be a list")
+        (item,) = get_args(hint) or (Any,)
+        return [_coerce(v, item, f"{path}[{i}]") for i, v in enumerate(value)]
+    if origin in (dict, Dict):
+        if not isinstance(value, dict):
+            raise SchemaError(f"'{path}' should be an object")
+        return value
+    if hint is str:
+        if isinstance(value, (dict, list)):
+            raise SchemaError(f"'{path}' should be a string")
+        return value if isinstance(value, str) else str(value)
+    if hint in (float, int):
+        if isinstance(value, bool):
+            raise SchemaError(f"'{path}' should be a number")
+        if isinstance(value, str):
+            # "$250,000" / "25%" -> 250000.0 / 25.0
+            try:
+                value = float(value.replace(",", "").replace("$", "").rstrip("%").strip())
+            except ValueError:
+                raise SchemaError(f"'{path}' should be a number, got {value!r}")
+        if not isinstance(value, (int, float)):
+            raise SchemaError(f"'{path}' should be a number")
+        return int(round(value)) if hint is int else float(value)
+    if hint is bool:
+        if not isinstance(value, bool):
+            raise SchemaError(f"'{path}' should be true/false")
+        return value
+    return value
+
+
+def validate_typed(data: Any, schema: type, exclude: Tuple[str, ...] = (), path: str = None) -> Dict[str, Any]:
+    """
+    Checks a parsed JSON object against a TypedDict (state.py): required keys present,
+    values coerced to the declared types ("12" -> 12, 250000 -> "250000" for str fields).
+    Keys the schema doesn't declare are kept as-is. Raises SchemaError listing every problem.
+    """
+    path = path or schema.__name__
+    if not isinstance(data, dict):
+        raise SchemaError(f"{path}: expected an object, got {type(data).__name__}")
+    hints = get_type_hints(schema)
+    required = getattr(schema, "__required_keys__", set(hints))
+    result = dict(data)
+    errors = []
+    for field, hint in hints.items():
+        if field in exclude:
+            continue
+        if field not in data:
+            if field in required:
+                errors.append(f"missing '{field}'")
+            continue
+        try:
+            result[field] = _coerce(data[field], hint, field)
+        except SchemaError as e:
+            errors.append(str(e))
+    if errors:
+        raise SchemaError(f"{path}: " + "; ".join(errors))
+    return result
+
+
+class IncrementalJSONParser:
+    """
+    Parses a JSON object/array while its text is still streaming in.
+    feed() returns the top-level members completed by the new text, as (key, value) pairs
+    (object) or (index, value) pairs (array), so packed replies keyed by signal id can be
+    used one signal at a time. Text before the first '{' / '[' (fences, preamble) is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.container = None  # "{" or "[" once the top-level value has started
+        self.members: List[Tuple[Union[str, int], Any]] = []
+        self.done = False
+        self._scan = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, text: str) -> List[Tuple[Union[str, int], Any]]:
+        self.buffer += text
+        completed = []
+        while self._scan < len(self.buffer) and not self.done:
+            char = self.buffer[self._scan]
+            if self.container is None:
+                if char in "{[":
+                    self.container = char
+                    self._depth = 1
+                    self._member_start = self._scan + 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._close_member(self._scan))
+                    self.done = True
+            elif char == "," and self._depth == 1:
+                completed.extend(self._close_member(self._scan))
+                self._member_start = self._scan + 1
+            self._scan += 1
+        return completed
+
+    def _close_member(self, end: int) -> List[Tuple[Union[str, int], Any]]:
+        text = self.buffer[self._member_start:end].strip()
+        if not text:
+            return []
+        try:
+            if self.container == "{":
+                (member,) = json.loads("{" + text + "}").items()
+            else:
+                member = (len(self.members), json.loads(text))
+        except ValueError:
+            return []
+        self.members.append(member)
+        return [member]
+
+    def partial(self) -> Any:
+        """The members completed so far, as a dict (object) or list (array)."""
+        if self.container == "[":
+            return [value for _, value in self.members]
+        return dict(self.members)
+
+    def result(self) -> Any:
+        """The complete value (raises ValueError if the text is not valid JSON)."""
+        return parse_json(self.buffer)
@@ -0,0 +1,216 @@
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# Span duration histogram buckets (seconds): sub-ms storage reads up to multi-minute LLM nodes
+DURATION_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PREFIX = "signal"
+
+
+def _enabled_from_env() -> bool:
+    return os.getenv("METRICS_ENABLED", "true").strip().lower() not in ("0", "false", "no", "off")
+
+
+# Read once: when disabled, a span costs one flag check
+ENABLED = _enabled_from_env()
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in the Prometheus text exposition format."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, list]] = {}  # labels -> [bucket counts..., sum, count]
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: Labels, value: float = 1, help_text: str = None):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def observe(self, name: str, labels: Labels, value: float, help_text: str = None):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    @staticmethod
+    def _labels(labels: Labels, extra: Labels = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        escaped = (
+            (k, str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for k, v in pairs
+        )
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{self._labels(labels)} {value:g}")
+            for name in sorted(self._histograms):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, state in sorted(self._histograms[name].items()):
+                    for bound, count in zip(self.buckets, state):
+                        lines.append(f"{name}_bucket{self._labels(labels, (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {state[-1]}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {state[-2]:.6f}")
+                    lines.append(f"{name}_count{self._labels(labels)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Receives the "metric" events of the spans finished in this context (see listen)
+_listener: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("metric_listener", default=None)
+
+
+class Span:
+    """
+    One timed operation. add() accumulates counts (tokens, cache hits, retries...), which also
+    feed the <kind>_<key>_total counters; set() attaches a descriptive attribute to its event.
+    """
+
+    __slots__ = ("kind", "name", "attributes", "counts", "status")
+
+    def __init__(self, kind: str, name: str, attributes: Dict[str, Any]):
+        self.kind = kind
+        self.name = name
+        self.attributes = attributes
+        self.counts: Dict[str, float] = {}
+        self.status = "ok"
+
+    def add(self, key: str, value: float = 1):
+        if value:
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+
+class _NoopSpan:
+    """Span (and its own context manager) used when metrics are disabled: records nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+    def add(self, key: str, value: float = 1):
+        pass
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(kind: str, name: str, **attributes):
+    """
+    Times a block as a span of `kind` ("node", "llm", "repl", "search", "storage", "load").
+    Records signal_span_duration_seconds{kind, name} (and signal_span_errors_total when it raises),
+    then hands a "metric" event to the context's listener.
+    """
+    if not ENABLED:
+        return NOOP_SPAN
+    return _timed(kind, name, attributes)
+
+
+@contextmanager
+def _timed(kind: str, name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+    current = Span(kind, name, attributes)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        _finish(current, time.perf_counter() - start)
+
+
+def _finish(current: Span, seconds: float):
+    labels = (("kind", current.kind), ("name", current.name))
+    registry.observe(f"{PREFIX}_span_duration_seconds", labels, seconds, "Duration of instrumented operations")
+    if current.status == "error":
+        registry.inc(f"{PREFIX}_span_errors_total", labels, help_text="Instrumented operations that raised")
+    for key, value in current.counts.items():
+        record(current.kind, current.name, key, value)
+    listener = _listener.get()
+    if listener is not None:
+        listener({
+            "type": "metric",
+            "kind": current.kind,
+            "name": current.name,
+            "duration_ms": round(seconds * 1000, 2),
+            "status": current.status,
+            **current.attributes,
+            **current.counts
+        })
+
+
+def record(kind: str, name: str, key: str, value: float = 1):
+    """Counts an occurrence outside any span (e.g. a retry): signal_<kind>_<key>_total{name}."""
+    if ENABLED and value:
+        registry.inc(f"{PREFIX}_{kind}_{key}_total", (("name", name),), value, f"{key} of {kind} operations")
+
+
+def traced(kind: str, name: str = None):
+    """Decorator running each call of a function in a span (named after the function by default)."""
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with span(kind, label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def listen(callback: Callable[[Dict[str, Any]], None]):
+    """
+    Sends the metric events of this context (and of the threads / tasks started from it) to callback.
+    Returns a token for unlisten(). The callback may be called from worker threads.
+    """
+    return _listener.set(callback if ENABLED else None)
+
+
+def unlisten(token):
+    try:
+        _listener.reset(token)
+    except ValueError:
+        pass  # Finalized from another context (e.g. an abandoned stream): nothing to restore there
+
+
+def render_metrics() -> str:
+    return registry.render()
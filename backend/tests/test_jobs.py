@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from jobs import AuditJobManager, QueueFullError
+
+
+def fake_audit(release: asyncio.Event):
+    """run_audit stand-in: a progress event, then (once `release` is set) a few tokens and the result."""
+    async def run_audit(request):
+        yield {"type": "progress", "node": "analyst", "status": "completed"}
+        await release.wait()
+        for word in ("Revenue ", "dropped"):
+            yield {"type": "token", "node": "ghostwriter", "content": word}
+        yield {"type": "result", "data": [request["name"]]}
+    return run_audit
+
+
+async def collect(job, offset=0):
+    return [(position, event["type"]) async for position, event in job.stream(offset)]
+
+
+def test_submit_runs_the_job_and_streams_its_events():
+    async def scenario():
+        release = asyncio.Event()
+        manager = AuditJobManager(fake_audit(release), workers=1)
+        job, coalesced = manager.submit({"name": "a"}, key="a")
+        stream = asyncio.create_task(collect(job))
+        await asyncio.sleep(0.05)
+        assert job.status == "running" and job.subscribers == 1
+        release.set()
+        events = await stream
+        return job, coalesced, events
+
+    job, coalesced, events = asyncio.run(scenario())
+    assert not coalesced
+    assert job.status == "completed"
+    assert events == [(0, "progress"), (None, "token"), (None, "token"), (1, "result")]
+    assert job.subscribers == 0
+
+
+def test_identical_submissions_coalesce_into_one_job():
+    async def scenario():
+        release = asyncio.Event()
+        manager = AuditJobManager(fake_audit(release), workers=1)
+        first, _ = manager.submit({"name": "a"}, key="same")
+        second, coalesced = manager.submit({"name": "a"}, key="same")
+        other, _ = manager.submit({"name": "b"}, key="other")
+        release.set()
+        await collect(other)
+        return first, second, coalesced, other, manager
+
+    first, second, coalesced, other, manager = asyncio.run(scenario())
+    assert coalesced and second is first
+    assert other is not first
+    assert len(manager.jobs) == 2
+
+
+def test_queue_limits_raise_queue_full():
+    async def scenario():
+        release = asyncio.Event()
+        manager = AuditJobManager(
+            fake_audit(release), workers=1, max_queue=2, max_per_workspace=1, max_queue_per_workspace=1
+        )
+        manager.submit({"name": "a", "workspace_id": "north"}, key="a")
+        await asyncio.sleep(0.05)  # "a" is running, the queue is empty again
+        manager.submit({"name": "b", "workspace_id": "north"}, key="b")
+        with pytest.raises(QueueFullError, match="north"):
+            manager.submit({"name": "c", "workspace_id": "north"}, key="c")
+        manager.submit({"name": "d", "workspace_id": "south"}, key="d")
+        with pytest.raises(QueueFullError, match="queue is full"):
+            manager.submit({"name": "e", "workspace_id": "east"}, key="e")
+        stats = manager.stats("north")
+        release.set()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats == {"workspace_id": "north", "queued": 1, "max_queue": 1, "running": 1, "max_running": 1}
+
+
+def test_stream_resumes_from_an_offset_without_replaying_tokens():
+    async def scenario():
+        release = asyncio.Event()
+        release.set()
+        manager = AuditJobManager(fake_audit(release), workers=1)
+        job, _ = manager.submit({"name": "a"}, key="a")
+        await collect(job)
+        return job, await collect(job, offset=0), await collect(job, offset=1)
+
+    job, replay, resumed = asyncio.run(scenario())
+    assert job.snapshot()["event_count"] == 2
+    assert replay == [(0, "progress"), (1, "result")]
+    assert resumed == [(1, "result")]
@@ -0,0 +1,41 @@
+import json
+import re
+import time
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from llm import fan_out
+
+
+class SleepyChat(BaseChatModel):
+    """Chat model that sleeps the delay named in the prompt ("delay=0.3"), then echoes the signal ID."""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = messages[-1].content
+        time.sleep(float(re.search(r"delay=([\d.]+)", text).group(1)))
+        signal_id = re.search(r"\[(SIG-\d+)\]", text).group(1)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=json.dumps({"id": signal_id})))])
+
+    @property
+    def _llm_type(self) -> str:
+        return "sleepy"
+
+
+def test_fan_out_waits_for_the_slowest_call_and_keeps_signal_order(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "8")
+    monkeypatch.setenv("LLM_PACK_SIZE", "1")
+    delays = [0.6, 0.1, 0.4, 0.2, 0.5, 0.3]
+    signals = [{"id": f"SIG-{i}", "delay": delay} for i, delay in enumerate(delays)]
+
+    start = time.perf_counter()
+    results = fan_out(
+        SleepyChat(),
+        signals,
+        build_prompt=lambda s: [HumanMessage(content=f"[{s['id']}] delay={s['delay']}")],
+        build_packed_prompt=lambda pack: [],
+        parse_reply=json.loads,
+    )
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < max(delays) + 0.5 < sum(delays)
+    assert [r["id"] for r in results] == [s["id"] for s in signals]
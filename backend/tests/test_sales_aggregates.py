@@ -0,0 +1,105 @@
+import os
+import pytest
+from sales_aggregates import SalesAggregateStore
+
+HEADER = "Date,Region,Account_Name,Deal_Size_USD,Product_Tier,Sales_Rep\n"
+
+
+def rows(count, start=0, amount=100.0):
+    return "".join(
+        f"{1 + (i % 12)}/1/25,EMEA,Client_{i},{amount},Enterprise,Sarah Chen\n" for i in range(start, start + count)
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SalesAggregateStore(str(tmp_path / "aggregates.sqlite"))
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    return str(tmp_path / "sales.csv")
+
+
+def ingest(store, csv_path, immutable=False):
+    """Folds the pending delta as the Analyst does (one cell per row); returns (delta, applied)."""
+    delta = store.read_delta(csv_path, immutable)
+    if delta is None:
+        return None, False
+    cells = []
+    for chunk in delta["frames"]:
+        for _, row in chunk.iterrows():
+            cells.append(("EMEA", "Enterprise", row["Date"].strftime("%Y-%m"), float(row["Deal_Size_USD"]), 1))
+    return delta, store.apply(delta, cells, [], len(cells))
+
+
+def total(store, csv_path):
+    return store.monthly_revenue(csv_path)["revenue"].sum()
+
+
+def test_a_partial_last_line_waits_for_its_newline(store, csv_path):
+    with open(csv_path, "w") as f:
+        f.write(HEADER + rows(3) + "4/1/25,EMEA,Client_3,100.0,Enterp")
+    ingest(store, csv_path)
+    assert store.watermark(csv_path)["row_count"] == 3
+
+    with open(csv_path, "a") as f:
+        f.write("rise,Sarah Chen\n" + rows(2, start=4))
+    delta, _ = ingest(store, csv_path)
+    assert not delta["reset"]
+    assert store.watermark(csv_path)["row_count"] == 6
+    assert total(store, csv_path) == pytest.approx(600.0)
+
+
+def test_an_immutable_file_counts_its_last_line_without_newline(store, csv_path):
+    with open(csv_path, "w") as f:
+        f.write(HEADER + rows(3).rstrip("\n"))
+    ingest(store, csv_path, immutable=True)
+    assert store.watermark(csv_path)["row_count"] == 3
+
+
+def test_a_rewritten_or_truncated_file_is_ingested_from_scratch(store, csv_path):
+    with open(csv_path, "w") as f:
+        f.write(HEADER + rows(5))
+    ingest(store, csv_path)
+
+    with open(csv_path, "w") as f:
+        f.write(HEADER + rows(2, amount=50.0))
+    delta, _ = ingest(store, csv_path)
+    assert delta["reset"]
+    assert store.watermark(csv_path)["row_count"] == 2
+    assert total(store, csv_path) == pytest.approx(100.0)
+
+    # Same size, different bytes before the watermark
+    with open(csv_path, "w") as f:
+        f.write(HEADER + rows(2, amount=70.0))
+    delta, _ = ingest(store, csv_path)
+    assert delta["reset"]
+    assert total(store, csv_path) == pytest.approx(140.0)
+
+
+def test_a_delta_read_twice_is_folded_once(store, csv_path):
+    with open(csv_path, "w") as f:
+        f.write(HEADER + rows(4))
+    first = store.read_delta(csv_path)
+    second = store.read_delta(csv_path)
+    cells = [("EMEA", "Enterprise", "2025-01", 400.0, 4)]
+    assert store.apply(first, cells, [], 4)
+    assert not store.apply(second, cells, [], 4)
+    assert total(store, csv_path) == pytest.approx(400.0)
+    assert store.watermark(csv_path)["row_count"] == 4
+    assert store.read_delta(csv_path) is None
+
+
+def test_incremental_engine_reads_every_row_of_an_upload(store, tmp_path):
+    from agents.analyst import detect_anomalies_incremental
+
+    sample = os.path.join(os.path.dirname(__file__), "..", "..", "data", "nexusflow_sales_2025_full.csv")
+    upload = str(tmp_path / "upload.csv")
+    with open(sample, "rb") as src, open(upload, "wb") as dst:
+        data = src.read()
+        dst.write(data.rstrip(b"\n"))  # Like the bundled sample: no newline after the last row
+    expected = data.rstrip(b"\n").count(b"\n")
+
+    detect_anomalies_incremental(upload, store, immutable=True)
+    assert store.watermark(upload)["row_count"] == expected
@@ -0,0 +1,23 @@
+import pytest
+from sandbox import SandboxPool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test-secret")
+    monkeypatch.setenv("TAVILY_API_KEY", "tvly-test-secret")
+    pool = SandboxPool(workers=1, timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_generated_code_cannot_read_the_servers_secrets(pool):
+    execution = pool.run("import os\nresult = {k: v for k, v in os.environ.items() if 'secret' in v or 'KEY' in k}")
+    assert execution["ok"], execution["error"]
+    assert execution["result"] == {}
+
+
+def test_worker_still_runs_pandas_code(pool):
+    execution = pool.run("result = int(pd.Series([1, 2, 3]).sum())")
+    assert execution["ok"], execution["error"]
+    assert execution["result"] == 6
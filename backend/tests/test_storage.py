@@ -0,0 +1,92 @@
+import json
+import pytest
+from storage import SignalStorage
+
+
+def signal(i: int, **fields):
+    return {
+        "signal_id": f"SIG-EMEA-ENTERPRISE-2025-{i:02d}",
+        "title": f"Signal {i}",
+        "severity": "critical" if i % 2 else "medium",
+        "status": "critical" if i % 2 else "medium",
+        "region": "EMEA" if i % 3 else "APAC",
+        "date": f"2025-01-{1 + i:02d}",
+        "evidence_csv": "Date,Deal_Size_USD\n1/1/25,100\n",
+        **fields
+    }
+
+
+@pytest.fixture
+def legacy_json(tmp_path):
+    path = tmp_path / "signals_history.json"
+    path.write_text(json.dumps({"signals": [
+        {"signal_id": "SIG-EMEA-202602021203-01", "title": "a", "last_updated": "2026-02-02T12:03:00"},
+        {"signal_id": "SIG-ENTERPRISE-202602021122-02", "title": "b", "last_updated": "2026-02-02T11:22:00"},
+        {"signal_id": "SIG-OVERALL-202602021122-01", "title": "c", "first_detected": "2026-01-01T00:00:00"},
+        {"title": "no id"},
+    ]}))
+    return str(path)
+
+
+def test_legacy_json_is_migrated_once(legacy_json):
+    storage = SignalStorage(legacy_json)
+    signals = {s["signal_id"]: s for s in storage.get_all_signals()}
+    assert len(signals) == 3
+    assert signals["SIG-EMEA-202602021203-01"]["last_updated"] == "2026-02-02T12:03:00"
+    assert signals["SIG-OVERALL-202602021122-01"]["first_detected"] == "2026-01-01T00:00:00"
+    revision = storage.get_revision()["revision"]
+
+    storage.clear_all()
+    reopened = SignalStorage(legacy_json)
+    assert reopened.get_all_signals() == []
+    assert reopened.get_revision()["revision"] > revision
+
+
+def test_legacy_ids_without_a_region_part_have_no_region(legacy_json):
+    storage = SignalStorage(legacy_json)
+    assert [s["signal_id"] for s in storage.query_signals(region=["emea"])["signals"]] == ["SIG-EMEA-202602021203-01"]
+    assert storage.query_signals(region=["ENTERPRISE"])["signals"] == []
+    assert storage.query_signals(region=["OVERALL"])["signals"] == []
+
+
+def test_cursor_pages_cover_every_signal_once(tmp_path):
+    storage = SignalStorage(str(tmp_path / "signals.db"))
+    storage.add_signals([signal(i) for i in range(23)])
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = storage.query_signals(limit=5, cursor=cursor)
+        seen += [s["signal_id"] for s in page["signals"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == 5
+    assert sorted(seen) == sorted(signal(i)["signal_id"] for i in range(23))
+    assert len(set(seen)) == 23
+
+
+def test_cursor_pages_are_stable_while_signals_arrive(tmp_path):
+    storage = SignalStorage(str(tmp_path / "signals.db"))
+    storage.add_signals([signal(i) for i in range(10)])
+    first = storage.query_signals(limit=4)
+    storage.add_signals([signal(i) for i in range(10, 14)])  # Newer than every listed signal
+    rest = storage.query_signals(limit=50, cursor=first["next_cursor"])
+    listed = [s["signal_id"] for s in first["signals"] + rest["signals"]]
+    assert sorted(listed) == sorted(signal(i)["signal_id"] for i in range(10))
+
+
+def test_filters_and_summary_fields(tmp_path):
+    storage = SignalStorage(str(tmp_path / "signals.db"))
+    storage.add_signals([signal(i) for i in range(12)])
+    page = storage.query_signals(severity=["CRITICAL"], region=["apac"], date_from="2025-01-04", include_evidence=False)
+    assert [s["signal_id"] for s in page["signals"]] == ["SIG-EMEA-ENTERPRISE-2025-09", "SIG-EMEA-ENTERPRISE-2025-03"]
+    assert all("evidence_csv" not in s for s in page["signals"])
+    assert "evidence_csv" in storage.query_signals(limit=1)["signals"][0]
+
+
+@pytest.mark.parametrize("cursor", ["@@@", "bm90LWEtY3Vyc29y"])
+def test_an_invalid_cursor_raises_value_error(tmp_path, cursor):
+    storage = SignalStorage(str(tmp_path / "signals.db"))
+    with pytest.raises(ValueError):
+        storage.query_signals(cursor=cursor)
@@ -0,0 +1,93 @@
+import io
+import json
+import time
+import pytest
+from uploads import BacklogJsonValidator, SalesCsvValidator, UploadRejected, store_upload
+
+HEADER = "Date,Region,Account_Name,Deal_Size_USD,Product_Tier,Sales_Rep\n"
+
+
+def validate(validator_class, data: bytes, chunk: int = 7):
+    """Feeds the data in small chunks, so records and items straddle chunk boundaries."""
+    validator = validator_class()
+    for start in range(0, len(data), chunk):
+        validator.feed(data[start:start + chunk])
+    validator.close()
+    return validator
+
+
+def test_sales_csv_accepts_quoted_fields_across_chunks():
+    data = HEADER + '1/1/25,EMEA,"Client, ""A""\nLtd",100.5,Enterprise,Sarah Chen\n1/2/25,NA,B, 200 ,SMB,Sam\n'
+    assert validate(SalesCsvValidator, data.encode()).rows == 2
+
+
+@pytest.mark.parametrize("row", [
+    '1/1/25,EMEA,"Client "A",100,Enterprise,Sarah Chen',  # Stray quote inside a quoted field
+    '1/1/25,EMEA,"Client A,100,Enterprise,Sarah Chen',  # Unterminated quoted field
+    '1/1/25,EMEA,Client A,100,Enterprise',  # Missing field
+])
+def test_sales_csv_rejects_malformed_rows(row):
+    with pytest.raises(UploadRejected, match="row 1"):
+        validate(SalesCsvValidator, (HEADER + row + "\n").encode())
+
+
+@pytest.mark.parametrize("amount", ["$1,234", "N/A", "twelve", "nan"])
+def test_sales_csv_rejects_amounts_ingestion_cannot_parse(amount):
+    data = HEADER + "1/1/25,EMEA,A,100,Enterprise,Sam\n" + f'1/2/25,EMEA,B,"{amount}",Enterprise,Sam\n'
+    with pytest.raises(UploadRejected, match=r"row 2 has a non-numeric Deal_Size_USD"):
+        validate(SalesCsvValidator, data.encode())
+
+
+def test_sales_csv_stray_quote_is_rejected_quickly():
+    row = "1/1/25,EMEA,Client,100,Enterprise,Sam\n"
+    data = (HEADER + '1/1/25,EMEA,"Client,100,Enterprise,Sam\n' + row * 200_000).encode()
+    started = time.perf_counter()
+    with pytest.raises(UploadRejected, match="exceeds"):
+        validate(SalesCsvValidator, data, chunk=1024 * 1024)
+    assert time.perf_counter() - started < 2
+
+
+def backlog(count: int) -> bytes:
+    items = [{"id": f"ENG-{i}", "title": f"Item {i}", "impact_usd": 1000 * i, "complexity_points": 3} for i in range(count)]
+    return json.dumps(items, indent=2).encode()
+
+
+def test_backlog_json_is_validated_item_by_item():
+    assert validate(BacklogJsonValidator, backlog(25)).items == 25
+    assert validate(BacklogJsonValidator, b' [ {"id": "A", "title": "t", "impact_usd": 1e3} ] \n', chunk=1).items == 1
+
+
+@pytest.mark.parametrize("data, message", [
+    (b'{"id": "A", "title": "t"}', "expected a JSON array"),
+    (b'[{"id": "A", "title": "t"}', "not closed"),
+    (b'[{"id": "A", "title": "t"},]', "invalid JSON"),
+    (b'[{"id": "A", "title": "t"} {"id": "B"}]', "expected ','"),
+    (b'[{"id": "A", "title": "t"}] []', "extra data"),
+    (b'[{"id": "A", "title": "t", "impact_usd": "1000"}]', "non-numeric impact_usd"),
+    (b'[{"id": "A"}]', "missing title"),
+    (b'[]', "no backlog items"),
+])
+def test_backlog_json_rejects_invalid_documents(data, message):
+    with pytest.raises(UploadRejected, match=message):
+        validate(BacklogJsonValidator, data)
+
+
+def test_backlog_json_buffers_one_item_at_a_time():
+    huge = b'[{"id": "A", "title": "' + b"x" * (2 * 1024 * 1024) + b'"}]'
+    with pytest.raises(UploadRejected, match="exceeds"):
+        validate(BacklogJsonValidator, huge, chunk=64 * 1024)
+
+    validator = BacklogJsonValidator()
+    data = backlog(2000)
+    for start in range(0, len(data), 4096):
+        validator.feed(data[start:start + 4096])
+        assert len(validator._buffer) < 4096 + 200
+    validator.close()
+    assert validator.items == 2000
+
+
+def test_store_upload_enforces_the_size_limit(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_MAX_MB", "0.001")
+    with pytest.raises(UploadRejected, match="upload limit"):
+        store_upload(io.BytesIO(backlog(50)), "backlog", "backlog.json", str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,293 @@
+import codecs
+import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Any, BinaryIO, Dict, List, Optional
+import pandas as pd
+from sales_data import REQUIRED_SALES_COLUMNS, FLOAT_COLUMNS, canonical_columns, parse_amounts
+from llm_cache import remember_digest
+
+CHUNK_BYTES = 1024 * 1024
+DEFAULT_MAX_MB = 512
+MAX_CSV_RECORD_CHARS = 64 * 1024  # Longest sales CSV record (a stray quote otherwise swallows the rest of the file)
+MAX_BACKLOG_ITEM_CHARS = 1024 * 1024  # Longest backlog item (only the item being parsed is kept in memory)
+UPLOAD_EXTENSIONS = {"sales": ".csv", "context": ".txt", "backlog": ".json"}
+
+
+class UploadRejected(ValueError):
+    """An uploaded file is too large or does not match its expected format."""
+
+
+def get_max_upload_bytes() -> int:
+    """Per-file upload limit (UPLOAD_MAX_MB)."""
+    try:
+        return int(float(os.getenv("UPLOAD_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_MAX_MB * 1024 * 1024
+
+
+def sanitize_filename(filename: str, default: str = "upload") -> str:
+    """Client filename reduced to a safe basename (no directories, no unusual characters)."""
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', name).lstrip('.')
+    return name[:128] or default
+
+
+class TextValidator:
+    """UTF-8 text, decoded incrementally; subclasses check the text as complete lines arrive."""
+
+    label = "context"
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.chars = 0
+
+    def feed(self, data: bytes):
+        self.on_text(self._decode(data))
+
+    def close(self):
+        self.on_text(self._decode(b"", final=True))
+        self.on_close()
+
+    def _decode(self, data: bytes, final: bool = False) -> str:
+        try:
+            text = self._decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            raise UploadRejected(f"{self.label}: not UTF-8 text ({e.reason} at byte {e.start})")
+        self.chars += len(text.strip())
+        return text
+
+    def on_text(self, text: str):
+        pass
+
+    def on_close(self):
+        if not self.chars:
+            raise UploadRejected(f"{self.label}: file is empty")
+
+
+class SalesCsvValidator(TextValidator):
+    """
+    Sales CSV checks while streaming: the header has the required columns (after mapping
+    column name variations), every row has the header's field count and amounts are numeric.
+    """
+
+    label = "sales"
+
+    def __init__(self):
+        super().__init__()
+        self._pending = ""  # Last line of the text so far, until its newline arrives
+        self._record: List[str] = []  # Lines of a record whose quoted field is still open
+        self._record_chars = 0
+        self._quoted = False
+        self.columns: Optional[List[str]] = None
+        self._numeric: List[int] = []
+        self.rows = 0
+
+    def on_text(self, text: str):
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        records = []
+        # Each line is scanned once: its quote count flips the open/closed state of the current record
+        for line in lines:
+            self._record.append(line)
+            self._record_chars += len(line) + 1
+            if line.count('"') % 2:
+                self._quoted = not self._quoted
+            if not self._quoted:
+                records.append("\n".join(self._record))
+                self._record, self._record_chars = [], 0
+        if self._record_chars + len(self._pending) > MAX_CSV_RECORD_CHARS:
+            raise UploadRejected(
+                f"sales: row {self.rows + len(records) + 1} exceeds {MAX_CSV_RECORD_CHARS // 1024} KB "
+                f"(unterminated quoted field?)"
+            )
+        self._check(records)
+
+    def on_close(self):
+        if self._pending or self._record:
+            if self._quoted ^ (self._pending.count('"') % 2 == 1):
+                raise UploadRejected(f"sales: row {self.rows + 1} has an unterminated quoted field")
+            self._check(["\n".join(self._record + [self._pending])])
+        if self.columns is None:
+            raise UploadRejected("sales: file is empty")
+        if not self.rows:
+            raise UploadRejected("sales: no data rows")
+
+    def _check(self, lines: List[str]):
+        reader = csv.reader(lines)
+        amounts = []  # (row, column position, text) of the non-empty amounts of these records
+        while True:
+            try:
+                record = next(reader, None)
+            except csv.Error as e:
+                self._check_amounts(amounts)
+                raise UploadRejected(f"sales: row {self.rows + 1} is not valid CSV ({e})")
+            if record is None:
+                break
+            if not record or record == [""]:
+                continue
+            if self.columns is None:
+                self._header(record)
+                continue
+            self.rows += 1
+            if len(record) != len(self.columns):
+                self._check_amounts(amounts)
+                raise UploadRejected(
+                    f"sales: row {self.rows} has {len(record)} fields, the header has {len(self.columns)}"
+                )
+            amounts.extend((self.rows, p, record[p]) for p in self._numeric if record[p].strip())
+        self._check_amounts(amounts)
+
+    def _check_amounts(self, amounts: List[tuple]):
+        """Amounts must parse the way ingestion parses them (sales_data.parse_amounts), else NaN revenue."""
+        if not amounts:
+            return
+        parsed = parse_amounts(pd.Series([text for _, _, text in amounts], dtype=object))
+        invalid = parsed.isna().to_numpy().nonzero()[0]
+        if len(invalid):
+            row, position, text = amounts[invalid[0]]
+            raise UploadRejected(f"sales: row {row} has a non-numeric {self.columns[position]} ({text!r})")
+
+    def _header(self, record: List[str]):
+        self.columns = canonical_columns([c.strip() for c in record])
+        missing = [c for c in REQUIRED_SALES_COLUMNS if c not in self.columns]
+        if missing:
+            raise UploadRejected(f"sales: missing required column(s) {', '.join(missing)}")
+        self._numeric = [i for i, c in enumerate(self.columns) if c in FLOAT_COLUMNS]
+
+
+class BacklogJsonValidator(TextValidator):
+    """
+    Backlog JSON checks while streaming: a top-level array of items, each decoded and checked as soon as
+    it completes. Only the item being parsed is buffered (up to MAX_BACKLOG_ITEM_CHARS).
+    """
+
+    label = "backlog"
+    required = ("id", "title")
+    numeric = ("impact_usd", "complexity_points")
+    _json = json.JSONDecoder()
+    _whitespace = re.compile(r"\s*")
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = ""
+        self._expect = "array"  # array -> item or end -> separator -> item ... -> done
+        self.items = 0
+
+    def on_text(self, text: str):
+        self._buffer += text
+        self._scan(final=False)
+
+    def on_close(self):
+        super().on_close()
+        self._scan(final=True)
+        if self._expect != "done":
+            raise UploadRejected("backlog: invalid JSON (the array is not closed)")
+        if not self.items:
+            raise UploadRejected("backlog: no backlog items")
+
+    def _scan(self, final: bool):
+        buffer = self._buffer
+        position = 0
+        while True:
+            position = self._whitespace.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if self._expect == "array":
+                if char != "[":
+                    raise UploadRejected("backlog: expected a JSON array of backlog items")
+                self._expect = "item or end"
+                position += 1
+            elif self._expect in ("item", "item or end"):
+                if char == "]" and self._expect == "item or end":
+                    self._expect = "done"
+                    position += 1
+                    continue
+                try:
+                    item, end = self._json.raw_decode(buffer, position)
+                except ValueError as e:
+                    if final:
+                        raise UploadRejected(f"backlog: invalid JSON ({e})")
+                    if len(buffer) - position > MAX_BACKLOG_ITEM_CHARS:
+                        raise UploadRejected(
+                            f"backlog: item {self.items} is not valid JSON or exceeds {MAX_BACKLOG_ITEM_CHARS // 1024} KB"
+                        )
+                    break  # The item continues in the next chunk
+                if end == len(buffer) and not final:
+                    break  # A number at the end of the text may still continue
+                self._check(self.items, item)
+                self._expect = "separator"
+                position = end
+            elif self._expect == "separator":
+                if char not in ",]":
+                    raise UploadRejected(f"backlog: invalid JSON (expected ',' or ']' after item {self.items - 1})")
+                self._expect = "item" if char == "," else "done"
+                position += 1
+            else:
+                raise UploadRejected("backlog: invalid JSON (extra data after the array)")
+        self._buffer = buffer[position:]
+
+    def _check(self, index: int, item: Any):
+        self.items += 1
+        if not isinstance(item, dict):
+            raise UploadRejected(f"backlog: item {index} is not an object")
+        missing = [f for f in self.required if not item.get(f)]
+        if missing:
+            raise UploadRejected(f"backlog: item {index} is missing {', '.join(missing)}")
+        for field in self.numeric:
+            value = item.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise UploadRejected(f"backlog: item {index} ({item['id']}) has a non-numeric {field}")
+
+
+VALIDATORS = {"sales": SalesCsvValidator, "context": TextValidator, "backlog": BacklogJsonValidator}
+
+
+def store_upload(source: BinaryIO, kind: str, filename: str, upload_dir: str) -> Dict[str, Any]:
+    """
+    Streams an uploaded file into content-addressed storage, chunk by chunk:
+    size limit, SHA-256 and format validation are applied while copying to a temp file,
+    which is then moved to <upload_dir>/<kind>-<digest><ext>. Identical content is a no-op.
+    Raises UploadRejected (the temp file is removed).
+    """
+    limit = get_max_upload_bytes()
+    validator = VALIDATORS[kind]()
+    digest = hashlib.sha256()
+    size = 0
+    os.makedirs(upload_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, prefix=f".{kind}-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            for chunk in iter(lambda: source.read(CHUNK_BYTES), b""):
+                size += len(chunk)
+                if size > limit:
+                    raise UploadRejected(f"{kind}: file exceeds the {limit / (1024 * 1024):g} MB upload limit")
+                digest.update(chunk)
+                validator.feed(chunk)
+                tmp.write(chunk)
+        validator.close()
+
+        sha256 = digest.hexdigest()
+        path = os.path.join(upload_dir, f"{kind}-{sha256[:32]}{UPLOAD_EXTENSIONS[kind]}")
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        # Caches keyed on file content reuse this hash instead of reading the file again
+        remember_digest(path, sha256)
+        return {
+            "path": path,
+            "sha256": sha256,
+            "bytes": size,
+            "deduplicated": deduplicated,
+            "original_filename": sanitize_filename(filename, f"{kind}{UPLOAD_EXTENSIONS[kind]}")
+        }
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
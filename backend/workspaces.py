@@ -0,0 +1,104 @@
+import os
+import re
+import threading
+from typing import Dict, List
+from llm_cache import DEFAULT_WORKSPACE, env_path
+from storage import SignalStorage
+
+WORKSPACE_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+
+class InvalidWorkspaceError(ValueError):
+    """A malformed workspace ID, or a file path that points outside its workspace."""
+
+
+class UnknownWorkspaceError(LookupError):
+    """A workspace that has not been created yet (it is created by its first upload)."""
+
+
+def _inside(path: str, directory: str) -> bool:
+    return path == directory or path.startswith(directory + os.sep)
+
+
+class Workspace:
+    """
+    One tenant's dataset workspace.
+    - data_dir: its audit inputs (uploads land in data_dir/uploads); files are named relative to it.
+    - storage: its own signal history.
+    - Caches and indexes (LLM, node cache, checkpoints, aggregates, views) live under
+      llm_cache.workspace_cache_path(<id>, ...).
+    """
+
+    def __init__(self, workspace_id: str, data_dir: str, excluded_dirs: List[str] = ()):
+        self.id = workspace_id
+        self.data_dir = os.path.abspath(data_dir)
+        self.upload_dir = os.path.join(self.data_dir, "uploads")
+        self._excluded = [os.path.abspath(d) for d in excluded_dirs]
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.storage = SignalStorage(os.path.join(self.data_dir, "signals_history.json"), workspace_id)
+
+    def resolve(self, filename: str) -> str:
+        """Absolute path of a file named relative to the workspace (e.g. a filename returned by /api/upload)."""
+        path = os.path.abspath(os.path.join(self.data_dir, filename))
+        if not _inside(path, self.data_dir) or any(_inside(path, d) for d in self._excluded):
+            raise InvalidWorkspaceError(f"{filename} is outside workspace {self.id}")
+        return path
+
+    def relative(self, path: str) -> str:
+        return os.path.relpath(path, self.data_dir)
+
+    def is_upload(self, path: str) -> bool:
+        """Uploads are content-addressed, so they never change after they are stored."""
+        return _inside(os.path.abspath(path), self.upload_dir)
+
+
+class WorkspaceManager:
+    """
+    Registry of dataset workspaces.
+    - "default" keeps the original single-tenant layout (DATA_DIR, backend/.cache and the *_PATH settings).
+    - Any other ID gets WORKSPACES_DIR/<id> for its data and WORKSPACE_CACHE_DIR/<id> for its caches;
+      it is created by its first upload, other endpoints answer 404 until then.
+    """
+
+    def __init__(self, data_dir: str, workspaces_dir: str = None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.workspaces_dir = os.path.abspath(
+            workspaces_dir or env_path("WORKSPACES_DIR", os.path.join(self.data_dir, "workspaces"))
+        )
+        self._workspaces: Dict[str, Workspace] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def validate_id(workspace_id: str = None) -> str:
+        """Normalized workspace ID (lowercase letters, digits, '-' and '_'); None means the default workspace."""
+        workspace_id = (workspace_id or DEFAULT_WORKSPACE).strip().lower()
+        if not WORKSPACE_ID.match(workspace_id):
+            raise InvalidWorkspaceError(
+                f"Invalid workspace '{workspace_id}': use up to 64 lowercase letters, digits, '-' or '_'"
+            )
+        return workspace_id
+
+    def get(self, workspace_id: str = None, create: bool = False) -> Workspace:
+        workspace_id = self.validate_id(workspace_id)
+        with self._lock:
+            if workspace_id not in self._workspaces:
+                if workspace_id == DEFAULT_WORKSPACE:
+                    # Other workspaces may live inside DATA_DIR: keep them out of the default one
+                    workspace = Workspace(workspace_id, self.data_dir, excluded_dirs=[self.workspaces_dir])
+                else:
+                    data_dir = os.path.join(self.workspaces_dir, workspace_id)
+                    if not create and not os.path.isdir(data_dir):
+                        raise UnknownWorkspaceError(f"Workspace {workspace_id} not found")
+                    workspace = Workspace(workspace_id, data_dir)
+                self._workspaces[workspace_id] = workspace
+            return self._workspaces[workspace_id]
+
+    def list(self) -> List[str]:
+        found = []
+        if os.path.isdir(self.workspaces_dir):
+            found = sorted(
+                name for name in os.listdir(self.workspaces_dir)
+                if WORKSPACE_ID.match(name) and name != DEFAULT_WORKSPACE
+                and os.path.isdir(os.path.join(self.workspaces_dir, name))
+            )
+        return [DEFAULT_WORKSPACE] + found
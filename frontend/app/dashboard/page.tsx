@@ -18,6 +18,18 @@ import {
 } from "lucide-react";
 import { motion, AnimatePresence } from "framer-motion";
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+const PAGE_SIZE = 50;
+
+// One page of the signal list, without the evidence blobs (the detail page fetches those)
+const fetchSignalPage = async (cursor: string | null, headers: Record<string, string> = {}) => {
+    const params = new URLSearchParams({ fields: 'summary', limit: String(PAGE_SIZE) });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    return fetch(`${API_URL}/api/signals?${params}`, { cache: 'no-store', headers });
+};
+
 export default function Dashboard() {
     const [gatheringSignals, setGatheringSignals] = useState(false);
     const [allSignals, setAllSignals] = useState<any[]>([]);
@@ -28,6 +40,8 @@ export default function Dashboard() {
     const [showNoMoreSignals, setShowNoMoreSignals] = useState(false);
     const [showNewTags, setShowNewTags] = useState(false);
     const [isHovered, setIsHovered] = useState(false);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const promptTimerRef = useRef<NodeJS.Timeout | null>(null);
 
     // Check for new tag visibility on mount/update
@@ -83,11 +97,33 @@ export default function Dashboard() {
 
     // Load all signals from backend on mount
     useEffect(() => {
+        // First page, as a conditional GET: the backend answers 304 when the signal store hasn't changed
+        const fetchSignals = async () => {
+            const etag = sessionStorage.getItem('signalsEtag');
+            const cached = sessionStorage.getItem('allSignals');
+            const response = await fetchSignalPage(null, etag && cached ? { 'If-None-Match': etag } : {});
+            if (response.status === 304) {
+                return null;
+            }
+            const newEtag = response.headers.get('ETag');
+            if (newEtag) {
+                sessionStorage.setItem('signalsEtag', newEtag);
+            }
+            const data = await response.json();
+            if (data.status === 'success') {
+                setNextCursor(data.next_cursor);
+                sessionStorage.setItem('signalsNextCursor', data.next_cursor || '');
+            }
+            return data;
+        };
+
         const loadAllSignals = async () => {
             try {
-                const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
-                const response = await fetch(`${API_URL}/api/signals`);
-                const data = await response.json();
+                let data = await fetchSignals();
+                if (data === null) {
+                    data = { status: 'success', signals: JSON.parse(sessionStorage.getItem('allSignals') || '[]') };
+                    setNextCursor(sessionStorage.getItem('signalsNextCursor') || null);
+                }
 
                 if (data.status === 'success' && data.signals.length > 0) {
                     setAllSignals(data.signals);
@@ -123,14 +159,56 @@ export default function Dashboard() {
 
         loadAllSignals();
 
+        // Poll for newly stored signals (cheap 304s while nothing changes); a change reloads from the first page
+        const pollInterval = setInterval(async () => {
+            try {
+                const data = await fetchSignals();
+                if (data && data.status === 'success') {
+                    setAllSignals(data.signals);
+                    sessionStorage.setItem('allSignals', JSON.stringify(data.signals));
+                    if (sessionStorage.getItem('hasScanned') === 'true') {
+                        setVisibleSignals(data.signals);
+                    }
+                }
+            } catch (error) {
+                console.error("Failed to poll signals", error);
+            }
+        }, 30000);
+
         // Cleanup timer on unmount
         return () => {
+            clearInterval(pollInterval);
             if (promptTimerRef.current) {
                 clearTimeout(promptTimerRef.current);
             }
         };
     }, []);
 
+    // Next page of older signals (after a scan, they are shown right away)
+    const loadMoreSignals = async () => {
+        if (!nextCursor || loadingMore) {
+            return;
+        }
+        setLoadingMore(true);
+        try {
+            const data = await (await fetchSignalPage(nextCursor)).json();
+            if (data.status === 'success') {
+                const signals = [...allSignals, ...data.signals];
+                setAllSignals(signals);
+                if (hasScanned) {
+                    setVisibleSignals(signals);
+                }
+                setNextCursor(data.next_cursor);
+                sessionStorage.setItem('allSignals', JSON.stringify(signals));
+                sessionStorage.setItem('signalsNextCursor', data.next_cursor || '');
+            }
+        } catch (error) {
+            console.error("Failed to load more signals", error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     // Simulate agent scan with theatrical logs
     const runTheatricalScan = async () => {
         // If already showing all signals, show "no more signals" message
@@ -301,6 +379,20 @@ export default function Dashboard() {
                         </div>
                     </AnimatePresence>
 
+                    {/* Older signals, one page at a time */}
+                    {hasScanned && nextCursor && !gatheringSignals && (
+                        <div className="flex justify-center mt-6">
+                            <button
+                                onClick={loadMoreSignals}
+                                disabled={loadingMore}
+                                className="px-4 py-2 rounded-lg border border-slate-200 bg-white text-sm font-medium text-slate-600 hover:bg-slate-50 transition-colors flex items-center gap-2 disabled:opacity-60"
+                            >
+                                {loadingMore && <Loader2 className="animate-spin" size={14} />}
+                                Load more signals
+                            </button>
+                        </div>
+                    )}
+
                     {/* Empty State Fallback */}
                     {visibleSignals.length === 0 && !gatheringSignals && (
                         <div className="text-center py-20 text-slate-400">
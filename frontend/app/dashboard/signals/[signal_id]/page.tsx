@@ -23,9 +23,11 @@ import {
     ChevronUp
 } from "lucide-react";
 import ReactMarkdown from 'react-markdown';
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { EvidenceTrail } from '@/components/EvidenceTrail';
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
 // Mock signal data (will be replaced with actual data fetching)
 const mockSignals = [
     {
@@ -86,10 +88,33 @@ export default function SignalDetailPage() {
     const params = useParams();
     const router = useRouter();
     const signalId = params.signal_id as string;
+    const [storedSignal, setStoredSignal] = useState<any>(null);
+    const [loading, setLoading] = useState(true);
+
+    // The dashboard only lists signal summaries: the full signal (with its evidence) is fetched on open
+    useEffect(() => {
+        let cancelled = false;
+        fetch(`${API_URL}/api/signals/${encodeURIComponent(signalId)}`, { cache: 'no-store' })
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (!cancelled && data?.status === 'success') {
+                    setStoredSignal(data.signal);
+                }
+            })
+            .catch(error => console.error("Failed to load signal", error))
+            .finally(() => {
+                if (!cancelled) {
+                    setLoading(false);
+                }
+            });
+        return () => {
+            cancelled = true;
+        };
+    }, [signalId]);
 
-    // Try to find signal in sessionStorage first (for backend-generated signals)
-    let signal = null;
-    if (typeof window !== 'undefined') {
+    // Until it arrives, show the summary listed on the dashboard (kept in sessionStorage)
+    let signal = storedSignal;
+    if (!signal && typeof window !== 'undefined') {
         const storedSignals = sessionStorage.getItem('allSignals');
         if (storedSignals) {
             const allSignals = JSON.parse(storedSignals);
@@ -97,11 +122,19 @@ export default function SignalDetailPage() {
         }
     }
 
-    // Fallback to mock signals if not found in sessionStorage
+    // Fallback to mock signals if not found in the backend
     if (!signal) {
         signal = mockSignals.find(s => s.signal_id === signalId);
     }
 
+    if (!signal && loading) {
+        return (
+            <div className="min-h-screen bg-gray-50 flex items-center justify-center">
+                <p className="text-gray-600">Loading signal...</p>
+            </div>
+        );
+    }
+
     if (!signal) {
         return (
             <div className="min-h-screen bg-gray-50 flex items-center justify-center">